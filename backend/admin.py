@@ -0,0 +1,40 @@
+import os
+import secrets
+
+from storage import data_path
+
+
+# === TOKEN DE ADMINISTRACION ===
+# Protege las funciones de diagnostico (perfilado...). Se toma de ADMIN_TOKEN
+# o, si no esta definido, de un token aleatorio generado una vez y guardado
+# en DATA_DIR/admin_token (solo legible por el usuario local).
+
+TOKEN_FILE = "admin_token"
+
+_token = None
+
+
+def admin_token():
+    global _token
+    if _token is None:
+        token = os.getenv("ADMIN_TOKEN", "").strip()
+        if not token:
+            path = data_path(TOKEN_FILE)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    token = f.read().strip()
+            except OSError:
+                token = ""
+            if not token:
+                token = secrets.token_urlsafe(24)
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(token)
+        _token = token
+    return _token
+
+
+def is_admin(request):
+    """True si la peticion trae el token (cabecera X-Admin-Token o ?admin_token=)."""
+    supplied = request.headers.get("x-admin-token") or request.query_params.get("admin_token") or ""
+    return bool(supplied) and secrets.compare_digest(supplied.encode(), admin_token().encode())
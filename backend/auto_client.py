@@ -0,0 +1,114 @@
+import os
+
+from engines import EngineProvider, get_engine, load_engine, register_engine
+from logs import get_logger
+from metrics import ROUTE_DECISIONS
+from routing import router
+
+log = get_logger("auto", engine="auto")
+
+# === MOTOR "AUTO" ===
+# No tiene transporte propio: cada intento se delega en un (motor, modelo)
+# real segun el plan que ordena routing.router al crear la peticion. Dentro
+# de un mismo destino se respetan los reintentos y esperas del motor (p.ej.
+# la llave backup de Gemini); al cambiar de destino no se espera.
+
+ROUTE_ENGINES = [name.strip() for name in os.getenv("ROUTE_ENGINES", "gemini,groq,ollama").split(",") if name.strip()]
+ROUTE_ATTEMPTS_PER_MODEL = int(os.getenv("ROUTE_ATTEMPTS_PER_MODEL", "2"))
+ROUTE_MAX_ATTEMPTS = int(os.getenv("ROUTE_MAX_ATTEMPTS", "6"))
+
+# Se importan aqui (en el hilo de load_engine) para no bloquear el bucle al crear el plan
+for _name in ROUTE_ENGINES:
+    load_engine(_name)
+
+
+@register_engine("auto")
+class AutoEngine(EngineProvider):
+    """Enruta cada intento al motor/modelo sano con menor tiempo esperado."""
+
+    display_name = "Auto"
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.providers = {}
+        for name in ROUTE_ENGINES:
+            provider = get_engine(name, model_name=options.get("ollama_model") if name == "ollama" else None)
+            if provider.name == name and not provider.check_ready():
+                self.providers[name] = provider
+        self.plan = self._build_plan()
+        self.max_retries = len(self.plan)
+
+    def _build_plan(self):
+        """[(proveedor, intento del proveedor)], agrupados por destino y ordenados por el router."""
+        groups = {}
+        for provider in self.providers.values():
+            for attempt in range(provider.max_retries):
+                model, _ = provider.attempt_target(attempt)
+                steps = groups.setdefault((provider.name, model), [])
+                if len(steps) < ROUTE_ATTEMPTS_PER_MODEL:
+                    steps.append((provider, attempt))
+        ranked = router.rank(list(groups))
+        # Primero el mejor destino sano de cada motor y luego el resto: si un
+        # proveedor entero cae, el fallback llega a otro motor antes de agotar
+        # los intentos en sus modelos secundarios
+        leaders, engines = [], set()
+        for engine, model in ranked:
+            if engine not in engines and router.stats(engine, model).healthy():
+                engines.add(engine)
+                leaders.append((engine, model))
+        targets = leaders + [target for target in ranked if target not in leaders]
+        plan = [step for target in targets for step in groups[target]]
+        return plan[:ROUTE_MAX_ATTEMPTS]
+
+    def provider(self, attempt):
+        return self._step(attempt)[0] if self.plan else self
+
+    def _step(self, attempt):
+        return self.plan[min(attempt, len(self.plan) - 1)]
+
+    def engine_names(self):
+        return list(self.providers)
+
+    def downshift(self):
+        """Baja de modelo en todos los motores del plan que tengan uno barato."""
+        self.downshifted = any([provider.downshift() for provider in self.providers.values()])
+        return self.downshifted
+
+    def check_ready(self):
+        if not self.plan:
+            return "Ningun motor disponible para el modo automatico. Revisa las claves en .env"
+        return None
+
+    def start_logs(self, num_questions, difficulty):
+        provider, attempt = self.plan[0]
+        model, _ = provider.attempt_target(attempt)
+        ROUTE_DECISIONS.inc(engine=provider.name, model=model, mode=self.options.get("mode") or "")
+        targets = []
+        for step_provider, step_attempt in self.plan:
+            target = (step_provider.name, step_provider.attempt_target(step_attempt)[0])
+            if target not in targets:
+                targets.append(target)
+        route = " -> ".join(f"{engine}/{model or '-'} ({router.describe(engine, model)})" for engine, model in targets)
+        log.info("Plan de enrutado", targets=[f"{engine}/{model}" for engine, model in targets])
+        return [
+            f"[INICIO] {num_questions} preguntas | Dificultad: {difficulty} | Motor: Auto",
+            f"[ROUTER] Plan: {route}",
+        ]
+
+    def attempt_target(self, attempt):
+        provider, sub_attempt = self._step(attempt)
+        return provider.attempt_target(sub_attempt)
+
+    async def complete(self, prompt, model, attempt):
+        provider, sub_attempt = self._step(attempt)
+        return await provider.complete(prompt, model, sub_attempt)
+
+    def retry_delay(self, attempt, error):
+        provider, sub_attempt = self._step(attempt)
+        if attempt + 1 < len(self.plan):
+            next_provider, next_attempt = self.plan[attempt + 1]
+            same_target = (next_provider is provider and
+                           next_provider.attempt_target(next_attempt)[0] == provider.attempt_target(sub_attempt)[0])
+            if not same_target:
+                return 0, ""
+        return provider.retry_delay(sub_attempt, error)
@@ -0,0 +1,392 @@
+import asyncio
+import glob
+import io
+import json
+import os
+import random
+import re
+import time
+import zipfile
+
+import numpy as np
+
+from budget import pack_context
+from condense import CONDENSE_MODES, cached_document, condense_document, local_document
+from contexts import context_store
+from coverage import Document, coverage_store
+from dedup import RecentQuestions, find_duplicates, question_text, vectorize
+from engines import ENGINE_MODULES, generate_exam_streaming, get_engine
+from jobs import DONE, ERROR, INTERRUPTED, job_store
+from logs import get_logger
+from metrics import BATCH_EXAMS, BUDGET_EVENTS
+from scheduler import MAX_QUEUED_PER_CLIENT, EngineSlot, Overloaded, scheduler
+from tracing import Trace
+from usage import BUDGET_ACTION, usage_ledger
+
+log = get_logger("batch")
+
+
+# === LOTES DE EXAMENES ===
+# POST /batches genera de una vez varios examenes: N variantes de una misma
+# especificacion o una lista de especificaciones (p.ej. 20 simulacros
+# distintos para una promocion). Frente a N llamadas a /generate-exam:
+#   - la ingesta es comun: cada carpeta se lee (y condensa) una sola vez,
+#     el fichero subido se extrae una vez y la ficha del motor se hace una
+#     vez por documento
+#   - los temas de la carpeta se reparten en rotacion en lugar de sortearse
+#     en cada examen, y en simulacro cada uso de un tema toma el tramo
+#     siguiente del documento
+#   - las variantes corren a la vez, tantas como admite el motor, con
+#     prioridad "background" en el scheduler (lo interactivo pasa antes)
+#   - la deduplicacion usa un historial del lote en memoria: cada variante
+#     descarta y repone las preguntas que ya tiene otra variante terminada
+# El lote es un trabajo de jobs.py (progreso en /jobs/{id}/events) y el
+# resultado se descarga con GET /batches/{id}/archive: un zip con un JSON
+# por examen y un manifest.json.
+
+BATCH_MAX_EXAMS = int(os.getenv("BATCH_MAX_EXAMS", "50"))
+# Variantes simultaneas por motor (0 = el limite de concurrencia del motor)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "0"))
+# Espera maxima antes de reintentar entrar en una cola llena
+BATCH_RETRY_SECONDS = 30.0
+BATCH_MODES = ("manual", "random_1", "simulacro_3")
+SIMULACRO_TOPICS = 3
+FRAGMENT_TOKENS = 750
+TOPIC_EXTENSIONS = ("*.md", "*.txt", "*.pdf")
+SPEC_DEFAULTS = {
+    "num_questions": 10, "difficulty": "Intermedio", "topic": None, "mode": "manual", "directory_path": None,
+    "context_id": None, "ai_engine": "gemini", "ollama_model": None, "condense": "off",
+}
+# Logs de cada variante que se reenvian al progreso del lote (el resto es ruido con 20 a la vez)
+FORWARDED_LOGS = ("[ERROR]", "[DEDUP]", "[PRESUPUESTO]", "[FICHA]")
+
+
+def parse_specs(raw):
+    """
+    Campo `spec` del formulario (JSON) -> lista de especificaciones, una por
+    examen. Acepta {"exam": {...}, "variants": N} o {"exams": [{...}, ...]}
+    (cada una con "variants" opcional). ValueError si no es valido.
+    """
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"spec no es JSON valido: {e}")
+    if not isinstance(data, dict):
+        raise ValueError('spec debe ser un objeto con "exam" o "exams"')
+    if "exams" in data:
+        items = data["exams"]
+    elif "exam" in data:
+        items = [{**data["exam"], "variants": data.get("variants", data["exam"].get("variants", 1))}]
+    else:
+        raise ValueError('spec debe incluir "exam" (con "variants") o "exams"')
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError('"exams" debe ser una lista de objetos')
+
+    specs = []
+    for item in items:
+        unknown = set(item) - set(SPEC_DEFAULTS) - {"variants"}
+        if unknown:
+            raise ValueError(f"Campos desconocidos: {', '.join(sorted(unknown))}")
+        spec = {**SPEC_DEFAULTS, **{k: v for k, v in item.items() if k != "variants"}}
+        try:
+            variants = int(item.get("variants", 1))
+            spec["num_questions"] = int(spec["num_questions"])
+        except (TypeError, ValueError):
+            raise ValueError("variants y num_questions deben ser enteros")
+        if variants < 1 or spec["num_questions"] < 1:
+            raise ValueError("variants y num_questions deben ser positivos")
+        if spec["mode"] not in BATCH_MODES:
+            raise ValueError(f"Modo no soportado en lotes: {spec['mode']}")
+        if spec["ai_engine"] not in ENGINE_MODULES:
+            raise ValueError(f"Motor desconocido: {spec['ai_engine']}")
+        if spec["condense"] not in CONDENSE_MODES:
+            spec["condense"] = "off"
+        if spec["mode"] != "manual" and not spec["directory_path"]:
+            raise ValueError(f"El modo {spec['mode']} necesita directory_path")
+        specs.extend(dict(spec) for _ in range(variants))
+    if not specs:
+        raise ValueError("El lote no tiene examenes")
+    if len(specs) > BATCH_MAX_EXAMS:
+        raise ValueError(f"Como mucho {BATCH_MAX_EXAMS} examenes por lote (pedidos {len(specs)})")
+    return specs
+
+
+class BatchSources:
+    """Ingesta comun del lote: cada carpeta, fichero y contexto se lee una vez."""
+
+    def __init__(self, pdf_text, upload=None):
+        self.pdf_text = pdf_text
+        self.upload = upload
+        self._texts = {}
+        self._folders = {}
+        self._contexts = {}
+        self._sheets = {}
+        self._uses = {}
+
+    def prepare(self, specs):
+        """Lee todo lo que necesitan `specs` (bloqueante: llamar en un hilo). ValueError si falta algo."""
+        for spec in specs:
+            if spec["mode"] != "manual":
+                if not self.folder(spec["directory_path"], spec["condense"]):
+                    raise ValueError(f"No hay temas (.md, .txt, .pdf) en {spec['directory_path']}")
+            elif spec["context_id"] and not self.upload:
+                if self.context(spec["context_id"]) is None:
+                    raise ValueError(f"El contexto {spec['context_id']} ya no existe en el servidor")
+            elif not (self.upload or spec["topic"]):
+                raise ValueError("Los examenes manuales necesitan un fichero, un context_id o un topic")
+
+    def _read(self, path):
+        if path not in self._texts:
+            self._texts[path] = self._read_file(path)
+        return self._texts[path]
+
+    def _read_file(self, path):
+        try:
+            if path.endswith(".pdf"):
+                with open(path, "rb") as f:
+                    return self.pdf_text(f.read())
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except Exception as e:
+            log.warning("Error reading topic file", path=path, error=str(e))
+            return ""
+
+    def folder(self, path, condense):
+        """Documentos de la carpeta (fichas si se condensa), en orden barajado."""
+        key = (path, condense)
+        if key not in self._folders:
+            files = sorted(f for pattern in TOPIC_EXTENSIONS for f in glob.glob(os.path.join(path, pattern)))
+            docs = []
+            for file_path in files:
+                text = self._read(file_path)
+                if not text:
+                    continue
+                doc = Document(text, os.path.basename(file_path))
+                if condense != "off":
+                    doc = cached_document(doc, condense) or local_document(doc)
+                docs.append(doc)
+            random.shuffle(docs)
+            self._folders[key] = {"docs": docs, "next": 0}
+        return self._folders[key]["docs"]
+
+    def context(self, context_id):
+        if context_id not in self._contexts:
+            self._contexts[context_id] = context_store.get(context_id)
+        return self._contexts[context_id]
+
+    def deal(self, path, condense, count):
+        """Siguientes `count` temas de la carpeta en rotacion (sin repetir dentro de un examen)."""
+        folder = self._folders[(path, condense)]
+        docs = folder["docs"]
+        count = min(count, len(docs))
+        picked = [docs[(folder["next"] + i) % len(docs)] for i in range(count)]
+        folder["next"] += count
+        return picked
+
+    def fragment(self, doc, tokens=FRAGMENT_TOKENS):
+        """Tramo de `doc` de ~`tokens`; cada uso en el lote empieza donde acabo el anterior."""
+        chunks, costs = doc.chunks, doc.costs
+        if not chunks:
+            return ""
+        start = self._uses.get(doc.id, 0)
+        selected, used = [], 0
+        while len(selected) < len(chunks):
+            index = (start + len(selected)) % len(chunks)
+            if selected and used + costs[index] > tokens:
+                break
+            selected.append(index)
+            used += costs[index]
+        self._uses[doc.id] = (start + len(selected)) % len(chunks)
+        if used > tokens:
+            # Un chunk que no cabe entero: frases completas hasta el presupuesto
+            return pack_context(chunks[selected[0]], tokens)[0]
+        return " ".join(chunks[i] for i in selected)
+
+    async def sheet(self, doc, condense, engine, emit, slot=None):
+        """Ficha de `doc` para condense="engine": una sola pasada por documento y lote."""
+        key = (doc.id, condense)
+        if key not in self._sheets:
+            result = {}
+            async for item in condense_document(doc, condense, engine, result, slot=slot):
+                emit(item)
+            self._sheets[key] = result["document"]
+        return self._sheets[key]
+
+
+class Batch:
+    def __init__(self, batch_id, name, specs, sources, client):
+        self.id = batch_id
+        self.name = name or f"lote-{batch_id[:8]}"
+        self.specs = specs
+        self.sources = sources
+        self.client = client
+        # Historial comun de dedup: cabe el lote entero
+        self.history = RecentQuestions(filename=None, size=sum(spec["num_questions"] for spec in specs))
+        self.exams = [None] * len(specs)
+        self.seq = 0
+        self._slots = {}
+        self._sheet_lock = asyncio.Lock()
+
+    def emit(self, payload):
+        job_store.append(self.id, self.seq, payload)
+        self.seq += 1
+
+    def log(self, msg):
+        self.emit({"type": "log", "msg": msg})
+
+    def slots(self, queue_name):
+        """Semaforo de variantes simultaneas en un motor (dentro del limite por cliente del scheduler)."""
+        if queue_name not in self._slots:
+            limit = scheduler.queue(queue_name).limit
+            if BATCH_CONCURRENCY:
+                limit = min(limit, BATCH_CONCURRENCY)
+            self._slots[queue_name] = asyncio.Semaphore(max(1, min(limit, MAX_QUEUED_PER_CLIENT)))
+        return self._slots[queue_name]
+
+    async def context(self, spec, engine, slot=None):
+        """(contexto, documento para el selector, documentos para cobertura, temas) de una variante."""
+        sources = self.sources
+        if spec["mode"] == "random_1":
+            doc = sources.deal(spec["directory_path"], spec["condense"], 1)[0]
+            return doc.text, doc, [doc], [doc.name]
+        if spec["mode"] == "simulacro_3":
+            docs = sources.deal(spec["directory_path"], spec["condense"], SIMULACRO_TOPICS)
+            text = "\n".join(f"### TEMA: {doc.name} ###\n{sources.fragment(doc)}\n" for doc in docs)
+            return text, None, docs, [doc.name for doc in docs]
+        doc = sources.upload or (sources.context(spec["context_id"]) if spec["context_id"] else None)
+        if doc is None:
+            return None, None, [], []
+        if spec["condense"] != "off":
+            async with self._sheet_lock:
+                doc = await sources.sheet(doc, spec["condense"], engine, self.emit, slot=slot)
+        return doc.text, doc, [doc], [doc.name]
+
+    async def run_exam(self, index, spec):
+        label = f"[LOTE {index + 1}/{len(self.specs)}]"
+        trace = Trace("generate-exam.batch", engine=spec["ai_engine"], mode=spec["mode"],
+                      num_questions=spec["num_questions"], difficulty=spec["difficulty"],
+                      **{"batch.id": self.id, "batch.index": index, "client.address": self.client})
+        if spec["ai_engine"] == "auto":
+            engine = get_engine("auto", ollama_model=spec["ollama_model"], mode=spec["mode"])
+        else:
+            engine = get_engine(spec["ai_engine"], model_name=spec["ollama_model"] if spec["ai_engine"] == "ollama" else None)
+        queue_name = engine.provider(0).name
+        exam = {"index": index + 1, "spec": spec, "topics": [], "questions": [], "error": None, "trace_id": trace.trace_id}
+        self.exams[index] = exam
+        error = None
+        # Turno en la cola del motor que atiende cada intento (con "auto" puede cambiar)
+        slot = EngineSlot(self.client, "background", mode=spec["mode"])
+        try:
+            async with self.slots(queue_name):
+                while slot.ticket is None:
+                    try:
+                        async for _ in slot.acquire(queue_name, engine.provider(0).display_name):
+                            pass
+                    except Overloaded as e:
+                        await asyncio.sleep(min(max(1.0, e.retry_after), BATCH_RETRY_SECONDS))
+
+                if usage_ledger.daily_exceeded(engine.engine_names()):
+                    if BUDGET_ACTION == "downshift" and (engine.downshifted or engine.downshift()):
+                        BUDGET_EVENTS.inc(scope="daily", action="downshift")
+                    else:
+                        BUDGET_EVENTS.inc(scope="daily", action="reject")
+                        raise RuntimeError("Presupuesto diario de tokens agotado")
+
+                context_text, document, documents, topics = await self.context(spec, engine, slot)
+                exam["topics"] = topics
+                self.log(f"{label} Generando ({', '.join(topics) or spec['topic'] or 'contexto'})...")
+                source = generate_exam_streaming(engine, spec["num_questions"], context_text, spec["topic"], spec["difficulty"],
+                                                 mode=spec["mode"], client_id=self.id, document=document, trace=trace,
+                                                 history=self.history, slot=slot)
+                async for item in source:
+                    if isinstance(item, list):
+                        exam["questions"] = item
+                        coverage_store.record(documents, item)
+                    elif isinstance(item, dict) and any(tag in item.get("msg", "") for tag in FORWARDED_LOGS):
+                        self.log(f"{label} {item['msg'].strip()}")
+            if not exam["questions"]:
+                raise RuntimeError("No se generaron preguntas")
+            self.log(f"{label} Listo: {len(exam['questions'])} preguntas.")
+            self.emit({"type": "exam", "index": index + 1, "topics": topics, "questions": len(exam["questions"])})
+        except Exception as e:
+            error = e
+            exam["error"] = f"{type(e).__name__}: {str(e)[:200]}"
+            self.log(f"{label} [ERROR] {exam['error']}")
+        finally:
+            slot.release()
+            trace.finish(error)
+            BATCH_EXAMS.inc(engine=spec["ai_engine"], mode=spec["mode"], outcome="failed" if exam["error"] else "ok")
+
+    def cross_duplicates(self):
+        """Preguntas de cada examen casi iguales a alguna de un examen anterior del lote (tras la dedup)."""
+        seen, counts = None, []
+        for exam in self.exams:
+            questions = exam["questions"] if exam else []
+            _, dropped = find_duplicates(questions, seen)
+            counts.append(len(dropped))
+            if questions:
+                vectors = vectorize([question_text(q) for q in questions])
+                seen = vectors if seen is None else np.vstack([seen, vectors])
+        return counts
+
+    def manifest(self, started, finished):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "exams": len(self.specs),
+            "generated": sum(1 for exam in self.exams if exam and exam["questions"]),
+            "seconds": round(finished - started, 1),
+            "items": [{k: v for k, v in exam.items() if k != "questions"} | {"questions": len(exam["questions"])}
+                      for exam in self.exams if exam],
+        }
+
+
+async def run_batch(batch, on_finish=None):
+    """Genera todas las variantes a la vez (limitadas por motor) y guarda el resultado en el trabajo."""
+    started = time.monotonic()
+    status, error = INTERRUPTED, None
+    batch.log(f"[LOTE] {len(batch.specs)} examenes: {batch.name}")
+    try:
+        await asyncio.gather(*(batch.run_exam(i, spec) for i, spec in enumerate(batch.specs)))
+        duplicates = batch.cross_duplicates()
+        for exam, count in zip(batch.exams, duplicates):
+            exam["duplicates_in_batch"] = count
+        if any(duplicates):
+            batch.log(f"[DEDUP] {sum(duplicates)} preguntas repetidas entre examenes del lote (sin reemplazo posible).")
+        manifest = batch.manifest(started, time.monotonic())
+        status = DONE if manifest["generated"] else ERROR
+        batch.log(f"[COMPLETO] {manifest['generated']}/{manifest['exams']} examenes en {manifest['seconds']}s.")
+        log.info("Lote terminado", batch_id=batch.id, exams=manifest["exams"], generated=manifest["generated"],
+                 seconds=manifest["seconds"], duplicates=sum(duplicates))
+        batch.emit("[DONE]")
+        job_store.finish(batch.id, status, {"manifest": manifest, "exams": batch.exams},
+                         None if status == DONE else "No se genero ningun examen")
+    except BaseException as e:
+        error = e
+        reason = f"{type(e).__name__}: {str(e)[:200]}" if not isinstance(e, asyncio.CancelledError) else "Lote cancelado"
+        batch.log(f"[ERROR] {reason}")
+        batch.emit("[DONE]")
+        job_store.finish(batch.id, ERROR if isinstance(e, Exception) else INTERRUPTED, error=reason)
+        if isinstance(e, Exception):
+            log.exception("Lote fallido", batch_id=batch.id)
+        else:
+            raise
+    finally:
+        if on_finish:
+            on_finish(error)
+
+
+def archive_name(name):
+    return re.sub(r"[^\w.-]+", "_", name).strip("_") or "lote"
+
+
+def build_archive(result):
+    """Zip del lote: manifest.json y un examen_NN.json por variante generada."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("manifest.json", json.dumps(result["manifest"], ensure_ascii=False, indent=2))
+        width = max(2, len(str(len(result["exams"]))))
+        for exam in result["exams"]:
+            if exam and exam["questions"]:
+                archive.writestr(f"examen_{exam['index']:0{width}d}.json", json.dumps(exam, ensure_ascii=False, indent=2))
+    return buffer.getvalue()
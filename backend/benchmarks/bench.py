@@ -0,0 +1,283 @@
+"""
+Micro-benchmarks de las rutas CPU del backend.
+
+Uso (desde backend/):
+    python benchmarks/bench.py                      # ejecuta y muestra el informe
+    python benchmarks/bench.py --save main          # guarda baselines/main.json
+    python benchmarks/bench.py --compare main       # compara; exit 1 si hay regresion
+    python benchmarks/bench.py --only clean_text --repeat 10
+
+Todo es sintetico y con semilla fija (PDFs incluidos): funciona sin red y
+los resultados entre commits son comparables en la misma maquina.
+
+baselines/main.json es la referencia del repo (Python 3.11, Linux x86_64).
+Los tiempos dependen de la maquina: para vigilar regresiones en otra,
+generar primero una baseline propia en el commit de referencia
+(--save local) y comparar contra ella (--compare local).
+"""
+import argparse
+import copy
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+sys.path.insert(0, BACKEND_DIR)
+# Estado del backend (historial, caches) fuera de los datos reales
+os.environ.setdefault("SIMULADOR_DATA_DIR", tempfile.mkdtemp(prefix="simulador-bench-"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from pypdf import PdfWriter  # noqa: E402
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject  # noqa: E402
+
+from main import extract_text_from_pdf  # noqa: E402
+from pipeline import _clean_json_response, _clean_text, parse_questions, process_questions  # noqa: E402
+from questions import process_batch  # noqa: E402
+
+SEED = 2026
+DEFAULT_THRESHOLD = 0.15
+
+WORDS = (
+    "el la de los las procedimiento administrativo plazo meses dias habiles organo competente "
+    "recurso alzada reposicion interesado resolucion expresa silencio notificacion articulo ley "
+    "administracion publica sede electronica registro documento firma certificado ministerio "
+    "consejo secretaria direccion general mayoria absoluta quorum sesion acuerdo nulidad pleno"
+).split()
+
+
+# === DATOS SINTETICOS ===
+def synthetic_text(rng, n_chars):
+    parts, size = [], 0
+    article = 1
+    while size < n_chars:
+        if rng.random() < 0.05:
+            chunk = f"\n\nArtículo {article}. Disposición {article}.\n"
+            article += 1
+        else:
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 25)))
+            spacing = rng.choice([" ", "  ", "\n", "\n\n", "   \n "])
+            chunk = sentence.capitalize() + f" de {rng.randint(1, 30)} días." + spacing
+        parts.append(chunk)
+        size += len(chunk)
+    return "".join(parts)[:n_chars]
+
+
+def _pdf_escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def synthetic_pdf(rng, pages, lines_per_page=45):
+    """PDF de `pages` paginas de texto (Helvetica) construido con pypdf."""
+    writer = PdfWriter()
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+    font_ref = writer._add_object(font)
+    for _ in range(pages):
+        page = writer.add_blank_page(width=595, height=842)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font_ref}),
+        })
+        ops = ["BT", "/F1 10 Tf", "12 TL", "50 800 Td"]
+        for _ in range(lines_per_page):
+            line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 14)))
+            ops.append(f"({_pdf_escape(line)}) Tj T*")
+        ops.append("ET")
+        stream = DecodedStreamObject()
+        stream.set_data("\n".join(ops).encode("latin-1"))
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def synthetic_questions(rng, n):
+    questions = []
+    for i in range(n):
+        n_options = rng.choice([4, 4, 4, 3, 5])
+        correct = rng.randrange(n_options)
+        stated = correct if rng.random() < 0.8 else rng.randrange(n_options)
+        letter = chr(65 + stated)
+        explanation_style = rng.choice([
+            f"La respuesta correcta es {letter} porque el articulo {i} lo establece.",
+            f"Correcta: {letter}. Segun la ley, el plazo es de {rng.randint(1, 30)} dias.",
+            f"{letter}) Es la opcion correcta: la opcion {letter} recoge el plazo.",
+            "El organo competente es el ministerio.",
+        ])
+        questions.append({
+            "id": i + 1,
+            "question": " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 30))) + "?",
+            "options": [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 9))) for _ in range(n_options)],
+            "correct_index": correct,
+            "explanation": explanation_style,
+        })
+    return questions
+
+
+def model_output(rng, n_questions, fenced=True):
+    body = json.dumps(synthetic_questions(rng, n_questions), ensure_ascii=False, indent=2)
+    if fenced:
+        return "Aqui tienes las preguntas:\n```json\n\ufeff" + body + "\n```\nEspero que te sirvan."
+    return body
+
+
+# === CASOS ===
+def build_cases(rng):
+    """{nombre: (descripcion, preparar() -> estado, ejecutar(estado))}"""
+    pdf_bytes = synthetic_pdf(rng, 300)
+    big_text = synthetic_text(rng, 4 * 1024 * 1024)
+    fenced = model_output(rng, 40)
+    plain = model_output(rng, 40, fenced=False)
+    truncated = plain[: int(len(plain) * 0.7)]
+    questions = synthetic_questions(rng, 5000)
+
+    def parse_truncated(text):
+        try:
+            parse_questions(text)
+        except ValueError:
+            pass
+
+    return {
+        "pdf_extract_300p": (
+            f"extract_text_from_pdf, PDF sintetico de 300 paginas ({len(pdf_bytes) // 1024} KB)",
+            lambda: pdf_bytes, extract_text_from_pdf),
+        "clean_text_4mb": (
+            "_clean_text sobre 4 MB de texto con saltos/espacios repetidos",
+            lambda: big_text, _clean_text),
+        "clean_json_fenced": (
+            "_clean_json_response + json.loads, 40 preguntas con fences y BOM",
+            lambda: fenced, lambda t: json.loads(_clean_json_response(t))),
+        "json_loads_plain": (
+            "json.loads directo, 40 preguntas",
+            lambda: plain, json.loads),
+        "parse_truncated": (
+            "parse_questions sobre una salida truncada al 70% (ruta de error)",
+            lambda: truncated, parse_truncated),
+        "validate_shuffle_5000": (
+            "process_questions (Question + blindaje + barajado), 5000 preguntas",
+            lambda: copy.deepcopy(questions), process_questions),
+        "validate_shuffle_5000_seeded": (
+            "process_batch con semilla (barajado reproducible por enunciado), 5000 preguntas",
+            lambda: copy.deepcopy(questions), lambda batch: process_batch(batch, seed=SEED)),
+    }
+
+
+def run_case(prepare, execute, repeat, rng_seed):
+    times = []
+    for i in range(repeat):
+        random.seed(rng_seed + i)
+        state = prepare()
+        started = time.perf_counter()
+        execute(state)
+        times.append(time.perf_counter() - started)
+    return {
+        "median_ms": round(statistics.median(times) * 1000, 3),
+        "min_ms": round(min(times) * 1000, 3),
+        "stdev_ms": round(statistics.stdev(times) * 1000, 3) if len(times) > 1 else 0.0,
+        "repeat": repeat,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(only=None, repeat=5):
+    rng = random.Random(SEED)
+    cases = build_cases(rng)
+    results = {}
+    for name, (description, prepare, execute) in cases.items():
+        if only and not any(o in name for o in only):
+            continue
+        execute(prepare())  # calentamiento
+        results[name] = {"description": description, **run_case(prepare, execute, repeat, SEED)}
+        print(f"  {name:<24} {results[name]['median_ms']:>10.2f} ms  (min {results[name]['min_ms']:.2f})", flush=True)
+    return {
+        "commit": _git_commit(),
+        "created": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """Lineas del informe comparativo y lista de casos que empeoran mas de `threshold`."""
+    lines, regressions = [], []
+    for name, current in report["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            lines.append(f"  {name:<24} {current['median_ms']:>10.2f} ms   (sin baseline)")
+            continue
+        ratio = current["median_ms"] / base["median_ms"] if base["median_ms"] else 1.0
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESION"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  mejora"
+        lines.append(f"  {name:<24} {base['median_ms']:>10.2f} -> {current['median_ms']:>10.2f} ms  ({ratio - 1:+.1%}){flag}")
+    return lines, regressions
+
+
+def _baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks del backend del Simulador TAI")
+    parser.add_argument("--repeat", type=int, default=5, help="repeticiones por caso (se usa la mediana)")
+    parser.add_argument("--only", nargs="*", help="ejecuta solo los casos que contengan estos textos")
+    parser.add_argument("--save", metavar="NOMBRE", help="guarda el resultado como baselines/NOMBRE.json")
+    parser.add_argument("--compare", metavar="NOMBRE", help="compara con baselines/NOMBRE.json")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="empeoramiento relativo de la mediana que cuenta como regresion (0.15 = 15%%)")
+    parser.add_argument("--output", help="escribe el informe JSON en este fichero")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        # Antes de medir: sin baseline no hay nada con que comparar
+        try:
+            with open(_baseline_path(args.compare), "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        except OSError:
+            sys.exit(f"No existe la baseline '{args.compare}' ({_baseline_path(args.compare)}). "
+                     f"Generala en el commit de referencia con: python benchmarks/bench.py --save {args.compare}")
+
+    print(f"Benchmarks (repeat={args.repeat}, python {platform.python_version()}):")
+    report = run(args.only, args.repeat)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(_baseline_path(args.save), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline guardada en {_baseline_path(args.save)}")
+    if baseline is not None:
+        print(f"\nComparacion con '{args.compare}' (commit {baseline.get('commit')}, umbral {args.threshold:.0%}):")
+        lines, regressions = compare(report, baseline, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"\n{len(regressions)} regresion(es): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
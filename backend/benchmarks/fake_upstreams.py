@@ -0,0 +1,217 @@
+"""
+Servidores falsos de Ollama, Groq y Gemini para pruebas de carga offline.
+
+Un solo servidor aiohttp atiende las tres APIs:
+    POST /api/generate                          (Ollama)
+    POST /openai/v1/chat/completions            (Groq, compatible OpenAI)
+    POST /v1beta/models/{model}:generateContent (Gemini, REST del SDK google-genai)
+y sus listados de modelos (GET /api/tags, /openai/v1/models, /v1beta/models)
+con los de FAKE_MODELS, para benchmarks/probe_models.py.
+
+Cada respuesta espera `latency` (+ jitter) antes de enviar cabeceras y luego
+el tiempo de generacion segun `tokens_per_sec`; con probabilidad `rate_429`
+responde 429 y con `malformed` devuelve un JSON truncado.
+
+Uso suelto:  python benchmarks/fake_upstreams.py --port 8600 --latency 0.8
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+from dataclasses import dataclass
+
+from aiohttp import web
+
+_RE_COUNT = re.compile(r"(?:Genera|Test de)\s+(\d+)\s+preguntas")
+# Modelos que anuncia cada API falsa (todos responden igual)
+FAKE_MODELS = {
+    "gemini": ["gemini-2.5-flash", "gemini-2.0-flash", "text-embedding-004"],
+    "groq": ["llama-3.3-70b-versatile", "llama-3.1-8b-instant", "whisper-large-v3"],
+    "ollama": ["deepseek-v3.2:cloud", "qwen2.5:7b"],
+}
+SYLLABLES = "ba be bi bo bu ca ce ci co cu da de di do du fa fe fi la le li lo lu ma me mi mo mu na ne ni no nu pa pe pi po pu ra re ri ro ru sa se si so su ta te ti to tu".split()
+
+
+@dataclass
+class UpstreamBehavior:
+    latency: float = 0.5          # segundos hasta las cabeceras
+    jitter: float = 0.2           # +- aleatorio sobre latency
+    tokens_per_sec: float = 200   # velocidad de generacion simulada
+    rate_429: float = 0.0         # probabilidad de responder 429
+    malformed: float = 0.0        # probabilidad de JSON truncado
+
+
+def _word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def fake_questions(rng, count):
+    """Preguntas aleatorias (vocabulario inventado: no las descarta el dedup)."""
+    questions = []
+    for i in range(count):
+        correct = rng.randrange(4)
+        questions.append({
+            "id": i + 1,
+            "question": " ".join(_word(rng) for _ in range(rng.randint(10, 18))) + "?",
+            "options": [" ".join(_word(rng) for _ in range(rng.randint(3, 6))) for _ in range(4)],
+            "correct_index": correct,
+            "explanation": f"La respuesta correcta es {chr(65 + correct)}. " + " ".join(_word(rng) for _ in range(12)),
+        })
+    return questions
+
+
+class FakeUpstreams:
+    def __init__(self, behavior=None, seed=None):
+        self.behavior = behavior or UpstreamBehavior()
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "429": 0, "malformed": 0, "cancelled": 0, "prompt_tokens": 0, "output_tokens": 0}
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_post("/api/generate", self.ollama)
+        self.app.router.add_post("/openai/v1/chat/completions", self.groq)
+        self.app.router.add_post(r"/{version}/models/{model}:generateContent", self.gemini)
+        self.app.router.add_get("/api/tags", self.ollama_tags)
+        self.app.router.add_get("/openai/v1/models", self.groq_models)
+        self.app.router.add_get("/{version}/models", self.gemini_models)
+        self._runner = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def _completion(self, prompt):
+        """(texto, tokens de prompt, tokens de salida, es_malformado)"""
+        m = _RE_COUNT.search(prompt)
+        count = int(m.group(1)) if m else 10
+        text = json.dumps(fake_questions(self.rng, count), ensure_ascii=False)
+        malformed = self.rng.random() < self.behavior.malformed
+        if malformed:
+            text = text[: int(len(text) * self.rng.uniform(0.3, 0.9))]
+            self.stats["malformed"] += 1
+        prompt_tokens, output_tokens = len(prompt) // 4, len(text) // 4
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["output_tokens"] += output_tokens
+        return text, prompt_tokens, output_tokens
+
+    async def _respond(self, request, build_body, error_body):
+        """Cabeceras tras la latencia, cuerpo tras el tiempo de generacion."""
+        self.stats["requests"] += 1
+        b = self.behavior
+        await asyncio.sleep(max(0.0, b.latency + self.rng.uniform(-b.jitter, b.jitter)))
+        if self.rng.random() < b.rate_429:
+            self.stats["429"] += 1
+            return web.json_response(error_body, status=429)
+
+        body, output_tokens = build_body()
+        response = web.StreamResponse(status=200, headers={"Content-Type": "application/json"})
+        try:
+            await response.prepare(request)
+            await asyncio.sleep(output_tokens / b.tokens_per_sec if b.tokens_per_sec > 0 else 0)
+            await response.write(json.dumps(body).encode("utf-8"))
+            await response.write_eof()
+        except ConnectionResetError:
+            # El backend cancelo la llamada (cliente desconectado)
+            self.stats["cancelled"] += 1
+        return response
+
+    async def ollama(self, request):
+        payload = await request.json()
+
+        def build():
+            text, prompt_tokens, output_tokens = self._completion(payload.get("prompt", ""))
+            return {"model": payload.get("model"), "response": text, "done": True,
+                    "prompt_eval_count": prompt_tokens, "eval_count": output_tokens}, output_tokens
+        return await self._respond(request, build, {"error": "rate limited"})
+
+    async def groq(self, request):
+        payload = await request.json()
+
+        def build():
+            prompt = "\n".join(m.get("content", "") for m in payload.get("messages", []))
+            text, prompt_tokens, output_tokens = self._completion(prompt)
+            return {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": output_tokens,
+                          "total_tokens": prompt_tokens + output_tokens},
+            }, output_tokens
+        return await self._respond(request, build, {"error": {"message": "Rate limit reached", "type": "tokens"}})
+
+    async def gemini(self, request):
+        payload = await request.json()
+
+        def build():
+            prompt = "\n".join(part.get("text", "") for content in payload.get("contents", [])
+                               for part in content.get("parts", []))
+            text, prompt_tokens, output_tokens = self._completion(prompt)
+            return {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+                "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                                  "totalTokenCount": prompt_tokens + output_tokens},
+                "modelVersion": request.match_info["model"],
+            }, output_tokens
+        return await self._respond(request, build, {"error": {"code": 429, "message": "Resource exhausted", "status": "RESOURCE_EXHAUSTED"}})
+
+
+    async def ollama_tags(self, request):
+        return web.json_response({"models": [{"name": name, "model": name, "size": 0} for name in FAKE_MODELS["ollama"]]})
+
+    async def groq_models(self, request):
+        return web.json_response({"object": "list", "data": [
+            {"id": name, "object": "model", "owned_by": "fake", "active": True, "context_window": 131072}
+            for name in FAKE_MODELS["groq"]
+        ]})
+
+    async def gemini_models(self, request):
+        models = []
+        for name in FAKE_MODELS["gemini"]:
+            action = "embedContent" if "embedding" in name else "generateContent"
+            models.append({"name": f"models/{name}", "displayName": name, "inputTokenLimit": 1048576,
+                           "outputTokenLimit": 8192, "supportedGenerationMethods": [action]})
+        return web.json_response({"models": models})
+
+
+def add_behavior_arguments(parser):
+    parser.add_argument("--latency", type=float, default=UpstreamBehavior.latency, help="segundos hasta las cabeceras")
+    parser.add_argument("--jitter", type=float, default=UpstreamBehavior.jitter, help="variacion aleatoria de la latencia")
+    parser.add_argument("--tokens-per-sec", type=float, default=UpstreamBehavior.tokens_per_sec, help="velocidad de generacion")
+    parser.add_argument("--rate-429", type=float, default=UpstreamBehavior.rate_429, help="fraccion de respuestas 429")
+    parser.add_argument("--malformed", type=float, default=UpstreamBehavior.malformed, help="fraccion de JSON truncados")
+
+
+def behavior_from_args(args):
+    return UpstreamBehavior(args.latency, args.jitter, args.tokens_per_sec, args.rate_429, args.malformed)
+
+
+async def _serve(args):
+    upstreams = FakeUpstreams(behavior_from_args(args), seed=args.seed)
+    port = await upstreams.start(args.host, args.port)
+    print(f"Servidores falsos en http://{args.host}:{port}")
+    print(f"  OLLAMA_URL=http://{args.host}:{port}/api/generate")
+    print(f"  GROQ_API_URL=http://{args.host}:{port}/openai/v1/chat/completions")
+    print(f"  GEMINI_BASE_URL=http://{args.host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await upstreams.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ollama/Groq/Gemini falsos para pruebas de carga")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--seed", type=int, default=None)
+    add_behavior_arguments(parser)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,289 @@
+"""
+Generador de carga para /generate-exam contra motores falsos.
+
+Arranca los servidores falsos (fake_upstreams.py), levanta el backend con
+uvicorn apuntando a ellos y lanza clientes SSE concurrentes. Informa:
+    - TTFQ: tiempo hasta el primer evento con preguntas
+    - latencia total por examen (p50/p90/p99)
+    - throughput (examenes/s y preguntas/s)
+    - memoria del backend (RSS pico y final, via /proc)
+
+Uso (desde backend/):
+    python benchmarks/loadgen.py --engine groq --clients 20 --requests 100
+    python benchmarks/loadgen.py --engine gemini --rate-429 0.1 --malformed 0.05 --output carga.json
+    python benchmarks/loadgen.py --backend-url http://127.0.0.1:8000   # backend ya arrancado
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_upstreams import FakeUpstreams, add_behavior_arguments, behavior_from_args  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTEXT_WORDS = "plazo organo recurso resolucion interesado notificacion silencio ley articulo ministerio".split()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return round(ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo), 4)
+
+
+def summarize(values):
+    return {
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "mean": round(statistics.fmean(values), 4) if values else None,
+        "max": round(max(values), 4) if values else None,
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_kb(pid):
+    """(VmRSS, VmHWM) en KB del proceso, o (None, None) fuera de Linux."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class BackendProcess:
+    """uvicorn main:app en un puerto libre, con los motores apuntando a los falsos."""
+
+    def __init__(self, upstream_port, log_path):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        upstream = f"http://127.0.0.1:{upstream_port}"
+        self.env = {
+            **os.environ,
+            "OLLAMA_URL": f"{upstream}/api/generate",
+            "GROQ_API_URL": f"{upstream}/openai/v1/chat/completions",
+            "GEMINI_BASE_URL": upstream,
+            "GEMINI_API_KEY": "fake-key-a",
+            "GEMINI_API_KEY_2": "fake-key-b",
+            "GROQ_API_KEY": "fake-key",
+            "SIMULADOR_DATA_DIR": tempfile.mkdtemp(prefix="simulador-load-"),
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+            # Todos los clientes simulados salen de 127.0.0.1: sin limite por cliente en la cola
+            "ENGINE_QUEUE_PER_CLIENT": os.environ.get("ENGINE_QUEUE_PER_CLIENT", "100000"),
+        }
+        self.log_path = log_path
+        self.proc = None
+
+    async def start(self, timeout=30):
+        self._log = open(self.log_path, "w")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=self.env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if self.proc.poll() is not None:
+                    raise RuntimeError(f"El backend termino al arrancar (ver {self.log_path})")
+                try:
+                    async with session.get(self.url + "/ready") as r:
+                        if r.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("El backend no respondio a tiempo")
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if self.proc:
+            self._log.close()
+
+
+async def one_exam(session, url, form, timeout):
+    """Un cliente SSE: devuelve dict con ttfq, latencia, preguntas y error."""
+    data = aiohttp.FormData()
+    for key, value in form.items():
+        data.add_field(key, str(value))
+    started = time.perf_counter()
+    result = {"ttfq": None, "latency": None, "questions": 0, "events": 0, "error": None}
+    try:
+        async with session.post(url + "/generate-exam", data=data, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+            if r.status != 200:
+                result["error"] = f"HTTP {r.status}"
+                return result
+            buffer = ""
+            async for chunk in r.content.iter_any():
+                buffer += chunk.decode("utf-8", "replace")
+                *events, buffer = buffer.split("\n\n")
+                for event in events:
+                    data_line = next((line[6:] for line in event.split("\n") if line.startswith("data: ")), None)
+                    if data_line is None:
+                        continue
+                    result["events"] += 1
+                    if data_line == "[DONE]":
+                        continue
+                    payload = json.loads(data_line)
+                    if isinstance(payload, list):
+                        if result["ttfq"] is None:
+                            result["ttfq"] = time.perf_counter() - started
+                        result["questions"] += len(payload)
+        result["latency"] = time.perf_counter() - started
+        if not result["questions"]:
+            result["error"] = "sin preguntas"
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def run_load(url, args, rss_probe=None):
+    rng = random.Random(args.seed)
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        context = " ".join(rng.choice(CONTEXT_WORDS) for _ in range(args.context_words))
+        queue.put_nowait({
+            "num_questions": args.questions,
+            "ai_engine": args.engine,
+            "difficulty": "Intermedio",
+            "mode": "manual",
+            "context": context,
+        })
+    results = []
+    rss_samples = []
+
+    async def client():
+        connector = aiohttp.TCPConnector(limit=1)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            while True:
+                try:
+                    form = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results.append(await one_exam(session, url, form, args.timeout))
+
+    async def sample_memory():
+        while True:
+            rss_samples.append(rss_probe())
+            await asyncio.sleep(0.25)
+
+    sampler = asyncio.create_task(sample_memory()) if rss_probe else None
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.clients)))
+    elapsed = time.perf_counter() - started
+    if sampler:
+        sampler.cancel()
+        rss_samples.append(rss_probe())
+
+    ok = [r for r in results if not r["error"]]
+    errors = {}
+    for r in results:
+        if r["error"]:
+            errors[r["error"][:80]] = errors.get(r["error"][:80], 0) + 1
+    rss = [s[0] for s in rss_samples if s[0]]
+    hwm = [s[1] for s in rss_samples if s[1]]
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "wall_seconds": round(elapsed, 3),
+        "ttfq_seconds": summarize([r["ttfq"] for r in ok if r["ttfq"] is not None]),
+        "latency_seconds": summarize([r["latency"] for r in ok]),
+        "throughput": {
+            "exams_per_sec": round(len(ok) / elapsed, 3) if elapsed else None,
+            "questions_per_sec": round(sum(r["questions"] for r in ok) / elapsed, 3) if elapsed else None,
+        },
+        "memory_kb": {
+            "rss_peak": max(rss) if rss else None,
+            "rss_final": rss[-1] if rss else None,
+            "hwm": max(hwm) if hwm else None,
+        },
+    }
+
+
+def print_report(report):
+    print(f"\nPeticiones: {report['requests']} ok={report['ok']} en {report['wall_seconds']}s")
+    if report["errors"]:
+        for error, count in report["errors"].items():
+            print(f"  error x{count}: {error}")
+    for key, title in (("ttfq_seconds", "TTFQ"), ("latency_seconds", "Latencia")):
+        s = report[key]
+        print(f"{title:<9} p50={s['p50']}s p90={s['p90']}s p99={s['p99']}s max={s['max']}s")
+    t = report["throughput"]
+    print(f"Throughput: {t['exams_per_sec']} examenes/s, {t['questions_per_sec']} preguntas/s")
+    m = report["memory_kb"]
+    if m["rss_peak"]:
+        print(f"Memoria backend: RSS pico {m['rss_peak'] / 1024:.1f} MB, final {m['rss_final'] / 1024:.1f} MB")
+    if "upstream" in report:
+        u = report["upstream"]
+        print(f"Upstream: {u['requests']} llamadas, {u['429']} x 429, {u['malformed']} JSON truncados, {u['cancelled']} canceladas")
+
+
+async def main_async(args):
+    if args.backend_url:
+        report = await run_load(args.backend_url.rstrip("/"), args)
+        print_report(report)
+        return report
+
+    upstreams = FakeUpstreams(behavior_from_args(args), seed=args.seed)
+    upstream_port = await upstreams.start()
+    backend = BackendProcess(upstream_port, args.backend_log)
+    try:
+        await backend.start()
+        print(f"Backend en {backend.url}, motores falsos en :{upstream_port} "
+              f"({args.clients} clientes, {args.requests} examenes de {args.questions} preguntas, motor {args.engine})")
+        report = await run_load(backend.url, args, rss_probe=lambda: _rss_kb(backend.proc.pid))
+    finally:
+        backend.stop()
+        await upstreams.stop()
+    report["upstream"] = dict(upstreams.stats)
+    report["config"] = {k: v for k, v in vars(args).items() if k not in ("output",)}
+    print_report(report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga concurrente sobre /generate-exam con motores falsos")
+    parser.add_argument("--engine", choices=("gemini", "groq", "ollama"), default="groq")
+    parser.add_argument("--clients", type=int, default=10, help="clientes SSE concurrentes")
+    parser.add_argument("--requests", type=int, default=50, help="examenes totales")
+    parser.add_argument("--questions", type=int, default=10, help="preguntas por examen")
+    parser.add_argument("--context-words", type=int, default=2000, help="palabras de contexto por examen")
+    parser.add_argument("--timeout", type=float, default=300, help="timeout por examen (s)")
+    parser.add_argument("--seed", type=int, default=2026)
+    parser.add_argument("--backend-url", help="usar un backend ya arrancado (sin motores falsos)")
+    parser.add_argument("--backend-log", default=os.path.join(tempfile.gettempdir(), "simulador-loadgen-backend.log"))
+    parser.add_argument("--output", help="escribe el informe JSON en este fichero")
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
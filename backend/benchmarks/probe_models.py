@@ -0,0 +1,272 @@
+"""
+Descubrimiento y sondeo de modelos de todos los motores configurados.
+
+Enumera los modelos de cada motor (Gemini y Groq por su API de listado,
+Ollama por sus tags locales), pasa a cada uno la misma sonda (un examen
+pequeno sobre un texto fijo) y mide tiempo hasta la primera respuesta,
+tokens/s, tasa de JSON valido y coste estimado. El ranking resultante se
+escribe en DATA_DIR/model_ranking.json (ranking.py), de donde el backend
+toma al arrancar la cadena de fallback de Gemini, el modelo por defecto de
+Groq y Ollama y las estimaciones iniciales del motor "auto".
+
+Uso (desde backend/):
+    python benchmarks/probe_models.py --list             # solo enumera
+    python benchmarks/probe_models.py                    # sondea y escribe el ranking
+    python benchmarks/probe_models.py --engines ollama --runs 3
+    python benchmarks/probe_models.py --fake             # contra fake_upstreams.py, sin red ni claves
+
+Los tokens son los que declara cada API (estimados si no los da) y el
+coste sale de budget.MODEL_PRICES: sirve para comparar, no para facturar.
+"""
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+ENGINE_NAMES = ("gemini", "groq", "ollama")
+# Modelos que no generan texto (embeddings, audio, imagen...) o no sirven para examenes
+DEFAULT_EXCLUDE = r"embed|tts|image|imagen|veo|audio|live|whisper|guard|transcri|native|robotics|computer-use|aqa"
+PROBE_QUESTIONS = 3
+PROBE_DIFFICULTY = "Intermedio"
+# Por debajo de esta tasa de JSON valido el modelo no entra en la cadena
+MIN_VALIDITY = 0.5
+CHAIN_LENGTH = 3
+
+PROBE_CONTEXT = """
+Artículo 30. Cómputo de plazos.
+1. Salvo que por Ley o en el Derecho de la Unión Europea se disponga otro cómputo, cuando los plazos se
+señalen por horas, se entiende que éstas son hábiles. Son hábiles todas las horas del día que formen parte
+de un día hábil.
+2. Siempre que por Ley o en el Derecho de la Unión Europea no se exprese otro cómputo, cuando los plazos se
+señalen por días, se entiende que éstos son hábiles, excluyéndose del cómputo los sábados, los domingos y
+los declarados festivos.
+3. Los plazos expresados en días se contarán a partir del día siguiente a aquel en que tenga lugar la
+notificación o publicación del acto de que se trate, o desde el siguiente a aquel en que se produzca la
+estimación o la desestimación por silencio administrativo.
+4. Si el plazo se fija en meses o años, éstos se computarán a partir del día siguiente a aquel en que tenga
+lugar la notificación o publicación del acto de que se trate. El plazo concluirá el mismo día en que se
+produjo la notificación, publicación o silencio administrativo en el mes o el año de vencimiento.
+5. Cuando el último día del plazo sea inhábil, se entenderá prorrogado al primer día hábil siguiente.
+"""
+
+
+# === DESCUBRIMIENTO ===
+async def discover_gemini(session):
+    import gemini_client
+    models = []
+    pager = await gemini_client.clients[0].aio.models.list()
+    async for m in pager:
+        if "generateContent" in (m.supported_actions or []):
+            models.append(m.name.split("/", 1)[-1])
+    return models
+
+
+async def discover_groq(session):
+    import groq_client
+    url = groq_client.GROQ_API_URL.rsplit("/chat/completions", 1)[0] + "/models"
+    headers = {"Authorization": f"Bearer {groq_client.GROQ_API_KEY}"}
+    async with session.get(url, headers=headers) as response:
+        response.raise_for_status()
+        data = await response.json()
+    return [m["id"] for m in data.get("data", []) if m.get("active", True)]
+
+
+async def discover_ollama(session):
+    import ollama_client
+    url = ollama_client.OLLAMA_URL.split("/api/", 1)[0] + "/api/tags"
+    async with session.get(url) as response:
+        response.raise_for_status()
+        data = await response.json()
+    return [m["name"] for m in data.get("models", [])]
+
+
+DISCOVERERS = {"gemini": discover_gemini, "groq": discover_groq, "ollama": discover_ollama}
+
+
+def select_models(models, include, exclude):
+    selected = []
+    for name in models:
+        if exclude and re.search(exclude, name):
+            continue
+        if include and not re.search(include, name):
+            continue
+        selected.append(name)
+    return selected
+
+
+# === SONDA ===
+async def probe_model(provider, model, runs, questions, timeout):
+    """Ejecuta la sonda `runs` veces contra (motor, modelo) y resume las medidas."""
+    from budget import estimate_cost
+    from pipeline import ParseError, parse_questions
+    from questions import process_batch
+    from usage import attempt_usage
+
+    prompt = provider.build_prompt(questions, PROBE_DIFFICULTY, PROBE_CONTEXT, None, "manual")
+    samples, errors = [], []
+    for _ in range(runs):
+        provider.first_byte_at = None
+        provider.usage = None
+        started = time.perf_counter()
+        try:
+            raw_text = await asyncio.wait_for(provider.complete(prompt, model, 0), timeout)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {str(e)[:120]}")
+            continue
+        finished = time.perf_counter()
+        usage = attempt_usage(provider, prompt, raw_text)
+        output_tokens = usage.output_tokens
+        try:
+            items, _ = parse_questions(raw_text)
+            valid = len(process_batch(items)[0]) >= questions
+        except ParseError:
+            valid = False
+        samples.append({
+            "ttft": (provider.first_byte_at or finished) - started,
+            "total": finished - started,
+            "tokens_per_second": output_tokens / (finished - started) if finished > started else 0.0,
+            "valid": valid,
+            "cost": estimate_cost(provider.name, model, usage.prompt_tokens, output_tokens),
+        })
+    return summarize(provider.name, model, runs, samples, errors)
+
+
+def summarize(engine, model, runs, samples, errors):
+    from routing import MAX_FAILURE_RATE, ROUTE_REFERENCE_TOKENS
+
+    valid = sum(1 for s in samples if s["valid"])
+    validity = valid / runs if runs else 0.0
+    entry = {"model": model, "runs": runs, "valid": valid, "validity": round(validity, 3),
+             "ttft_seconds": None, "total_seconds": None, "tokens_per_second": None,
+             "cost_usd": None, "expected_seconds": None, "errors": sorted(set(errors))[:3]}
+    if samples:
+        tps = statistics.median(s["tokens_per_second"] for s in samples)
+        entry.update({
+            "ttft_seconds": round(statistics.median(s["ttft"] for s in samples), 3),
+            "total_seconds": round(statistics.median(s["total"] for s in samples), 3),
+            "tokens_per_second": round(tps, 1),
+            "cost_usd": round(statistics.fmean(s["cost"] for s in samples), 6),
+        })
+        # Mismo criterio que el enrutador: tiempo hasta una respuesta valida de referencia
+        seconds = ROUTE_REFERENCE_TOKENS / tps if tps else entry["total_seconds"]
+        entry["expected_seconds"] = round(seconds / (1 - min(1 - validity, MAX_FAILURE_RATE)), 2)
+    return entry
+
+
+def rank_models(entries):
+    """Validos primero, por tiempo esperado y luego coste; la cadena son los CHAIN_LENGTH mejores."""
+    def key(entry):
+        usable = entry["validity"] >= MIN_VALIDITY and entry["expected_seconds"] is not None
+        return (not usable, entry["expected_seconds"] or float("inf"), entry["cost_usd"] or 0.0)
+    ranked = sorted(entries, key=key)
+    chain = [e["model"] for e in ranked if e["validity"] >= MIN_VALIDITY and e["expected_seconds"] is not None]
+    return ranked, chain[:CHAIN_LENGTH]
+
+
+# === EJECUCION ===
+async def start_fake(args):
+    """Arranca fake_upstreams.py y apunta los motores (y DATA_DIR) a el."""
+    from fake_upstreams import FakeUpstreams, behavior_from_args
+    upstreams = FakeUpstreams(behavior_from_args(args), seed=args.seed)
+    port = await upstreams.start()
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update({
+        "OLLAMA_URL": f"{base}/api/generate",
+        "GROQ_API_URL": f"{base}/openai/v1/chat/completions",
+        "GEMINI_BASE_URL": base,
+        "GEMINI_API_KEY": "fake-key-a",
+        "GROQ_API_KEY": "fake-key",
+    })
+    # Un ranking de servidores falsos nunca pisa el real (salvo --output)
+    os.environ["SIMULADOR_DATA_DIR"] = tempfile.mkdtemp(prefix="simulador-probe-")
+    return upstreams
+
+
+async def run(args):
+    import aiohttp
+
+    upstreams = await start_fake(args) if args.fake else None
+    # Despues de configurar el entorno: los motores leen URLs y claves al importarse
+    from engines import get_engine, load_engine
+    import ranking
+
+    try:
+        result = {"engines": {}}
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+            for name in args.engines:
+                load_engine(name)
+                provider = get_engine(name)
+                error = provider.check_ready()
+                if error:
+                    print(f"[{name}] omitido: {error}")
+                    continue
+                try:
+                    models = await DISCOVERERS[name](session)
+                except Exception as e:
+                    print(f"[{name}] no se pudieron listar los modelos: {type(e).__name__}: {e}")
+                    continue
+                selected = select_models(models, args.include, args.exclude)
+                print(f"[{name}] {len(models)} modelos, {len(selected)} seleccionados: {', '.join(selected) or '-'}")
+                if args.list or not selected:
+                    continue
+
+                entries = []
+                for model in selected:
+                    entry = await probe_model(provider, model, args.runs, args.questions, args.timeout)
+                    entries.append(entry)
+                    print(f"  {model:<40} valido {entry['valid']}/{entry['runs']}  ttft {entry['ttft_seconds']}s  "
+                          f"{entry['tokens_per_second']} tok/s  coste {entry['cost_usd']} USD"
+                          + (f"  errores: {'; '.join(entry['errors'])}" if entry["errors"] else ""))
+                ranked, chain = rank_models(entries)
+                result["engines"][name] = {"chain": chain, "models": ranked}
+                print(f"[{name}] cadena: {' -> '.join(chain) or '(ningun modelo valido)'}")
+    finally:
+        if upstreams:
+            await upstreams.stop()
+
+    if args.list:
+        return
+    output = args.output or ranking.RANKING_FILE
+    # Los motores no sondeados en esta ejecucion conservan su entrada anterior
+    previous = ranking.load_ranking(output)
+    engines = {**previous.get("engines", {}), **result["engines"]}
+    ranking.save_ranking({
+        "generated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "probe": {"questions": args.questions, "runs": args.runs, "fake": args.fake},
+        "engines": engines,
+    }, output)
+    print(f"Ranking escrito en {output}")
+
+
+def main():
+    from fake_upstreams import add_behavior_arguments
+
+    parser = argparse.ArgumentParser(description="Descubre y sondea los modelos de cada motor; escribe el ranking")
+    parser.add_argument("--engines", default=",".join(ENGINE_NAMES), help="motores separados por comas")
+    parser.add_argument("--list", action="store_true", help="solo enumera los modelos, sin sondear")
+    parser.add_argument("--include", default=None, help="regex: solo modelos que la cumplan")
+    parser.add_argument("--exclude", default=DEFAULT_EXCLUDE, help="regex: modelos a ignorar")
+    parser.add_argument("--runs", type=int, default=2, help="sondas por modelo")
+    parser.add_argument("--questions", type=int, default=PROBE_QUESTIONS, help="preguntas por sonda")
+    parser.add_argument("--timeout", type=float, default=180, help="timeout por sonda (s)")
+    parser.add_argument("--output", help="fichero de ranking (por defecto DATA_DIR/model_ranking.json)")
+    parser.add_argument("--fake", action="store_true", help="contra servidores falsos locales (fake_upstreams.py)")
+    parser.add_argument("--seed", type=int, default=2026)
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+    args.engines = [name.strip() for name in args.engines.split(",") if name.strip() in ENGINE_NAMES]
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import os
+import re
+
+from pipeline import _clean_text
+
+
+# === PRESUPUESTO DE TOKENS POR MOTOR / MODELO ===
+# Antes el contexto se cortaba a 30000 caracteres para cualquier modelo.
+# Ahora cada (motor, modelo) tiene su ventana de entrada y el empaquetador
+# llena exactamente: ventana - salida esperada - prompt fijo - margen.
+
+# (motor, modelo) -> ventana de contexto en tokens
+# Groq: el limite efectivo es el de tokens/minuto del plan gratuito, no la ventana del modelo.
+MODEL_WINDOWS = {
+    ("gemini", "gemini-3-flash-preview"): 1_048_576,
+    ("gemini", "gemini-2.5-flash"): 1_048_576,
+    ("gemini", "gemini-2.0-flash"): 1_048_576,
+    ("groq", "llama-3.3-70b-versatile"): 12_000,
+    ("ollama", "deepseek-v3.2:cloud"): 131_072,
+    ("ollama", "qwen3.5:9b"): 32_768,
+    ("ollama", "qwen2.5:7b"): 32_768,
+    ("ollama", "qwen2.5:14b"): 32_768,
+    ("ollama", "llama3-auditor:latest"): 8_192,
+}
+
+# Ventana por defecto si el modelo no esta en la tabla
+ENGINE_DEFAULT_WINDOWS = {
+    "gemini": 1_048_576,
+    "groq": 12_000,
+    "ollama": 8_192,
+}
+
+FALLBACK_WINDOW = 8_192
+
+# (motor, modelo) -> (USD por millon de tokens de entrada, de salida).
+# Precios de lista orientativos; Ollama local no cuesta nada. Un modelo que
+# no este en la tabla usa el precio por defecto de su motor.
+MODEL_PRICES = {
+    ("gemini", "gemini-3-flash-preview"): (0.50, 3.00),
+    ("gemini", "gemini-2.5-flash"): (0.30, 2.50),
+    ("gemini", "gemini-2.5-flash-lite"): (0.10, 0.40),
+    ("gemini", "gemini-2.5-pro"): (1.25, 10.00),
+    ("gemini", "gemini-2.0-flash"): (0.10, 0.40),
+    ("gemini", "gemini-2.0-flash-lite"): (0.075, 0.30),
+    ("groq", "llama-3.3-70b-versatile"): (0.59, 0.79),
+    ("groq", "llama-3.1-8b-instant"): (0.05, 0.08),
+}
+
+ENGINE_DEFAULT_PRICES = {
+    "gemini": (0.30, 2.50),
+    "groq": (0.59, 0.79),
+    "ollama": (0.0, 0.0),
+}
+
+# Margen de seguridad: el estimador no es el tokenizer real del modelo
+SAFETY_MARGIN = 0.10
+
+# Tope opcional global (p.ej. para no mandar 1M tokens a Gemini en cada examen)
+_cap = os.getenv("CONTEXT_TOKEN_CAP")
+CONTEXT_TOKEN_CAP = int(_cap) if _cap and _cap.isdigit() else None
+
+
+# === ESTIMADOR ===
+_RE_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """
+    Estimacion barata de tokens BPE: un token por signo de puntuacion y
+    ~4 caracteres por token en palabras (texto legal en castellano).
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _RE_PIECES.findall(text):
+        tokens += 1 + (len(piece) - 1) // 4
+    return tokens
+
+
+def get_window(engine, model):
+    return MODEL_WINDOWS.get((engine, model)) or ENGINE_DEFAULT_WINDOWS.get(engine, FALLBACK_WINDOW)
+
+
+def estimate_cost(engine, model, prompt_tokens, output_tokens):
+    """Coste en USD de una llamada segun MODEL_PRICES."""
+    price_in, price_out = MODEL_PRICES.get((engine, model)) or ENGINE_DEFAULT_PRICES.get(engine, (0.0, 0.0))
+    return (prompt_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+
+def context_budget(engine, model, max_output_tokens, prompt_tokens=0):
+    """Tokens disponibles para el documento de referencia."""
+    window = get_window(engine, model)
+    available = int((window - max_output_tokens - prompt_tokens) * (1 - SAFETY_MARGIN))
+    if CONTEXT_TOKEN_CAP:
+        available = min(available, CONTEXT_TOKEN_CAP)
+    return max(available, 0)
+
+
+# === EMPAQUETADO ===
+# Unidades preferidas: articulos > parrafos > frases. Nunca se corta una
+# frase a medias salvo que una sola frase no quepa en el presupuesto.
+_RE_ARTICLE = re.compile(r"(?=^\s*(?:Art[íi]culo|ART[ÍI]CULO|Art\.)\s+\d+)", re.MULTILINE)
+_RE_PARAGRAPH = re.compile(r"\n\s*\n|\n(?=\s*(?:\d+\.|[a-z]\)|[-•·]))")
+_RE_SENTENCE = re.compile(r"(?<=[.;:!?])\s+(?=[A-ZÁÉÍÓÚÑ¿¡\d])")
+
+
+def split_units(text):
+    """Trocea el texto crudo en articulos y, dentro de ellos, en parrafos."""
+    for article in _RE_ARTICLE.split(text):
+        paragraphs = [_clean_text(p) for p in _RE_PARAGRAPH.split(article)]
+        paragraphs = [p for p in paragraphs if p]
+        if paragraphs:
+            yield paragraphs
+
+
+def split_sentences(paragraph):
+    return _RE_SENTENCE.split(paragraph)
+
+
+def _fit_sentences(paragraph, budget):
+    """Frases completas de `paragraph` que caben en `budget` tokens."""
+    taken, used = [], 0
+    for sentence in split_sentences(paragraph):
+        cost = estimate_tokens(sentence) + 1
+        if used + cost > budget:
+            break
+        taken.append(sentence)
+        used += cost
+    return " ".join(taken), used
+
+
+def pack_context(text, token_budget):
+    """
+    Devuelve (contexto, tokens_estimados) con el mayor prefijo del documento que
+    cabe en `token_budget`, respetando articulos, parrafos y frases completas.
+    """
+    if not text or token_budget <= 0:
+        return "", 0
+
+    # Caso comun: el documento entero cabe
+    clean = _clean_text(text)
+    total = estimate_tokens(clean)
+    if total <= token_budget:
+        return clean, total
+
+    parts, used = [], 0
+    for paragraphs in split_units(text):
+        article = " ".join(paragraphs)
+        cost = estimate_tokens(article) + 1
+        if used + cost <= token_budget:
+            parts.append(article)
+            used += cost
+            continue
+
+        # El articulo entero no cabe: meter parrafos completos y, del primero
+        # que no quepa, solo frases completas.
+        for paragraph in paragraphs:
+            cost = estimate_tokens(paragraph) + 1
+            if used + cost <= token_budget:
+                parts.append(paragraph)
+                used += cost
+                continue
+            partial, partial_cost = _fit_sentences(paragraph, token_budget - used)
+            if partial:
+                parts.append(partial)
+                used += partial_cost
+            break
+        break
+
+    if not parts:
+        # Texto sin estructura (PDF sin puntuacion): corte por caracteres en un espacio
+        cut = clean[:token_budget * 3]
+        cut = cut[:cut.rfind(" ")] if " " in cut else cut
+        return cut, estimate_tokens(cut)
+
+    return " ".join(parts), used
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import re
+import time
+
+from budget import context_budget, estimate_tokens, split_sentences, split_units
+from coverage import Document
+from pipeline import parse_questions
+from scheduler import Overloaded
+from storage import data_path
+from usage import attempt_usage, usage_ledger
+
+
+# === FICHAS DE HECHOS (CONDENSACION) ===
+# Los PDFs de temario son sobre todo prosa alrededor de unos pocos datos
+# de examen (plazos, organos, porcentajes). Una pasada unica por documento
+# genera una "ficha" compacta que se cachea por hash y se usa como contexto
+# en los examenes siguientes.
+#   - "local":  extractor heuristico, sin llamadas a la IA.
+#   - "engine": el motor configurado resume el documento (una vez).
+
+CONDENSE_MODES = ("off", "local", "engine")
+
+# Tamano maximo de cada trozo enviado al motor para condensar
+CONDENSE_GROUP_TOKENS = 30000
+MAX_FACT_CHARS = 400
+
+# Frases con datos examinables
+_RE_FACT = re.compile(
+    r"\d|%|\bplazos?\b|\bd[ií]as?\b|\bmes(?:es)?\b|\baños?\b|\bh[áa]biles\b|"
+    r"\b[óo]rganos?\b|\bminist|\bconsejo\b|\bsecretar|\bdirecci[óo]n\b|\bdelegaci|"
+    r"\bcompeten|\bcorresponde\b|\bdeber[áa]n?\b|\bpodr[áa]n?\b|\bno\s+podr|"
+    r"\bsalvo\b|\bexcepto\b|\bexcepci|\bmayor[íi]a\b|\bqu[óo]rum\b|\bnulidad\b|\banulab",
+    re.IGNORECASE,
+)
+_RE_ARTICLE_HEAD = re.compile(r"^(?:Art[íi]culo|ART[ÍI]CULO|Art\.)\s+\d+[^.]*\.(?:\s*[^.]{0,80}\.)?")
+
+CONDENSE_PROMPT = """
+    Rol: Preparador Oposiciones TAI. Vas a preparar una FICHA DE HECHOS de examen.
+
+    Del documento de abajo extrae TODOS los datos examinables, uno por elemento:
+    plazos, organos competentes, porcentajes, mayorias, cifras, fechas,
+    requisitos, excepciones y enumeraciones cerradas.
+
+    REGLAS:
+    - Cada hecho es una frase corta y autocontenida; indica el articulo si aparece.
+    - Copia los datos EXACTOS (no redondees plazos ni cambies organos).
+    - No anadas nada que no este en el documento.
+
+    Formato JSON (lista de cadenas):
+    ["Art. 21: El plazo maximo para resolver es de 3 meses.", "..."]
+    """
+
+
+def _cache_path(doc_id, method):
+    return data_path("factsheets", f"{doc_id}.{method}.json")
+
+
+def load_fact_sheet(doc_id, method):
+    try:
+        with open(_cache_path(doc_id, method), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _store_fact_sheet(doc, method, text):
+    sheet = {
+        "doc_id": doc.id,
+        "name": doc.name,
+        "method": method,
+        "text": text,
+        "source_tokens": estimate_tokens(doc.text),
+        "tokens": estimate_tokens(text),
+        "created": time.time(),
+    }
+    with open(_cache_path(doc.id, method), "w", encoding="utf-8") as f:
+        json.dump(sheet, f, ensure_ascii=False)
+    return sheet
+
+
+def local_fact_sheet(text):
+    """Extractor heuristico: cabeceras de articulo + frases con datos."""
+    lines = []
+    for paragraphs in split_units(text):
+        header = _RE_ARTICLE_HEAD.match(paragraphs[0])
+        if header:
+            lines.append(header.group(0))
+        for paragraph in paragraphs:
+            for sentence in split_sentences(paragraph):
+                if header and sentence in header.group(0):
+                    continue
+                if _RE_FACT.search(sentence):
+                    lines.append(f"- {sentence[:MAX_FACT_CHARS]}")
+    return "\n".join(lines)
+
+
+def cached_document(doc, mode):
+    """Ficha ya cacheada para `doc` (la del motor tiene prioridad) o None."""
+    if mode == "off":
+        return None
+    # En modo "local" tambien vale una ficha del motor hecha antes
+    methods = ("engine", "local") if mode == "local" else ("engine",)
+    for method in methods:
+        sheet = load_fact_sheet(doc.id, method)
+        if sheet and sheet["text"]:
+            return Document(sheet["text"], doc.name)
+    return None
+
+
+def local_document(doc):
+    """Ficha heuristica (cacheada) de `doc` como nuevo Document."""
+    sheet = load_fact_sheet(doc.id, "local") or _store_fact_sheet(doc, "local", local_fact_sheet(doc.text))
+    return Document(sheet["text"], doc.name) if sheet["text"] else doc
+
+
+async def condense_document(doc, mode, engine, result, slot=None):
+    """
+    Async generator: emite logs y deja en result["document"] el Document a
+    usar como contexto (la ficha, o el original si no se pudo condensar).
+    Con `slot` (scheduler.EngineSlot) cada intento espera turno en la cola
+    del motor que lo atiende, como en engines._request_questions.
+    """
+    result["document"] = doc
+    if mode not in ("local", "engine"):
+        return
+
+    cached = cached_document(doc, mode)
+    if cached:
+        result["document"] = cached
+        yield {"type": "log", "msg": f"[FICHA] {doc.name}: ficha cacheada (~{estimate_tokens(cached.text)} tokens)."}
+        return
+
+    if mode == "local" or engine is None or engine.check_ready():
+        result["document"] = local_document(doc)
+        yield {"type": "log", "msg": f"[FICHA] {doc.name}: ficha heuristica de ~{estimate_tokens(result['document'].text)} tokens (original ~{estimate_tokens(doc.text)})."}
+        return
+
+    # Pasada unica con el motor: trozos de chunks completos dentro del presupuesto
+    model, label = engine.attempt_target(0)
+    overhead = estimate_tokens(CONDENSE_PROMPT)
+    group_budget = min(context_budget(engine.provider(0).name, model, engine.max_output_tokens, overhead), CONDENSE_GROUP_TOKENS)
+    groups, current, used = [], [], 0
+    for chunk, cost in zip(doc.chunks, doc.costs):
+        if current and used + cost > group_budget:
+            groups.append(" ".join(current))
+            current, used = [], 0
+        current.append(chunk)
+        used += cost
+    if current:
+        groups.append(" ".join(current))
+
+    yield {"type": "log", "msg": f"[FICHA] Condensando {doc.name} con {model or engine.display_name} ({len(groups)} bloques)..."}
+    facts = []
+    for group_idx, group in enumerate(groups):
+        prompt = f"{CONDENSE_PROMPT}\n\nDOCUMENTO:\n{group}"
+        for attempt in range(engine.max_retries):
+            model, label = engine.attempt_target(attempt)
+            provider = engine.provider(attempt)
+            if slot is not None and slot.engine != provider.name:
+                try:
+                    async for item in slot.acquire(provider.name, provider.display_name):
+                        yield item
+                except Overloaded as e:
+                    yield {"type": "log", "msg": f"[FICHA] Bloque {group_idx+1}: {e}"}
+                    continue
+            provider.usage, raw_text = None, None
+            try:
+                raw_text = await engine.complete(prompt, model, attempt)
+                items, _ = parse_questions(raw_text)
+                usage_ledger.record(provider.name, model, label, "", attempt_usage(provider, prompt, raw_text), True, purpose="condense")
+                facts.extend(f"- {item}" for item in items if isinstance(item, str) and item.strip())
+                break
+            except Exception as e:
+                usage_ledger.record(provider.name, model, label, "", attempt_usage(provider, prompt, raw_text), False, purpose="condense")
+                yield {"type": "log", "msg": f"[FICHA] Bloque {group_idx+1}: {type(e).__name__}: {str(e)[:150]}"}
+                if attempt < engine.max_retries - 1:
+                    delay, _ = engine.retry_delay(attempt, e)
+                    await asyncio.sleep(delay)
+        else:
+            # Un bloque sin resumen: se conserva su extraccion heuristica
+            facts.append(local_fact_sheet(group))
+
+    if not any(facts):
+        result["document"] = local_document(doc)
+        yield {"type": "log", "msg": f"[FICHA] {doc.name}: el motor no devolvio hechos. Usando ficha heuristica."}
+        return
+
+    sheet = _store_fact_sheet(doc, "engine", "\n".join(facts))
+    result["document"] = Document(sheet["text"], doc.name)
+    yield {"type": "log", "msg": f"[FICHA] {doc.name}: ficha de ~{sheet['tokens']} tokens (original ~{sheet['source_tokens']}). Cacheada."}
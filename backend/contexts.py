@@ -0,0 +1,139 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from coverage import Document
+from logs import get_logger
+from storage import data_path
+
+log = get_logger("contexts")
+
+
+# === ALMACEN DE CONTEXTOS ===
+# El texto extraido de un documento se guarda una vez en el servidor, con su
+# hash (sha256) como identificador. Por SSE solo viaja {id, nombre, vista
+# previa}; los examenes siguientes envian context_id en lugar de reenviar el
+# documento entero. Los ultimos contextos usados se mantienen en memoria como
+# Document, con sus chunks y vectores ya calculados.
+
+CONTEXT_DIR = "contexts"
+CONTEXT_TTL_SECONDS = int(os.getenv("CONTEXT_TTL_SECONDS", str(30 * 24 * 3600)))
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "8"))
+PREVIEW_CHARS = 280
+CLEANUP_INTERVAL = 3600
+
+_RE_CONTEXT_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+def valid_context_id(context_id):
+    return bool(context_id and _RE_CONTEXT_ID.match(context_id))
+
+
+def preview(text):
+    """Primeras lineas del texto, con los espacios normalizados."""
+    flat = " ".join(text[:PREVIEW_CHARS * 2].split())
+    return flat if len(flat) <= PREVIEW_CHARS else flat[:PREVIEW_CHARS].rstrip() + "…"
+
+
+class ContextStore:
+    """DATA_DIR/contexts/<sha256>.json + LRU en memoria de Document."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._last_cleanup = 0.0
+
+    def _path(self, context_id):
+        return data_path(CONTEXT_DIR, f"{context_id}.json")
+
+    def _remember(self, doc):
+        with self._lock:
+            self._cache[doc.id] = doc
+            self._cache.move_to_end(doc.id)
+            while len(self._cache) > CONTEXT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def put(self, text, name="contexto"):
+        """Guarda `text` (si no estaba) y devuelve su Document cacheado."""
+        doc = Document(text, name)
+        with self._lock:
+            cached = self._cache.get(doc.id)
+        if cached:
+            self._remember(cached)
+            self._touch(doc.id)
+            return cached
+        path = self._path(doc.id)
+        if os.path.exists(path):
+            self._touch(doc.id)
+        else:
+            record = {"id": doc.id, "name": name, "chars": len(text), "created": time.time(), "text": text}
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        self._remember(doc)
+        if time.time() - self._last_cleanup > CLEANUP_INTERVAL:
+            self.cleanup()
+        return doc
+
+    def exists(self, context_id):
+        return valid_context_id(context_id) and os.path.exists(self._path(context_id))
+
+    def load(self, context_id):
+        """Registro guardado ({id, name, chars, created, text}) o None."""
+        if not valid_context_id(context_id):
+            return None
+        try:
+            with open(self._path(context_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, context_id):
+        """Document del contexto (de memoria si esta) o None si no existe/caduco."""
+        if not valid_context_id(context_id):
+            return None
+        with self._lock:
+            doc = self._cache.get(context_id)
+        if doc is None:
+            record = self.load(context_id)
+            if not record:
+                return None
+            doc = Document(record["text"], record.get("name") or "contexto previo")
+        self._remember(doc)
+        self._touch(context_id)
+        return doc
+
+    def _touch(self, context_id):
+        """La caducidad cuenta desde el ultimo uso (mtime)."""
+        try:
+            os.utime(self._path(context_id))
+        except OSError:
+            pass
+
+    def cleanup(self):
+        """Borra contextos sin usar desde hace CONTEXT_TTL_SECONDS."""
+        self._last_cleanup = time.time()
+        cutoff = time.time() - CONTEXT_TTL_SECONDS
+        directory = os.path.dirname(self._path("x"))
+        removed = 0
+        for entry in os.scandir(directory):
+            try:
+                if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        if removed:
+            log.info("Contextos caducados eliminados", count=removed)
+
+
+def context_event(doc):
+    """Evento SSE que sustituye al texto completo del contexto."""
+    return {"type": "context", "id": doc.id, "name": doc.name, "chars": len(doc.text), "preview": preview(doc.text)}
+
+
+context_store = ContextStore()
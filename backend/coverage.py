@@ -0,0 +1,180 @@
+import threading
+import time
+
+import numpy as np
+
+from budget import estimate_tokens, pack_context, split_units
+from dedup import question_text, vectorize
+from storage import SAVE_DELAY_SECONDS, DeferredSave, content_hash, load_json
+
+
+# === COBERTURA POR DOCUMENTO ===
+# Cada documento se trocea en chunks estables (articulos/parrafos agrupados)
+# y se guarda, por hash del documento, un bitmap de los chunks que ya han
+# producido preguntas. El selector de contexto prioriza los chunks no
+# cubiertos, asi examenes repetidos sobre el mismo PDF recorren todo el temario.
+
+COVERAGE_FILE = "coverage.json"
+CHUNK_TOKENS = 600
+# Similitud minima para atribuir una pregunta a un chunk
+MIN_ATTRIBUTION = 0.05
+
+
+class Document:
+    """Documento de referencia troceado en chunks para el selector de contexto."""
+
+    def __init__(self, text, name="contexto"):
+        self.text = text
+        self.name = name
+        self.id = content_hash(text)
+        self._chunks = None
+        self._costs = None
+        self._vectors = None
+
+    @property
+    def chunks(self):
+        if self._chunks is None:
+            chunks, current, current_tokens = [], [], 0
+            for paragraphs in split_units(self.text):
+                for paragraph in paragraphs:
+                    current.append(paragraph)
+                    current_tokens += estimate_tokens(paragraph) + 1
+                    if current_tokens >= CHUNK_TOKENS:
+                        chunks.append(" ".join(current))
+                        current, current_tokens = [], 0
+            if current:
+                chunks.append(" ".join(current))
+            self._chunks = chunks
+            self._costs = [estimate_tokens(c) + 1 for c in chunks]
+        return self._chunks
+
+    @property
+    def costs(self):
+        """Tokens estimados de cada chunk."""
+        self.chunks
+        return self._costs
+
+    @property
+    def vectors(self):
+        if self._vectors is None:
+            self._vectors = vectorize(self.chunks)
+        return self._vectors
+
+    def pack(self, token_budget):
+        """Contexto dentro de `token_budget` priorizando los chunks no cubiertos."""
+        return coverage_store.select(self, token_budget)
+
+
+class CoverageStore:
+    """Bitmaps de cobertura persistidos en DATA_DIR/coverage.json."""
+
+    def __init__(self, filename=COVERAGE_FILE, save_delay=SAVE_DELAY_SECONDS):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._docs = load_json(filename, {})
+        # Se guarda en segundo plano: record() corre en el bucle de eventos
+        self._saver = DeferredSave(filename, self._snapshot, save_delay)
+
+    def _mask(self, doc):
+        entry = self._docs.get(doc.id)
+        return int(entry["bitmap"], 16) if entry else 0
+
+    def select(self, doc, token_budget):
+        """
+        Devuelve (contexto, tokens). Llena el presupuesto con chunks completos,
+        primero los no cubiertos, y los concatena en orden de documento.
+        """
+        chunks = doc.chunks
+        if not chunks or token_budget <= 0:
+            return "", 0
+        costs = doc.costs
+        if sum(costs) <= token_budget:
+            return " ".join(chunks), sum(costs)
+
+        with self._lock:
+            mask = self._mask(doc)
+        full = (1 << len(chunks)) - 1
+        if mask & full == full:
+            # Temario completo: empieza una vuelta nueva
+            mask = 0
+
+        uncovered = [i for i in range(len(chunks)) if not mask >> i & 1]
+        covered = [i for i in range(len(chunks)) if mask >> i & 1]
+
+        selected, used = [], 0
+        for i in uncovered + covered:
+            if used + costs[i] <= token_budget:
+                selected.append(i)
+                used += costs[i]
+
+        if not selected:
+            # Ningun chunk cabe entero: frases completas del primero sin cubrir
+            return pack_context(chunks[(uncovered or covered)[0]], token_budget)
+
+        selected.sort()
+        return " ".join(chunks[i] for i in selected), used
+
+    def record(self, docs, questions):
+        """
+        Atribuye cada pregunta al chunk mas parecido (entre todos los `docs`)
+        y marca esos chunks como cubiertos. Devuelve {doc.id: porcentaje}.
+        """
+        docs = [d for d in docs if d.chunks]
+        if not docs or not questions:
+            return {}
+
+        q_vectors = vectorize([question_text(q) + " " + str(q.get("explanation", "")) for q in questions])
+        # Similitud de cada pregunta contra todos los chunks de todos los documentos
+        owners = [(d, i) for d in docs for i in range(len(d.chunks))]
+        sims = q_vectors @ np.vstack([d.vectors for d in docs]).T
+        best = sims.argmax(axis=1)
+
+        with self._lock:
+            for q_idx, col in enumerate(best):
+                if sims[q_idx, col] < MIN_ATTRIBUTION:
+                    continue
+                doc, chunk_idx = owners[col]
+                entry = self._docs.setdefault(doc.id, {"name": doc.name, "chunks": len(doc.chunks), "bitmap": "0"})
+                mask = int(entry["bitmap"], 16)
+                full = (1 << len(doc.chunks)) - 1
+                if mask & full == full:
+                    mask = 0  # vuelta nueva (ver select)
+                entry["bitmap"] = format(mask | (1 << int(chunk_idx)), "x")
+                entry["name"] = doc.name
+                entry["updated"] = time.time()
+            percents = {d.id: self._percent(self._docs.get(d.id)) for d in docs}
+        self._saver.mark()
+        return percents
+
+    def _snapshot(self):
+        # Copia de cada entrada: record() las modifica en sitio
+        with self._lock:
+            return {doc_id: dict(entry) for doc_id, entry in self._docs.items()}
+
+    def flush(self):
+        self._saver.flush()
+
+    @staticmethod
+    def _percent(entry):
+        if not entry or not entry["chunks"]:
+            return 0.0
+        covered = bin(int(entry["bitmap"], 16)).count("1")
+        return round(100.0 * covered / entry["chunks"], 1)
+
+    def summary(self):
+        """Cobertura por documento/tema, para el endpoint /coverage."""
+        with self._lock:
+            items = list(self._docs.items())
+        return [
+            {
+                "doc_id": doc_id,
+                "name": entry.get("name"),
+                "chunks": entry["chunks"],
+                "covered": bin(int(entry["bitmap"], 16)).count("1"),
+                "percent": self._percent(entry),
+            }
+            for doc_id, entry in sorted(items, key=lambda kv: kv[1].get("name") or "")
+        ]
+
+
+coverage_store = CoverageStore()
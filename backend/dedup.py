@@ -0,0 +1,149 @@
+import os
+import threading
+import unicodedata
+import zlib
+
+import numpy as np
+
+from questions import Question
+from storage import SAVE_DELAY_SECONDS, DeferredSave, load_json
+
+
+# === DEDUPLICACION SEMANTICA DE PREGUNTAS ===
+# Vectores de n-gramas de caracteres con hashing (sin modelo externo) y
+# similitud coseno con NumPy. Detecta preguntas casi identicas dentro de un
+# lote y frente a los examenes recientes del mismo cliente.
+
+NGRAM = 3
+DIM = 1 << 12  # potencia de 2: el hash se reduce con una mascara
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+
+# Historial por cliente (preguntas de examenes recientes)
+HISTORY_FILE = "recent_questions.json"
+HISTORY_SIZE = 300
+
+
+def _normalize(text):
+    """Minusculas, sin tildes y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+
+def question_text(question):
+    """Texto que identifica una pregunta: enunciado + opcion correcta."""
+    if isinstance(question, str):
+        return question
+    if isinstance(question, Question):
+        return f"{question.question} {question.answer}"
+    stem = str(question.get("question", ""))
+    options = question.get("options") or []
+    idx = question.get("correct_index", 0)
+    answer = options[idx] if isinstance(idx, int) and 0 <= idx < len(options) else ""
+    return f"{stem} {answer}"
+
+
+def vectorize(texts):
+    """Matriz (len(texts), DIM) de n-gramas hasheados, normalizada L2."""
+    matrix = np.zeros((len(texts), DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        padded = f" {_normalize(text)} "
+        grams = [padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)]
+        if grams:
+            idx = [zlib.crc32(g.encode("utf-8")) & (DIM - 1) for g in grams]
+            matrix[row] = np.bincount(idx, minlength=DIM)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def find_duplicates(questions, seen_vectors=None, threshold=DEDUP_THRESHOLD):
+    """
+    Devuelve (indices_a_mantener, indices_duplicados).
+    Una pregunta es duplicada si se parece a una anterior del lote ya
+    aceptada o a cualquiera de `seen_vectors` (historial).
+    """
+    if not questions:
+        return [], []
+    vectors = vectorize([question_text(q) for q in questions])
+
+    # Similitud contra el historial en una sola multiplicacion
+    if seen_vectors is not None and len(seen_vectors):
+        against_seen = (vectors @ seen_vectors.T).max(axis=1)
+    else:
+        against_seen = np.zeros(len(questions), dtype=np.float32)
+
+    within = vectors @ vectors.T
+    keep, dropped = [], []
+    for i in range(len(questions)):
+        if against_seen[i] >= threshold or (keep and within[i, keep].max() >= threshold):
+            dropped.append(i)
+        else:
+            keep.append(i)
+    return keep, dropped
+
+
+class RecentQuestions:
+    """
+    Historial de las ultimas preguntas servidas por cliente. Persistente en
+    DATA_DIR/`filename`; con filename=None solo en memoria (p.ej. un lote).
+    """
+
+    def __init__(self, filename=HISTORY_FILE, size=HISTORY_SIZE, save_delay=SAVE_DELAY_SECONDS):
+        self.filename = filename
+        self.size = size
+        self._lock = threading.Lock()
+        self._texts = load_json(filename, {}) if filename else {}
+        self._vectors = {}
+        # Se guarda en segundo plano: add() corre en el bucle de eventos
+        self._saver = DeferredSave(filename, self._snapshot, save_delay) if filename else None
+
+    def vectors(self, client_id):
+        """Vectores del historial de `client_id` (cacheados en memoria)."""
+        with self._lock:
+            if client_id not in self._vectors:
+                self._vectors[client_id] = vectorize(self._texts.get(client_id, []))
+            return self._vectors[client_id]
+
+    def add(self, client_id, questions):
+        texts = [question_text(q) for q in questions]
+        with self._lock:
+            history = (self._texts.get(client_id, []) + texts)[-self.size:]
+            self._texts[client_id] = history
+            self._vectors.pop(client_id, None)
+        if self._saver:
+            self._saver.mark()
+
+    def _snapshot(self):
+        with self._lock:
+            return dict(self._texts)
+
+    def flush(self):
+        if self._saver:
+            self._saver.flush()
+
+
+class PendingQuestions:
+    """
+    Historial de una generacion especulativa (una precarga): deduplica contra
+    `history` pero sus preguntas solo entran en el cuando commit() confirma
+    que se entregaron. Si nadie la reclama, no ocupa el historial del cliente.
+    """
+
+    def __init__(self, history):
+        self.history = history
+        self.pending = []
+
+    def vectors(self, client_id):
+        return self.history.vectors(client_id)
+
+    def add(self, client_id, questions):
+        self.pending.append((client_id, questions))
+
+    def commit(self):
+        pending, self.pending = self.pending, []
+        for client_id, questions in pending:
+            self.history.add(client_id, questions)
+
+
+recent_questions = RecentQuestions()
@@ -0,0 +1,461 @@
+import asyncio
+import importlib
+import threading
+import time
+
+import numpy as np
+
+from budget import context_budget, estimate_tokens, pack_context
+from dedup import find_duplicates, question_text, recent_questions, vectorize
+from logs import get_logger
+from metrics import (
+    CANCELLED,
+    CANCELLED_ATTEMPTS_SAVED,
+    CANCELLED_SLEEP_SAVED,
+    FALLBACKS,
+    IMPORT_SECONDS,
+    PARSE_FAILURES,
+    RETRIES,
+    STAGE_SECONDS,
+)
+from pipeline import (
+    ParseError,
+    build_exam_prompt,
+    parse_questions,
+    process_questions,
+    DEFAULT_CONTEXT_RULES,
+)
+from questions import renumber, to_json_list
+from routing import router
+from scheduler import Overloaded
+from tracing import Trace
+from usage import Usage, attempt_usage, over_request_budget, usage_ledger
+
+log = get_logger("engines")
+
+
+# === REGISTRO DE MOTORES ===
+# Cada motor (gemini, groq, ollama...) se registra con @register_engine("nombre").
+# main.py solo conoce el registro; anadir un motor nuevo = un modulo con una
+# subclase de EngineProvider que implemente el transporte (complete) y su
+# entrada en ENGINE_MODULES.
+# Los modulos se importan la primera vez que se pide el motor (google.genai
+# por si solo tarda casi medio segundo): el arranque no espera a ninguno.
+ENGINES = {}
+ENGINE_MODULES = {"gemini": "gemini_client", "groq": "groq_client", "ollama": "ollama_client", "auto": "auto_client"}
+DEFAULT_ENGINE = "gemini"
+# Segundos que tardo la importacion de cada modulo de motor ya cargado
+IMPORT_TIMES = {}
+# Reentrante: auto_client carga los demas motores mientras se importa
+_load_lock = threading.RLock()
+
+# Rondas maximas pidiendo reemplazos de preguntas duplicadas
+MAX_REPLACEMENT_ROUNDS = 2
+
+
+def register_engine(name):
+    """Decorador: registra una subclase de EngineProvider bajo `name`."""
+    def decorator(cls):
+        cls.name = name
+        ENGINES[name] = cls
+        return cls
+    return decorator
+
+
+def load_engine(name):
+    """Importa (una sola vez) el modulo del motor `name`; devuelve su clase o None."""
+    if name in ENGINES:
+        return ENGINES[name]
+    module = ENGINE_MODULES.get(name)
+    if module is None:
+        return None
+    with _load_lock:
+        if name not in ENGINES:
+            started = time.perf_counter()
+            importlib.import_module(module)
+            IMPORT_TIMES[module] = seconds = time.perf_counter() - started
+            IMPORT_SECONDS.set(seconds, module=module)
+            log.info("Motor cargado", engine=name, module=module, import_ms=round(seconds * 1000, 1))
+    return ENGINES.get(name)
+
+
+def get_engine(name, **options):
+    """Instancia el motor `name` (por defecto gemini si no existe), cargandolo si hace falta."""
+    cls = load_engine(name) or load_engine(DEFAULT_ENGINE)
+    return cls(**options)
+
+
+def engine_status():
+    """{motor: {"loaded", "import_ms"}} para /ready."""
+    return {
+        name: {"loaded": name in ENGINES,
+               "import_ms": round(IMPORT_TIMES[module] * 1000, 1) if module in IMPORT_TIMES else None}
+        for name, module in ENGINE_MODULES.items()
+    }
+
+
+class EngineProvider:
+    """
+    Interfaz comun de los motores. Las subclases solo implementan el
+    transporte (`complete`) y, si lo necesitan, la politica de reintentos.
+    El prompt, el parseo y el blindaje son compartidos (pipeline.py).
+    """
+
+    name = "base"
+    display_name = "Motor"
+    max_retries = 3
+    max_output_tokens = 4000
+    # Modelo al que se baja al agotar el presupuesto de tokens (None = no hay)
+    budget_model = None
+
+    # Ajustes de prompt por motor
+    strict_json = False
+    context_rules = DEFAULT_CONTEXT_RULES
+    prompt_suffix = ""
+
+    def __init__(self, **options):
+        self.options = options
+        self.first_byte_at = None
+        self.usage = None
+        self.downshifted = False
+
+    def mark_first_byte(self):
+        """Los transportes lo llaman al recibir las cabeceras (metrica TTFB)."""
+        self.first_byte_at = time.perf_counter()
+
+    def record_usage(self, prompt_tokens, output_tokens):
+        """Los transportes lo llaman con los tokens que declara la respuesta."""
+        self.usage = Usage(int(prompt_tokens or 0), int(output_tokens or 0))
+
+    def downshift(self):
+        """Pasa los intentos siguientes a budget_model; False si el motor no tiene uno."""
+        if not self.budget_model:
+            return False
+        self.downshifted = True
+        return True
+
+    # --- Hooks a implementar / sobreescribir ---
+    def check_ready(self):
+        """Devuelve un mensaje de error si el motor no puede usarse, o None."""
+        return None
+
+    def start_logs(self, num_questions, difficulty):
+        return [f"[INICIO] {num_questions} preguntas | Dificultad: {difficulty} | Motor: {self.display_name}"]
+
+    def attempt_target(self, attempt):
+        """(modelo, etiqueta de llave/proyecto) usados en el intento `attempt`."""
+        return self.options.get("model_name") or "", self.display_name
+
+    def provider(self, attempt):
+        """Motor real que atiende el intento `attempt` (distinto de self solo en "auto")."""
+        return self
+
+    def engine_names(self):
+        """Motores reales que puede usar esta peticion."""
+        return [self.name]
+
+    async def complete(self, prompt, model, attempt):
+        """Transporte: envia el prompt y devuelve el texto crudo de la respuesta."""
+        raise NotImplementedError
+
+    def retry_delay(self, attempt, error):
+        """(segundos, mensaje) a esperar antes del siguiente intento."""
+        return 5, "[DEBUG] Error inesperado. Probando de nuevo en 5s..."
+
+    # --- Prompt ---
+    def build_prompt(self, num_questions, difficulty, context, topic, mode, avoid=None):
+        return build_exam_prompt(
+            num_questions, difficulty, context, topic=topic, mode=mode,
+            strict_json=self.strict_json, context_rules=self.context_rules,
+            suffix=self.prompt_suffix, avoid=avoid,
+        )
+
+    def fit_prompt(self, model, num_questions, difficulty, context_text, topic, mode, avoid=None, document=None):
+        """
+        Prompt con el documento empaquetado al presupuesto de tokens del modelo.
+        Con `document` (coverage.Document) se priorizan las partes aun no preguntadas.
+        Devuelve (prompt, contexto_usado, tokens_contexto, presupuesto).
+        """
+        if not context_text:
+            return self.build_prompt(num_questions, difficulty, "", topic, mode, avoid), "", 0, 0
+        # Coste fijo del prompt (reglas + instrucciones) sin el documento
+        overhead = estimate_tokens(self.build_prompt(num_questions, difficulty, " ", topic, mode, avoid))
+        budget = context_budget(self.name, model, self.max_output_tokens, overhead)
+        if document is not None:
+            block_ctx, ctx_tokens = document.pack(budget)
+        else:
+            block_ctx, ctx_tokens = pack_context(context_text, budget)
+        prompt = self.build_prompt(num_questions, difficulty, block_ctx, topic, mode, avoid)
+        return prompt, block_ctx, ctx_tokens, budget
+
+
+# === STREAMING GENERATOR (compartido por todos los motores) ===
+async def _request_questions(engine, count, difficulty, context_text, topic, mode, result, start_attempt=0, avoid=None, document=None, trace=None, slot=None):
+    """
+    Bucle de reintentos de una peticion al motor. Emite logs y deja en
+    `result` las preguntas crudas ("questions") y el intento que funciono
+    ("attempt"), para que las peticiones de reemplazo empiecen en ese tier.
+    Con `slot` (scheduler.EngineSlot) cada intento espera turno en la cola
+    del motor que lo atiende: con "auto" puede no ser el del primer intento.
+    """
+    result["questions"] = []
+    result.setdefault("usage", Usage())
+    result.setdefault("attempts", 0)
+    result.setdefault("cost", 0.0)
+    max_retries = engine.max_retries
+    # El prompt depende del presupuesto del modelo: se construye una vez por modelo
+    prompts = {}
+
+    previous_model = previous_provider = None
+    tier = 0
+    # Etapa en curso y fin de la espera actual, para contar lo ahorrado si se cancela
+    attempt, stage, sleep_until = start_attempt, "prompt_build", None
+    request_span = trace.start_span("engine.request", engine=engine.name, mode=mode, count=count, replacement=bool(avoid))
+
+    try:
+        for attempt in range(start_attempt, max_retries):
+            proceed, msg = over_request_budget(engine, result["usage"].total)
+            if msg:
+                yield {"type": "log", "msg": msg}
+            if not proceed:
+                break
+            model, label = engine.attempt_target(attempt)
+            # Con "auto" cada intento puede ir a un motor distinto: metricas y prompt son del real
+            provider = engine.provider(attempt)
+            labels = {"engine": provider.name, "model": model, "key": label, "mode": mode}
+            if previous_model is not None and (model, provider) != (previous_model, previous_provider):
+                FALLBACKS.inc(engine=provider.name, from_model=previous_model, to_model=model, mode=mode)
+                tier += 1
+                if provider is not previous_provider:
+                    yield {"type": "log", "msg": f"[ROUTER] {previous_provider.display_name} no responde: se pasa a "
+                                                 f"{provider.display_name} ({model or '-'}, {router.describe(provider.name, model)})."}
+            previous_model, previous_provider = model, provider
+            if slot is not None and slot.engine != provider.name:
+                stage = "queue_wait"
+                try:
+                    async for item in slot.acquire(provider.name, provider.display_name):
+                        yield item
+                except Overloaded as e:
+                    # Cola del motor de respaldo llena: se pasa al siguiente intento del plan
+                    yield {"type": "log", "msg": f"[COLA] {e}"}
+                    continue
+            stage = "prompt_build"
+            if (provider.name, model) not in prompts:
+                with STAGE_SECONDS.time(stage="prompt_build", **labels):
+                    prompt, block_ctx, ctx_tokens, budget = provider.fit_prompt(model, count, difficulty, context_text, topic, mode, avoid=avoid, document=document)
+                prompts[provider.name, model] = prompt
+                if block_ctx:
+                    yield {"type": "log", "msg": f"[DEBUG] Contexto de {len(block_ctx)} caracteres (~{ctx_tokens} tokens de {budget} disponibles en {model or provider.display_name}) inyectado."}
+            prompt = prompts[provider.name, model]
+            raw_text = None
+            span = trace.start_span("engine.attempt", parent=request_span, engine=provider.name, model=model, key=label,
+                                    attempt=attempt + 1, **{"model.tier": tier})
+            try:
+                yield {"type": "log", "msg": f"[LOG] Intento {attempt+1}/{max_retries}: Llamando a {model or engine.display_name} con {label}..."}
+                provider.first_byte_at = None
+                provider.usage = None
+                stage = "upstream"
+                started = time.perf_counter()
+                raw_text = await engine.complete(prompt, model, attempt)
+                finished = time.perf_counter()
+                stage = "parse"
+                # Sin marca de cabeceras (SDK sin streaming) el TTFB es el total
+                ttfb = (provider.first_byte_at or finished) - started
+                STAGE_SECONDS.observe(ttfb, stage="upstream_ttfb", **labels)
+                STAGE_SECONDS.observe(finished - started, stage="upstream_total", **labels)
+                span.set(**{"upstream.ttfb_ms": round(ttfb * 1000, 1), "upstream.total_ms": round((finished - started) * 1000, 1)})
+                yield {"type": "log", "msg": f"[{label}] Respuesta recibida. Parseando JSON..."}
+
+                with STAGE_SECONDS.time(stage="json_parse", **labels):
+                    try:
+                        current_questions, cleaned = parse_questions(raw_text)
+                    except ParseError:
+                        PARSE_FAILURES.inc(outcome="failed", **labels)
+                        router.record(provider.name, model, ok=False)
+                        raise
+                usage = attempt_usage(provider, prompt, raw_text)
+                router.record(provider.name, model, ok=True, seconds=finished - started, tokens=usage.output_tokens)
+                _account(result, labels, usage, ok=True, span=span)
+                span.set(**{"parse.outcome": "repaired" if cleaned else "ok", "questions": len(current_questions)})
+                log.info("Respuesta del motor", trace_id=trace.trace_id, attempt=attempt + 1, questions=len(current_questions),
+                         repaired=cleaned, total_ms=round((finished - started) * 1000, 1), **labels)
+                if cleaned:
+                    PARSE_FAILURES.inc(outcome="repaired", **labels)
+                    yield {"type": "log", "msg": f"[{label}] JSON limpiado: {len(current_questions)} preguntas recuperadas."}
+                else:
+                    yield {"type": "log", "msg": f"[{label}] JSON OK: {len(current_questions)} preguntas."}
+                result["questions"] = current_questions
+                result["attempt"] = attempt
+                result["labels"] = labels
+                return
+
+            except ParseError as e:
+                error = e
+                _account(result, labels, attempt_usage(provider, prompt, raw_text), ok=False, span=span)
+                span.set(**{"parse.outcome": "failed"})
+                span.error(e)
+                log.warning("JSON no utilizable", trace_id=trace.trace_id, attempt=attempt + 1, error=str(e),
+                            raw=(raw_text or "")[:150], **labels)
+                yield {"type": "log", "msg": f"[{label}] {e}. Raw: {(raw_text or '')[:150]}..."}
+            except Exception as e:
+                error = e
+                _account(result, labels, attempt_usage(provider, prompt, raw_text), ok=False, span=span)
+                router.record(provider.name, model, ok=False)
+                span.error(e)
+                log.warning("Intento fallido", trace_id=trace.trace_id, attempt=attempt + 1,
+                            error=f"{type(e).__name__}: {str(e)[:200]}", **labels)
+                yield {"type": "log", "msg": f"[ERROR] {type(e).__name__}: {str(e)[:200]}"}
+            finally:
+                span.end()
+
+            if attempt < max_retries - 1:
+                RETRIES.inc(**labels)
+                delay, msg = engine.retry_delay(attempt, error)
+                if delay:
+                    yield {"type": "log", "msg": msg}
+                    stage, sleep_until = "retry_sleep", time.monotonic() + delay
+                    with trace.span("retry.sleep", parent=request_span, **{"sleep.seconds": delay}):
+                        await asyncio.sleep(delay)
+                    sleep_until = None
+    except (asyncio.CancelledError, GeneratorExit):
+        # El cliente se fue: la llamada en vuelo y la espera se abortan aqui
+        CANCELLED.inc(engine=engine.name, mode=mode, stage=stage)
+        CANCELLED_ATTEMPTS_SAVED.inc(max(0, max_retries - attempt - 1), engine=engine.name, mode=mode)
+        if sleep_until is not None:
+            CANCELLED_SLEEP_SAVED.inc(max(0.0, sleep_until - time.monotonic()), engine=engine.name, mode=mode)
+        request_span.set(cancelled=True, **{"cancelled.stage": stage})
+        log.info("Peticion al motor cancelada", trace_id=trace.trace_id, engine=engine.name, mode=mode,
+                 stage=stage, attempt=attempt + 1)
+        raise
+    finally:
+        request_span.set(questions=len(result["questions"]))
+        request_span.end()
+
+
+def _account(result, labels, usage, ok, span):
+    """Anota los tokens del intento en el libro diario y en el total del examen."""
+    result["cost"] += usage_ledger.record(labels["engine"], labels["model"], labels["key"], labels["mode"], usage, ok)
+    result["usage"].prompt_tokens += usage.prompt_tokens
+    result["usage"].output_tokens += usage.output_tokens
+    result["attempts"] += 1
+    span.set(**{"tokens.prompt": usage.prompt_tokens, "tokens.output": usage.output_tokens, "tokens.estimated": usage.estimated})
+
+
+def _usage_log(result):
+    usage = result.get("usage")
+    if not usage or not result.get("attempts"):
+        return None
+    return {"type": "log", "msg": f"[CONSUMO] {usage.total} tokens (entrada {usage.prompt_tokens}, salida "
+                                  f"{usage.output_tokens}) en {result['attempts']} intentos, ~{result['cost']:.4f} USD."}
+
+
+def _observe_pipeline(timings, labels):
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+
+
+async def generate_exam_streaming(engine, num_questions: int, context_text: str = None, topic: str = None, difficulty: str = "Intermedio", mode: str = "manual", client_id: str = None, document=None, trace=None, history=None, slot=None):
+    """
+    Async generator.
+    Yields {"type": "log"} dicts while working and a final list of validated questions.
+    `trace` (tracing.Trace) recibe los spans de intentos, esperas y parseo.
+    `history` (dedup.RecentQuestions) es el historial contra el que se
+    deduplica; por defecto el persistente por cliente.
+    `slot` (scheduler.EngineSlot) es el turno de la peticion; si un intento
+    va a otro motor, el turno se mueve a su cola.
+    """
+    history = history or recent_questions
+    # Sin traza explicita los spans se descartan (la traza nunca se cierra)
+    trace = trace or Trace("generate-exam")
+    error = engine.check_ready()
+    if error:
+        yield {"type": "log", "msg": f"[ERROR] {error}"}
+        return
+
+    for msg in engine.start_logs(num_questions, difficulty):
+        yield {"type": "log", "msg": msg}
+
+    if topic and not context_text:
+        context_text = f"Tema solicitado: {topic}"
+        document = None
+        yield {"type": "log", "msg": f"[INICIO] Tema: {topic}"}
+
+    yield {"type": "log", "msg": f"\n[GENERANDO] Peticion unica de {num_questions} preguntas..."}
+
+    result = {}
+    async for event in _request_questions(engine, num_questions, difficulty, context_text, topic, mode, result, document=document, trace=trace, slot=slot):
+        yield event
+    all_raw_questions = result["questions"]
+
+    # === VALIDATION & OUTPUT ===
+    if not all_raw_questions:
+        yield {"type": "log", "msg": "[ERROR] No se generaron preguntas tras todos los intentos."}
+        if _usage_log(result):
+            yield _usage_log(result)
+        return
+
+    # === BLINDAJE FINAL ===
+    yield {"type": "log", "msg": f"\n[BLINDAJE] Validando coherencia de {len(all_raw_questions)} preguntas totales..."}
+    timings = {}
+    with trace.span("pipeline.process", questions=len(all_raw_questions)) as span:
+        validated, fixes_count = process_questions(all_raw_questions, timings)
+        span.set(fixes=fixes_count, **{f"{k}_ms": round(v * 1000, 3) for k, v in timings.items()})
+    _observe_pipeline(timings, result["labels"])
+
+    if fixes_count > 0:
+        yield {"type": "log", "msg": f"[BLINDAJE] {fixes_count} correcciones de correct_index aplicadas."}
+    else:
+        yield {"type": "log", "msg": "[BLINDAJE] Todas las preguntas son coherentes."}
+
+    # === DEDUPLICACION (lote + examenes recientes) ===
+    seen = history.vectors(client_id) if client_id else None
+    with trace.span("pipeline.dedup", questions=len(validated)) as span:
+        keep, dropped = find_duplicates(validated, seen)
+        span.set(dropped=len(dropped))
+    # Descartadas por parecerse al historial: ultimo recurso si no hay reemplazos
+    backfill = [validated[i] for i in dropped]
+    validated = [validated[i] for i in keep]
+    missing = len(dropped)
+
+    for round_idx in range(MAX_REPLACEMENT_ROUNDS):
+        if not missing:
+            break
+        yield {"type": "log", "msg": f"[DEDUP] Faltan {missing} preguntas por duplicados. Pidiendo reemplazos (ronda {round_idx+1})..."}
+        avoid = [q.question for q in validated]
+        if client_id:
+            # Otros examenes del mismo historial (un lote) han podido terminar mientras tanto
+            seen = history.vectors(client_id)
+        async for event in _request_questions(engine, missing, difficulty, context_text, topic, mode, result,
+                                              start_attempt=result.get("attempt", 0), avoid=avoid, document=document, trace=trace, slot=slot):
+            yield event
+        timings = {}
+        replacements, _ = process_questions(result["questions"], timings)
+        if result["questions"]:
+            _observe_pipeline(timings, result["labels"])
+        # Los reemplazos se comparan con lo ya aceptado y con el historial
+        accepted = vectorize([question_text(q) for q in validated])
+        if seen is not None and len(seen):
+            accepted = np.vstack([seen, accepted])
+        keep, _ = find_duplicates(replacements[:missing], accepted)
+        validated.extend(replacements[i] for i in keep)
+        missing -= len(keep)
+
+    if missing and backfill:
+        # Mejor repetir una pregunta de un examen anterior que servir un examen corto;
+        # los duplicados dentro del propio examen nunca se recuperan.
+        keep, _ = find_duplicates(backfill, vectorize([question_text(q) for q in validated]))
+        recovered = [backfill[i] for i in keep][:missing]
+        validated.extend(recovered)
+        missing -= len(recovered)
+
+    if missing:
+        yield {"type": "log", "msg": f"[DEDUP] {missing} duplicadas sin reemplazo. Se sirven {len(validated)} preguntas."}
+
+    renumber(validated)
+    if client_id and validated:
+        history.add(client_id, validated)
+
+    if _usage_log(result):
+        yield _usage_log(result)
+    yield {"type": "log", "msg": f"\n[COMPLETO] {len(validated)} preguntas generadas y validadas."}
+    yield to_json_list(validated)
@@ -1,14 +1,18 @@
 import os
-import json
-import asyncio
-import re
-import random
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types, errors as genai_errors
 
+from engines import EngineProvider, register_engine
+from logs import get_logger
+from budget import MODEL_PRICES
+from pipeline import ParseError
+from ranking import model_chain
+
 load_dotenv()
 
+log = get_logger("gemini", engine="gemini")
+
 # === MULTI-PROJECT KEY MANAGEMENT ===
 # Each key belongs to an independent GCP project with separate quotas
 PROJECT_KEYS = []
@@ -19,7 +23,9 @@ if _key1:
 if _key2:
     PROJECT_KEYS.append({"label": "Proyecto Backup", "key": _key2})
 
-clients = [genai.Client(api_key=p["key"]) for p in PROJECT_KEYS]
+# GEMINI_BASE_URL redirige el SDK (p.ej. a los servidores falsos de benchmarks/loadgen.py)
+_http_options = types.HttpOptions(base_url=os.getenv("GEMINI_BASE_URL")) if os.getenv("GEMINI_BASE_URL") else None
+clients = [genai.Client(api_key=p["key"], http_options=_http_options) for p in PROJECT_KEYS]
 
 def _get_client_for_attempt(attempt_idx):
     """Returns the client and project label based on attempt step (0-5)."""
@@ -29,10 +35,10 @@ def _get_client_for_attempt(attempt_idx):
     client_idx = attempt_idx % 2
     if client_idx >= len(clients):
         client_idx = 0
-    
+
     if not clients:
         return None, "Sin proyecto"
-        
+
     return clients[client_idx], PROJECT_KEYS[client_idx]["label"]
 
 
@@ -45,457 +51,66 @@ generation_config = types.GenerateContentConfig(
     response_mime_type="application/json",
 )
 
-MODEL_NAME = "gemini-2.0-flash"
-
-
-# === UTILIDADES ===
-def _safe_print(msg):
-    """Print with encoding safety for Windows cp1252 console."""
-    try:
-        print(msg)
-    except UnicodeEncodeError:
-        print(msg.encode('ascii', 'replace').decode('ascii'))
-
-
-def _clean_text(text):
-    """Colapsa saltos de linea y espacios multiples."""
-    if not text:
-        return ""
-    text = re.sub(r'\n+', '\n', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
-
-
-def _clean_json_response(raw_text):
-    """
-    Limpia la respuesta de la IA antes de parsear JSON.
-    Elimina markdown code fences, caracteres de control, texto extra.
-    """
-    if not raw_text:
-        return "[]"
-    
-    text = raw_text.strip()
-    
-    # Remove invisible control characters (BOM, zero-width spaces, etc.)
-    text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\ufeff\u200b\u200c\u200d\u2060]', '', text)
-    
-    # Remove markdown code fences
-    text = re.sub(r'^```(?:json)?\s*\n?', '', text)
-    text = re.sub(r'\n?```\s*$', '', text)
-    text = text.strip()
-    
-    # Find the JSON array
-    if not text.startswith('['):
-        bracket_start = text.find('[')
-        if bracket_start != -1:
-            text = text[bracket_start:]
-    
-    if not text.endswith(']'):
-        bracket_end = text.rfind(']')
-        if bracket_end != -1:
-            text = text[:bracket_end + 1]
-    
-    return text
-
-
-def validate_and_fix_question(question):
-    """
-    BLINDAJE STRICTO: La explicacion es la fuente de la verdad.
-    Si la explicacion dice 'La respuesta correcta es B', el indice DEBE ser 1.
-    """
-    try:
-        explanation = question.get("explanation", "").strip()
-        options = question.get("options", [])
-        correct_idx = question.get("correct_index", 0)
-        
-        # 1. Extraer la letra que la explicacion AFIRMA ser correcta
-        detected_letter = None
-        
-        # Pattern Prioritario: "La respuesta correcta es [la] X" (Formato forzado en prompt)
-        m = re.search(r"respuesta\s+correcta\s+(?:es|sea)\s+(?:la\s+)?([A-D])\b", explanation, re.IGNORECASE)
-        if m:
-            detected_letter = m.group(1).upper()
-        
-        # Fallbacks (por si el modelo alucina el formato)
-        if not detected_letter:
-            # "Correcta: X"
-            m2 = re.search(r"correcta:\s*\[?([A-D])\]?", explanation, re.IGNORECASE)
-            if m2: detected_letter = m2.group(1).upper()
-            
-        if not detected_letter:
-            # Empieza por "X)" o "X."
-            m3 = re.search(r"^([A-D])[).\s]", explanation)
-            if m3: detected_letter = m3.group(1).upper()
-
-        # 2. Aplicar correccion si hay discrepancia
-        if detected_letter:
-            expected_index = ord(detected_letter) - ord('A')
-            
-            # Verificar rango valido
-            if 0 <= expected_index < len(options):
-                if correct_idx != expected_index:
-                    _safe_print(f"[BLINDAJE] Q{question.get('id')}: CORRECCION APLICADA. Indice {correct_idx} ({chr(65+correct_idx)}) -> {expected_index} ({detected_letter}) basado en explicacion.")
-                    question["correct_index"] = expected_index
-            else:
-                 _safe_print(f"[BLINDAJE] Q{question.get('id')}: Letra detectada '{detected_letter}' fuera de rango de opciones. No se puede corregir.")
-        
-        # 3. Validacion final de rango
-        current_idx = question.get("correct_index")
-        if not isinstance(current_idx, int) or current_idx < 0 or current_idx >= len(options):
-             _safe_print(f"[BLINDAJE] Q{question.get('id')}: Indice {current_idx} invalido. Reseteando a 0 (Safeguard).")
-             question["correct_index"] = 0
-
-    except Exception as e:
-        _safe_print(f"[BLINDAJE] Error critico en validacion: {e}")
-    
-    return question
-
-
-
-def shuffle_options(question):
-    """
-    Aleatoriza el orden de las opciones para evitar el sesgo de posicion (siempre A).
-    Actualiza correct_index y la explicacion para reflejar la nueva letra.
-    """
-    try:
-        options = question.get("options", [])
-        current_idx = question.get("correct_index", 0)
-        
-        if not options or len(options) < 2:
-            return question
-            
-        # 1. Identificar la respuesta correcta actual (texto)
-        if current_idx < 0 or current_idx >= len(options):
-            return question # Indice invalido, no tocar
-            
-        correct_text = options[current_idx]
-        
-        # 2. Barajar opciones
-        # Creamos pares (texto, es_correcta)
-        items = [{"text": opt, "is_correct": (i == current_idx)} for i, opt in enumerate(options)]
-        random.shuffle(items)
-        
-        # 3. Reconstruir
-        new_options = [item["text"] for item in items]
-        new_idx = next(i for i, item in enumerate(items) if item["is_correct"])
-        
-        question["options"] = new_options
-        question["correct_index"] = new_idx
-        
-        # 4. Actualizar Explicacion (Reflejar cambio de letra)
-        # El modelo suele escribir "La respuesta correcta es A...".
-        # Debemos cambiar esa A por la nueva letra (B, C, D...).
-        old_letter = chr(65 + current_idx)
-        new_letter = chr(65 + new_idx)
-        
-        if old_letter != new_letter:
-            explanation = question.get("explanation", "")
-            
-            # Regex para patrones comunes de explicacion
-            patterns = [
-                # "La respuesta correcta es (la) X"
-                (r"(respuesta\s+correcta\s+(?:es|sea)\s+(?:la\s+)?){}\b".format(old_letter), r"\g<1>" + new_letter),
-                # "Correcta: X"
-                (r"(correcta:\s*\[?){}\]?".format(old_letter), r"\g<1>" + new_letter),
-                # "Solución: X"
-                (r"(soluci[oó]n:\s*){}\b".format(old_letter), r"\g<1>" + new_letter),
-                # Inicio con "X)" o "X."
-                (r"^{}([.\)])".format(old_letter), new_letter + r"\1")
-            ]
-            
-            for pat, repl in patterns:
-                explanation = re.sub(pat, repl, explanation, flags=re.IGNORECASE)
-                
-            question["explanation"] = explanation
-            
-    except Exception as e:
-        _safe_print(f"[SHUFFLE] Error barajando pregunta {question.get('id')}: {e}")
-        
-    return question
-
-
-def get_base_prompt(num_questions, difficulty, has_context=False):
-    # === REGLAS UNIVERSALES DE BLINDAJE (OPTIMIZADO) ===
-    # 1. UNICIDAD: 1 Verdadera, 3 Falsas.
-    # 2. EXCLUSION: Prohibido "Todas/Ninguna", "A y B".
-    # 3. OBJETIVIDAD: Falsas por dato, no interpretacion.
-    
-    # Requisitos dinámicos según el contexto
-    requisitos_contexto = ""
-    if has_context:
-        requisitos_contexto = "- Cíñete ESTRICTAMENTE al texto proporcionado."
-    else:
-        requisitos_contexto = "- Temas: Administrativo (Leyes 39/40), plazos y datos EXACTOS."
-
-    if difficulty.upper() == "EXPERTO":
-        return f"""
-    Rol: Examinador TAI C1. Genera {num_questions} preguntas.
-    
-    BLINDAJE RESPUESTA UNICA:
-    - REGLA: 1 Verdadera, 3 Falsas indiscutibles.
-    - PROHIBIDO: Compuestas ("Todas", "Ninguna", "A y B").
-    
-    DISTRACTORES (Falsas):
-    - Altera 1 dato objetivo (plazo, organo, condicion).
-    - No inventes normativa ni conceptos. Modifica los reales del texto.
-    
-    REQUISITOS:
-    - Temas: Practicos, sintaxis, excepciones.
-    - 25% Negativas.
-    {requisitos_contexto}
-    
-    PROCESO (SELF-CORRECTION):
-    1. Piensa pregunta y Verdadera.
-    2. Genera 3 Falsas (dato alterado).
-    3. SELF-CHECK: ¿Alguna falsa es defendible? Si -> Reescribela.
-    4. REDACTA explicacion: "La respuesta correcta es [Letra] porque...".
-    5. Verifica: Si dices "Es la B", correct_index=1.
-
-    JSON SCHEMA:
-    [
-        {{
-            "id": 1,
-            "question": "Texto",
-            "options": ["A", "B", "C", "D"],
-            "correct_index": 0,
-            "explanation": "La respuesta correcta es A porque [Breve]..."
-        }}
-    ]
-    """
-    
-    # BASICO / INTERMEDIO (OPTIMIZADO)
-    return f"""
-    Rol: Preparador Oposiciones. Test de {num_questions} preguntas.
-    
-    NIVEL: {difficulty.upper()}
-    
-    REGLAS (BLINDAJE):
-    1. 1 Correcta, 3 Falsas claras.
-    2. PROHIBIDO: "Todas/Ninguna correctas", "A y C".
-    3. FALSAS: Cambia 1 dato concreto.
-    
-    {requisitos_contexto.replace("- Temas:", "REQUISITO:").replace("- ", "")}
-    
-    CRITERIO OBLIGATORIO:
-    - "explanation" DEBE empezar: "La respuesta correcta es [Letra]...".
-    
-    PROCESO:
-    1. Define Correcta.
-    2. Asegura 3 Falsas sin ambiguedad.
-    3. Explicacion: "La respuesta correcta es [Letra]..."
-    4. Asigna correct_index (0=A...).
-    
-    Formato JSON:
-    [
-        {{
-            "id": 1,
-            "question": "Enunciado...",
-            "options": ["A", "B", "C", "D"],
-            "correct_index": 0,
-            "explanation": "La respuesta correcta es A porque..."
-        }}
-    ]
-    """
-
-
-# === STREAMING GENERATOR (Unified with Segmentation) ===
-async def generate_exam_streaming(num_questions: int, context_text: str = None, topic: str = None, difficulty: str = "Intermedio", mode: str = "manual"):
-    """
-    Async generator. 
-    Expert Mode: Splits generation into 2 blocks (Half 1 / Half 2) to ensure full context coverage.
-    Other Modes: Single unified request.
-    """
-    
-    if not clients:
-        yield {"type": "log", "msg": "[ERROR] No hay API Keys configuradas. Revisa .env"}
-        yield [{"id": 1, "question": "Error: API Key no configurada", "options": ["A","B","C","D"], "correct_index": 0, "explanation": "Configura .env"}]
-        return
-
-    # Log inicial
-    _, initial_project = _get_client_for_attempt(0)
-    yield {"type": "log", "msg": f"[INICIO] {num_questions} preguntas | Dificultad: {difficulty} | Proyectos: {len(clients)}"}
-    yield {"type": "log", "msg": f"[INICIO] Proyecto inicial: {initial_project}"}
-
-    if topic and not context_text:
-        context_text = f"Tema solicitado: {topic}"
-        yield {"type": "log", "msg": f"[INICIO] Tema: {topic}"}
-    
-    # === SEGMENTATION STRATEGY ===
-    generation_tasks = []
-    
-    # Standard single block for ALL modes (Expert splitting removed)
-    clean_ctx = _clean_text(context_text) if context_text else ""
-    generation_tasks.append({
-        "context": clean_ctx, 
-        "count": num_questions, 
-        "desc": "completo"
-    })
-
-    all_raw_questions = []
-    max_retries = 6 
-    
-    # === SESSION MEMORY ===
-    # Tracks the best working model tier index (0=2.0, 2=Lite, 4=Exp)
-    # If Block 1 fails on 2.0 and succeeds on Lite (attempt 2), Block 2 starts at attempt 2.
-    current_tier_start = 0 
-
-    # === EXECUTION LOOP ===
-    for task_idx, task in enumerate(generation_tasks):
-        if len(generation_tasks) > 1:
-            yield {"type": "log", "msg": f"\n[EXPERTO] Generando preguntas {task['desc']}..."}
-            if current_tier_start > 0:
-                 model_name = "gemini-2.0-flash-lite" if current_tier_start == 2 else "gemini-exp-1206"
-                 yield {"type": "log", "msg": f"[OPTIMIZACION] Saltando modelos agotados. Iniciando con {model_name} (Tier {current_tier_start})..."}
-        else:
-            yield {"type": "log", "msg": f"\n[GENERANDO] Peticion unica de {num_questions} preguntas..."}
-        
-        # Build Prompt for this block
-        has_content = bool(task["context"] or topic)
-        current_prompt = get_base_prompt(task["count"], difficulty, has_context=has_content)
-        
-        # Inject Topic (Critical for context)
-        if topic:
-             current_prompt += f"\n\nCONTEXTO TEMATICO: {topic}"
-
-        if task["context"]:
-            # Limit context length per block if needed, though splitting helps handling limits naturally
-            # Using 25000 chars roughly per block if full doc is huge
-            block_ctx = task["context"][:30000] 
-            # Use generic header to avoid confusing the model into writing "Según el fragmento..."
-            current_prompt += f"\n\nDOCUMENTO NORMATIVO DE REFERENCIA:\n{block_ctx}"
-            
-            # STRICT CONTEXT INSTRUCTION (REFINED)
-            current_prompt += "\n\n⚠️ INSTRUCCION CRITICA DE JEFE DE TRIBUNAL:"
-            
-            if mode == "simulacro_3":
-                 current_prompt += "\n0. ESTÁS ANTE UN SIMULACRO MULTITEMA (3 Bloques). Debes generar preguntas equilibradas (aprox. una cantidad igual por cada bloque temático)."
-            
-            current_prompt += "\n1. Genera las preguntas BASANDOTE UNICAMENTE EN EL TEXTO DE ARRIBA."
-            current_prompt += "\n2. IMPORTANTE: NO menciones 'el texto', 'el fragmento', 'la fuente' o 'el documento' en los enunciados. Formula la pregunta como si fuera un examen oficial."
-            current_prompt += "\n3. Si el texto es un fragmento, ignora el corte y pregunta solo sobre lo visible, PERO SIN MENCIONAR QUE ES UN FRAGMENTO."
-            
-            yield {"type": "log", "msg": f"[DEBUG] Bloque {task_idx+1}: Contexto de {len(block_ctx)} caracteres inyectado."}
-        
-        # Retry Loop for this Block
-        block_success = False
-        
-        # Start attempts from the memorized tier
-        for attempt in range(current_tier_start, max_retries):
-            try:
-                active_client, project_label = _get_client_for_attempt(attempt)
-                
-                # === MODEL FALLBACK STRATEGY ===
-                # Intentos 0-1: gemini-3-flash-preview
-                # Intentos 2-3: gemini-2.5-flash
-                # Intentos 4-5: gemini-2.0-flash
-                current_model = "gemini-3-flash-preview"
-                if attempt >= 2:
-                    current_model = "gemini-2.5-flash"
-                if attempt >= 4:
-                    current_model = "gemini-2.0-flash"
-                
-                yield {"type": "log", "msg": f"[LOG] Intento {attempt+1}/{max_retries}: Llamando a {current_model} con {project_label}..."}
-                _safe_print(f"[{project_label}] Request start {current_model}...")
-                
-                response = await active_client.aio.models.generate_content(
-                    model=current_model,
-                    contents=current_prompt,
-                    config=generation_config,
-                )
-                
-                raw_text = response.text
-                yield {"type": "log", "msg": f"[{project_label}] Respuesta recibida. Parseando JSON..."}
-                
-                # Robust JSON parsing
-                current_questions = []
-                try:
-                    current_questions = json.loads(raw_text)
-                    yield {"type": "log", "msg": f"[{project_label}] JSON OK: {len(current_questions)} preguntas."}
-                    all_raw_questions.extend(current_questions)
-                    
-                    # === UPDATE SESSION MEMORY ===
-                    # If we succeeded, remember the tier for the next block so we don't start from an exhausted model again.
-                    current_tier_start = attempt
-                    
-                    block_success = True
-                    break # Block Success!
-                except json.JSONDecodeError:
-                    yield {"type": "log", "msg": f"[{project_label}] JSON directo fallo. Limpiando..."}
-                    cleaned_json = _clean_json_response(raw_text)
-                    try:
-                        current_questions = json.loads(cleaned_json)
-                        yield {"type": "log", "msg": f"[{project_label}] JSON limpiado: {len(current_questions)} preguntas recuperadas."}
-                        all_raw_questions.extend(current_questions)
-                        
-                        # === UPDATE SESSION MEMORY ===
-                        current_tier_start = attempt
-
-                        block_success = True
-                        break # Block Success!
-                    except json.JSONDecodeError as je:
-                        yield {"type": "log", "msg": f"[{project_label}] JSON irrecuperable: {je}. Raw: {raw_text[:150]}..."}
-            
-            except genai_errors.ClientError as e:
-                error_str = str(e)
-                yield {"type": "log", "msg": f"[ERROR] ClientError: {error_str[:200]}"}
-                
-                if attempt < max_retries - 1:
-                    if attempt % 2 == 0:
-                        # Falló Proyecto A. Esperar 5s antes de probar Proyecto Backup
-                        yield {"type": "log", "msg": f"[DEBUG] Probando llave backup en 5s..."}
-                        await asyncio.sleep(5)
-                    else:
-                        # Fallaron Proyecto A y Proyecto Backup para este modelo.
-                        # Esperar 15s antes de saltar al siguiente modelo.
-                        yield {"type": "log", "msg": f"[DEBUG] Ambas llaves fallaron. Esperando 15s antes de cambiar de modelo lider..."}
-                        await asyncio.sleep(15)
-                continue
-                        
-            except Exception as e:
-                error_str = str(e)
-                yield {"type": "log", "msg": f"[ERROR] {type(e).__name__}: {error_str[:200]}"}
-                
-                if attempt < max_retries - 1:
-                    if attempt % 2 == 0:
-                        yield {"type": "log", "msg": f"[DEBUG] Error inesperado. Probando llave backup en 5s..."}
-                        await asyncio.sleep(5)
-                    else:
-                        yield {"type": "log", "msg": f"[DEBUG] Error inesperado con ambas llaves. Esperando 15s antes de bajar modelo..."}
-                        await asyncio.sleep(15)
-                continue
-        
-        if not block_success:
-            yield {"type": "log", "msg": f"[ERROR] Fallo critico en bloque {task_idx+1}. Se devolveran resultados parciales."}
-            # Decide whether to stop or continue to next block. 
-            # If prompt integrity is huge, maybe continue? 
-            # But likely we should try next block to salvage something.
-            continue
-
-    # === VALIDATION & OUTPUT ===
-    if all_raw_questions:
-        # === BLINDAJE FINAL ===
-        yield {"type": "log", "msg": f"\n[BLINDAJE] Validando coherencia de {len(all_raw_questions)} preguntas totales..."}
-        
-        validated = []
-        fixes_count = 0
-        for i, q in enumerate(all_raw_questions):
-            if q:
-                q["id"] = i + 1 # Renumber sequentially
-                old_idx = q.get("correct_index")
-                fixed_q = validate_and_fix_question(q)
-                if fixed_q.get("correct_index") != old_idx:
-                    fixes_count += 1
-                
-                # === SHUFFLE PARA EVITAR SESGO ===
-                shuffled_q = shuffle_options(fixed_q)
-                validated.append(shuffled_q)
-        
-        if fixes_count > 0:
-            yield {"type": "log", "msg": f"[BLINDAJE] {fixes_count} correcciones de correct_index aplicadas."}
-        else:
-            yield {"type": "log", "msg": "[BLINDAJE] Todas las preguntas son coherentes."}
-        
-        yield {"type": "log", "msg": f"\n[COMPLETO] {len(validated)} preguntas generadas y validadas."}
-        yield validated
-    else:
-        yield {"type": "log", "msg": "[ERROR] No se generaron preguntas tras todos los intentos."}
+# === MODEL FALLBACK STRATEGY ===
+# Dos intentos por modelo (Proyecto A y Backup), del primero al ultimo:
+# por defecto gemini-3-flash-preview -> gemini-2.5-flash -> gemini-2.0-flash.
+# benchmarks/probe_models.py puede reordenarla con DATA_DIR/model_ranking.json.
+MODEL_CHAIN = model_chain("gemini", ["gemini-3-flash-preview", "gemini-2.5-flash", "gemini-2.0-flash"])
+# Con el presupuesto de tokens agotado (usage.py): el mas barato de la cadena
+BUDGET_MODEL = os.getenv("GEMINI_BUDGET_MODEL") or min(
+    MODEL_CHAIN, key=lambda m: sum(MODEL_PRICES.get(("gemini", m), (float("inf"), 0))))
+
+
+@register_engine("gemini")
+class GeminiEngine(EngineProvider):
+    """Gemini via google-genai, alternando proyectos y bajando de modelo."""
+
+    display_name = "Gemini"
+    max_retries = 2 * len(MODEL_CHAIN)
+    budget_model = BUDGET_MODEL
+    max_output_tokens = generation_config.max_output_tokens
+
+    def check_ready(self):
+        if not clients:
+            return "No hay API Keys configuradas. Revisa .env"
+        return None
+
+    def start_logs(self, num_questions, difficulty):
+        _, initial_project = _get_client_for_attempt(0)
+        return [
+            f"[INICIO] {num_questions} preguntas | Dificultad: {difficulty} | Proyectos: {len(clients)}",
+            f"[INICIO] Proyecto inicial: {initial_project}",
+        ]
+
+    def attempt_target(self, attempt):
+        _, project_label = _get_client_for_attempt(attempt)
+        if self.downshifted:
+            return BUDGET_MODEL, project_label
+        model = MODEL_CHAIN[min(attempt // 2, len(MODEL_CHAIN) - 1)]
+        return model, project_label
+
+    async def complete(self, prompt, model, attempt):
+        active_client, project_label = _get_client_for_attempt(attempt)
+        log.debug("Peticion al modelo", model=model, key=project_label)
+        response = await active_client.aio.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=generation_config,
+        )
+        meta = response.usage_metadata
+        if meta is not None:
+            # Los tokens de razonamiento se facturan como salida
+            self.record_usage(meta.prompt_token_count, (meta.candidates_token_count or 0) + (meta.thoughts_token_count or 0))
+        return response.text
+
+    def retry_delay(self, attempt, error):
+        # JSON roto: el modelo respondio, reintentar sin esperar
+        if isinstance(error, ParseError):
+            return 0, ""
+        kind = "" if isinstance(error, genai_errors.ClientError) else "Error inesperado. "
+        if attempt % 2 == 0:
+            # Falló Proyecto A. Esperar 5s antes de probar Proyecto Backup
+            return 5, f"[DEBUG] {kind}Probando llave backup en 5s..."
+        # Fallaron Proyecto A y Proyecto Backup para este modelo.
+        # Esperar 15s antes de saltar al siguiente modelo.
+        return 15, f"[DEBUG] {kind}Ambas llaves fallaron. Esperando 15s antes de cambiar de modelo lider..."
@@ -0,0 +1,547 @@
+import asyncio
+import json
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+
+from logs import get_logger
+from storage import data_path
+
+log = get_logger("jobs")
+
+
+# === TRABAJOS DURABLES ===
+# POST /jobs lanza la generacion en segundo plano y guarda cada evento SSE
+# (numerado) en SQLite. Un cliente que recarga reanuda con Last-Event-ID
+# desde el ultimo evento recibido, sin regenerar nada. Los trabajos y sus
+# eventos se borran JOB_TTL_SECONDS despues de su ultima actualizacion.
+
+JOBS_DB = "jobs.sqlite3"
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(24 * 3600)))
+CLEANUP_INTERVAL = 300
+# Sin ningun cliente leyendo durante este tiempo, el trabajo se cancela (0 = nunca)
+JOB_ABANDON_SECONDS = float(os.getenv("JOB_ABANDON_SECONDS", "120"))
+
+# "inline": la generacion corre en el proceso web (por defecto).
+# "queue": el proceso web solo encola; la ejecutan los procesos de worker.py.
+JOB_MODE = os.getenv("JOB_MODE", "inline")
+# Un worker renueva su reserva de cada trabajo (y un proceso web la de los
+# trabajos que ejecuta en linea); si deja de hacerlo (proceso muerto, maquina
+# caida) el trabajo se da por interrumpido.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+# worker.py lo activa antes de importar: un worker no debe cerrar los
+# trabajos que esta ejecutando el proceso web
+IS_WORKER = os.getenv("SIMULADOR_WORKER") == "1"
+
+QUEUED, RUNNING, DONE, ERROR, INTERRUPTED = "queued", "running", "done", "error", "interrupted"
+FINISHED = (DONE, ERROR, INTERRUPTED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    params TEXT,
+    result TEXT,
+    error TEXT,
+    trace_id TEXT
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS job_queue (
+    job_id TEXT PRIMARY KEY,
+    priority TEXT NOT NULL,
+    enqueued REAL NOT NULL,
+    inputs TEXT NOT NULL,
+    file_name TEXT,
+    file_data BLOB,
+    worker TEXT,
+    lease_until REAL,
+    cancel INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS engine_slots (
+    holder TEXT PRIMARY KEY,
+    engine TEXT NOT NULL,
+    lease_until REAL NOT NULL
+);
+"""
+# Columnas anadidas despues de crear la tabla: se agregan a las bases ya existentes
+_ADDED_COLUMNS = {"jobs": {"trace_id": "TEXT", "owner": "TEXT", "lease_until": "REAL"}}
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def new_job_id():
+    """Id de trabajo generado en el servidor (no el de la traza, que elige el cliente con traceparent)."""
+    return secrets.token_hex(16)
+
+
+def parse_last_event_id(value):
+    """Secuencia del ultimo evento recibido ("<trace>-<seq>" o "<seq>"); -1 si no hay."""
+    if not value:
+        return -1
+    try:
+        return int(str(value).rsplit("-", 1)[-1])
+    except ValueError:
+        return -1
+
+
+class JobStore:
+    """
+    Trabajos y eventos en DATA_DIR/jobs.sqlite3 (modo WAL). Varios procesos
+    (web y workers, en la misma maquina o con el directorio compartido)
+    pueden abrir el mismo fichero: las reservas usan BEGIN IMMEDIATE.
+    """
+
+    def __init__(self, filename=JOBS_DB, interrupt=True, lease=JOB_LEASE_SECONDS):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(data_path(filename), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._add_columns()
+        # Avisos en memoria para los lectores en directo (un asyncio.Event por trabajo)
+        self._waiters = {}
+        # Lectores conectados por trabajo y ultima vez que hubo alguno
+        self._readers = {}
+        self._last_reader = {}
+        self._last_cleanup = 0.0
+        # Dueno de los trabajos en linea de este proceso (el pid solo se repite
+        # al reiniciar un contenedor, de ahi el sufijo aleatorio)
+        self.owner = f"{worker_name()}:{secrets.token_hex(4)}"
+        self.lease = lease
+        if interrupt:
+            self.reap_orphaned()
+            threading.Thread(target=self._lease_loop, name="job-leases", daemon=True).start()
+        self.cleanup()
+
+    def _add_columns(self):
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for name, kind in columns.items():
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+    def reap_orphaned(self):
+        """
+        Cierra los trabajos en linea cuyo proceso web dejo de renovar la
+        reserva: ya no avanzaran. Los de otros procesos web vivos (varios
+        --workers de uvicorn, un reinicio escalonado) siguen su curso, y los
+        que tiene reservados un worker se vigilan con reap_expired.
+        """
+        now = time.time()
+        with self._lock:
+            expired = [r[0] for r in self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND (lease_until IS NULL OR lease_until < ?) "
+                "AND id NOT IN (SELECT job_id FROM job_queue)", (RUNNING, now))]
+            # Otro proceso puede estar revisando a la vez: solo cierra quien se lo queda
+            expired = [job_id for job_id in expired if self._conn.execute(
+                "UPDATE jobs SET owner = ?, lease_until = ? WHERE id = ? AND status = ? "
+                "AND (lease_until IS NULL OR lease_until < ?)", (self.owner, now + self.lease, job_id, RUNNING, now)
+            ).rowcount]
+        for job_id in expired:
+            log.warning("Trabajo en linea huerfano", job_id=job_id)
+            self.interrupt(job_id, "El servidor se reinicio durante la generacion")
+        return len(expired)
+
+    def renew_owned(self):
+        """Alarga la reserva de los trabajos en linea que corren en este proceso."""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = ?",
+                               (time.time() + self.lease, self.owner, RUNNING))
+
+    def _lease_loop(self):
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                self.renew_owned()
+                self.reap_orphaned()
+            except sqlite3.Error as e:
+                log.warning("No se pudieron renovar los trabajos en linea", error=f"{type(e).__name__}: {e}")
+
+    def interrupt(self, job_id, message):
+        """Cierra un trabajo que ya no avanzara, con eventos de error y [DONE] para los lectores."""
+        seq = self.next_seq(job_id)
+        self.append(job_id, seq, {"type": "log", "msg": f"[ERROR] {message}"})
+        self.append(job_id, seq + 1, "[DONE]")
+        self.finish(job_id, INTERRUPTED, error=message)
+        self.dequeue(job_id)
+
+    def next_seq(self, job_id):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM job_events WHERE job_id = ?",
+                                      (job_id,)).fetchone()[0]
+
+    def create(self, job_id, params, trace_id=None):
+        """Trabajo en linea: corre en este proceso, que renueva su reserva mientras vive."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, created, updated, params, trace_id, owner, lease_until) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, RUNNING, now, now, json.dumps(params, ensure_ascii=False), trace_id, self.owner, now + self.lease))
+        if now - self._last_cleanup > CLEANUP_INTERVAL:
+            self.cleanup()
+
+    # --- cola para los workers (JOB_MODE=queue) ---
+    def enqueue(self, job_id, params, inputs, priority="interactive", file_name=None, file_data=None, trace_id=None):
+        """Crea el trabajo en estado QUEUED con todo lo necesario para ejecutarlo en otro proceso."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("INSERT INTO jobs (id, status, created, updated, params, trace_id) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (job_id, QUEUED, now, now, json.dumps(params, ensure_ascii=False), trace_id))
+                self._conn.execute(
+                    "INSERT INTO job_queue (job_id, priority, enqueued, inputs, file_name, file_data) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, priority, now, json.dumps(inputs, ensure_ascii=False), file_name, file_data))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def queued_ahead(self, job_id):
+        """Trabajos en cola que se atenderan antes que `job_id`."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM job_queue q, job_queue me WHERE me.job_id = ? AND q.worker IS NULL "
+                "AND ((q.priority = 'background') < (me.priority = 'background') "
+                "OR ((q.priority = 'background') = (me.priority = 'background') AND q.enqueued < me.enqueued))",
+                (job_id,)).fetchone()
+        return row[0]
+
+    def claim(self, worker, lease=JOB_LEASE_SECONDS):
+        """
+        Reserva el trabajo en cola mas antiguo (interactivos primero) para
+        `worker`. Devuelve (job_id, inputs, file_name, file_data) o None.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT job_id, inputs, file_name, file_data FROM job_queue WHERE worker IS NULL AND cancel = 0 "
+                    "ORDER BY priority = 'background', enqueued LIMIT 1").fetchone()
+                if row:
+                    now = time.time()
+                    self._conn.execute("UPDATE job_queue SET worker = ?, lease_until = ? WHERE job_id = ?",
+                                       (worker, now + lease, row[0]))
+                    self._conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (RUNNING, now, row[0]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        return row[0], json.loads(row[1]), row[2], row[3]
+
+    def renew(self, job_id, worker, lease=JOB_LEASE_SECONDS):
+        """Alarga la reserva; devuelve True si alguien pidio cancelar el trabajo."""
+        with self._lock:
+            self._conn.execute("UPDATE job_queue SET lease_until = ? WHERE job_id = ? AND worker = ?",
+                               (time.time() + lease, job_id, worker))
+            row = self._conn.execute("SELECT cancel FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def request_cancel(self, job_id):
+        """Pide cancelar un trabajo encolado; si nadie lo habia reservado se cierra aqui mismo."""
+        with self._lock:
+            self._conn.execute("UPDATE job_queue SET cancel = 1 WHERE job_id = ?", (job_id,))
+            row = self._conn.execute("SELECT worker FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+        if row and row[0] is None:
+            self.interrupt(job_id, "Generacion cancelada antes de empezar")
+
+    def dequeue(self, job_id):
+        """Quita el trabajo de la cola (libera las entradas, que pueden ser un PDF entero)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM job_queue WHERE job_id = ?", (job_id,))
+
+    def reap_expired(self):
+        """Cierra los trabajos cuyo worker dejo de renovar la reserva."""
+        with self._lock:
+            expired = [r[0] for r in self._conn.execute(
+                "SELECT job_id FROM job_queue WHERE worker IS NOT NULL AND lease_until < ?", (time.time(),))]
+        for job_id in expired:
+            log.warning("Reserva de trabajo caducada", job_id=job_id)
+            self.interrupt(job_id, "El worker dejo de responder durante la generacion")
+        return len(expired)
+
+    def queue_stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT worker IS NOT NULL, COUNT(*) FROM job_queue GROUP BY worker IS NOT NULL").fetchall()
+        counts = {bool(claimed): n for claimed, n in rows}
+        return {"queued": counts.get(False, 0), "running": counts.get(True, 0)}
+
+    # --- huecos por motor comunes a todos los procesos (JOB_MODE=queue) ---
+    def acquire_engine_slot(self, engine, holder, limit, lease=JOB_LEASE_SECONDS):
+        """Reserva para `holder` uno de los `limit` huecos de `engine`; False si estan todos ocupados."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Reservas de procesos que murieron sin soltarlas
+                self._conn.execute("DELETE FROM engine_slots WHERE lease_until < ?", (now,))
+                used = self._conn.execute("SELECT COUNT(*) FROM engine_slots WHERE engine = ?", (engine,)).fetchone()[0]
+                acquired = used < limit
+                if acquired:
+                    self._conn.execute("INSERT OR REPLACE INTO engine_slots (holder, engine, lease_until) VALUES (?, ?, ?)",
+                                       (holder, engine, now + lease))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return acquired
+
+    def renew_engine_slots(self, holders, lease=JOB_LEASE_SECONDS):
+        if not holders:
+            return
+        with self._lock:
+            self._conn.executemany("UPDATE engine_slots SET lease_until = ? WHERE holder = ?",
+                                   [(time.time() + lease, holder) for holder in holders])
+
+    def release_engine_slot(self, holder):
+        with self._lock:
+            self._conn.execute("DELETE FROM engine_slots WHERE holder = ?", (holder,))
+
+    def engine_slot_counts(self):
+        """{motor: huecos ocupados} sumando todos los procesos."""
+        with self._lock:
+            rows = self._conn.execute("SELECT engine, COUNT(*) FROM engine_slots WHERE lease_until >= ? GROUP BY engine",
+                                      (time.time(),)).fetchall()
+        return dict(rows)
+
+    def append(self, job_id, seq, payload):
+        data = json.dumps(payload, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO job_events (job_id, seq, data) VALUES (?, ?, ?)", (job_id, seq, data))
+            self._conn.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time(), job_id))
+        self._notify(job_id)
+
+    def finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ?",
+                               (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                                error, time.time(), job_id))
+        self._notify(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, created, updated, result, error, "
+                "(SELECT COUNT(*) FROM job_events WHERE job_id = jobs.id), trace_id FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "created": row[2],
+            "updated": row[3],
+            "questions": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "events": row[6],
+            "trace_id": row[7] or row[0],
+        }
+
+    def events_after(self, job_id, seq, limit=500):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?", (job_id, seq, limit)
+            ).fetchall()
+        return [(s, json.loads(d)) for s, d in rows]
+
+    def _notify(self, job_id):
+        waiter = self._waiters.pop(job_id, None)
+        if waiter:
+            waiter.set()
+
+    async def wait(self, job_id, timeout):
+        """Espera a un evento nuevo del trabajo (o `timeout`, para sondear el disco)."""
+        waiter = self._waiters.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def attach(self, job_id):
+        self._readers[job_id] = self._readers.get(job_id, 0) + 1
+        self._last_reader[job_id] = time.monotonic()
+
+    def detach(self, job_id):
+        self._readers[job_id] = max(0, self._readers.get(job_id, 0) - 1)
+        self._last_reader[job_id] = time.monotonic()
+
+    def abandoned_for(self, job_id):
+        """Segundos sin lectores conectados (0 si hay alguno)."""
+        if self._readers.get(job_id):
+            return 0.0
+        return time.monotonic() - self._last_reader.setdefault(job_id, time.monotonic())
+
+    def forget(self, job_id):
+        self._readers.pop(job_id, None)
+        self._last_reader.pop(job_id, None)
+
+    def cleanup(self):
+        """Borra trabajos (y eventos) sin actividad desde hace JOB_TTL_SECONDS."""
+        cutoff = time.time() - JOB_TTL_SECONDS
+        with self._lock:
+            self._last_cleanup = time.time()
+            expired = [r[0] for r in self._conn.execute("SELECT id FROM jobs WHERE updated < ?", (cutoff,))]
+            for job_id in expired:
+                self._conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM job_queue WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        if expired:
+            log.info("Trabajos caducados eliminados", count=len(expired))
+
+
+job_store = JobStore(interrupt=not IS_WORKER)
+
+
+class SharedEngineSlots:
+    """
+    Limite por motor comun a todos los procesos que generan con JOB_MODE=queue.
+    Cada worker tiene su propio scheduler (cola justa y limite local), pero
+    antes de llamar al motor el turno concedido reserva un hueco en
+    jobs.sqlite3: con N workers siguen siendo ENGINE_LIMITS llamadas a la vez,
+    no N veces mas. Un hilo renueva las reservas de este proceso; si muere,
+    caducan en JOB_LEASE_SECONDS. Entre procesos no hay turno rotatorio: el
+    primero que sondea con hueco libre se lo lleva.
+    """
+
+    def __init__(self, store=None, lease=JOB_LEASE_SECONDS):
+        self.store = store or job_store
+        self.lease = lease
+        self.held = set()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._renew_loop, name="engine-slots", daemon=True).start()
+
+    def acquire(self, engine, holder, limit):
+        if not self.store.acquire_engine_slot(engine, holder, limit, self.lease):
+            return False
+        with self._lock:
+            self.held.add(holder)
+        return True
+
+    def release(self, holder):
+        with self._lock:
+            self.held.discard(holder)
+        self.store.release_engine_slot(holder)
+
+    def _renew_loop(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                held = list(self.held)
+            try:
+                self.store.renew_engine_slots(held, self.lease)
+            except sqlite3.Error as e:
+                log.warning("No se pudieron renovar los huecos de motor", error=f"{type(e).__name__}: {e}")
+
+
+async def run_job(job_id, stream, on_finish=None, seq=0):
+    """Consume el generador de eventos del examen y lo persiste en el store."""
+    questions, error = None, None
+    status = INTERRUPTED
+    try:
+        async for payload in stream:
+            job_store.append(job_id, seq, payload)
+            seq += 1
+            if isinstance(payload, list):
+                questions = (questions or []) + payload
+        status = DONE if questions else ERROR
+    except Exception as e:
+        error = e
+        status = ERROR
+        log.exception("Trabajo fallido", job_id=job_id)
+    finally:
+        # Cancelado (apagado del servidor) o con error: cerrar el stream de eventos
+        if status == INTERRUPTED or error is not None:
+            reason = f"{type(error).__name__}: {str(error)[:200]}" if error else "Generacion cancelada"
+            job_store.append(job_id, seq, {"type": "log", "msg": f"[ERROR] {reason}"})
+            job_store.append(job_id, seq + 1, "[DONE]")
+        elif status == ERROR:
+            reason = "No se generaron preguntas"
+        else:
+            reason = None
+        job_store.finish(job_id, status, questions, reason)
+        if on_finish:
+            on_finish(error)
+
+
+async def cancel_if_abandoned(job_id, task, on_abandon=None, grace=JOB_ABANDON_SECONDS):
+    """
+    Cancela `task` si nadie lee el trabajo durante `grace` segundos. Una
+    recarga de la pagina reconecta mucho antes, asi que no la afecta.
+    """
+    if grace <= 0:
+        return
+    job_store.abandoned_for(job_id)  # empieza a contar desde la creacion
+    try:
+        while not task.done():
+            await asyncio.sleep(min(5.0, grace))
+            if not task.done() and job_store.abandoned_for(job_id) >= grace:
+                log.info("Trabajo abandonado: se cancela", job_id=job_id, grace=grace)
+                if on_abandon:
+                    on_abandon()
+                task.cancel()
+                return
+    finally:
+        job_store.forget(job_id)
+
+
+async def follow_queued_job(job_id, poll=1.0):
+    """
+    Espera (en el proceso web) a que un worker termine el trabajo. Cancelar
+    esta tarea (trabajo abandonado, apagado) pide la cancelacion al worker.
+    """
+    try:
+        while True:
+            job = job_store.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                return job
+            await job_store.wait(job_id, poll)
+            # Si todos los workers han caido nadie mas cerraria el trabajo
+            job_store.reap_expired()
+    except asyncio.CancelledError:
+        job_store.request_cancel(job_id)
+        raise
+
+
+async def job_event_stream(job_id, last_seq, heartbeat=15.0, poll=1.0):
+    """
+    Async generator de (seq, payload) desde `last_seq` + 1 hasta el final del
+    trabajo; None cada `heartbeat` segundos sin eventos (para comentarios SSE).
+    """
+    idle = 0.0
+    while True:
+        events = job_store.events_after(job_id, last_seq)
+        for seq, payload in events:
+            last_seq = seq
+            yield seq, payload
+        if events:
+            idle = 0.0
+            continue
+        job = job_store.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            # Ultimo repaso: eventos escritos justo antes de cerrar
+            for seq, payload in job_store.events_after(job_id, last_seq):
+                last_seq = seq
+                yield seq, payload
+            return
+        started = time.monotonic()
+        await job_store.wait(job_id, poll)
+        idle += time.monotonic() - started
+        if idle >= heartbeat:
+            idle = 0.0
+            yield None
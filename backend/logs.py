@@ -0,0 +1,167 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+
+# === LOGS ESTRUCTURADOS ===
+# Una linea JSON por evento (ts, level, logger, msg + campos). Las llamadas
+# solo encolan el registro: la escritura a consola la hace un hilo aparte
+# (QueueListener), asi un stdout lento o redirigido no bloquea el event loop.
+# Si la cola se llena se descartan registros en lugar de esperar.
+#   LOG_LEVEL          nivel minimo (INFO por defecto)
+#   LOG_SAMPLE_EVERY   de los debug con sample_key, se emite 1 de cada N
+#   LOG_QUEUE_SIZE     registros pendientes antes de empezar a descartar
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_EVERY = max(1, int(os.getenv("LOG_SAMPLE_EVERY", "20")))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+_listener = None
+_exc_formatter = logging.Formatter()
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        # ASCII escapado: ninguna consola (cp1252 incluida) falla al escribirlo
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca espera: con la cola llena descarta y cuenta."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        # Solo cuentan como avisados los descartes que viajan en un registro encolado
+        self.dropped -= (getattr(record, "fields", None) or {}).get("dropped_before", 0)
+
+    def prepare(self, record):
+        # Se formatea aqui (hilo del llamador) y se conserva la traza aparte
+        record = copy.copy(record)
+        fields = dict(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            fields["exc"] = _exc_formatter.formatException(record.exc_info)
+        if self.dropped:
+            fields["dropped_before"] = self.dropped
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.fields = fields
+        return record
+
+
+def queued(handler, handler_class=DroppingQueueHandler, size=LOG_QUEUE_SIZE):
+    """
+    Handler que solo encola: un QueueListener propio pasa los registros a
+    `handler` (consola, fichero...) desde otro hilo y vacia la cola al salir.
+    """
+    log_queue = queue.Queue(size)
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return handler_class(log_queue), listener
+
+
+def setup_logging():
+    """Arranca (una vez) el hilo escritor y engancha la cola al logger raiz 'simulador'."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(JsonFormatter())
+        handler, _listener = queued(console)
+
+        root = logging.getLogger("simulador")
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        root.propagate = False
+        root.addHandler(handler)
+
+
+class StructLogger:
+    """
+    Logger con campos: log.info("Peticion", engine="groq", model=...).
+    bind() devuelve un hijo con campos fijos (p.ej. el motor).
+    """
+
+    def __init__(self, logger, fields=None):
+        self._logger = logger
+        self._fields = fields or {}
+
+    def bind(self, **fields):
+        return StructLogger(self._logger, {**self._fields, **fields})
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if not self._logger.isEnabledFor(level):
+            return
+        self._logger.log(level, msg, exc_info=exc_info, extra={"fields": {**self._fields, **fields}})
+
+    def debug(self, msg, sample_key=None, **fields):
+        """Debug; con `sample_key` solo se emite 1 de cada LOG_SAMPLE_EVERY."""
+        if sample_key is not None:
+            if not self._logger.isEnabledFor(logging.DEBUG):
+                return
+            emit, skipped = _sampler.should_emit(sample_key)
+            if not emit:
+                return
+            if skipped:
+                fields["sampled_out"] = skipped
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields)
+
+    def exception(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info=True)
+
+
+class _Sampler:
+    def __init__(self, every):
+        self.every = every
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def should_emit(self, key):
+        """(emitir, descartados desde el ultimo emitido) para `key`."""
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % self.every:
+            return False, 0
+        return True, (self.every - 1 if count else 0)
+
+
+_sampler = _Sampler(LOG_SAMPLE_EVERY)
+
+
+def get_logger(name, **fields):
+    setup_logging()
+    return StructLogger(logging.getLogger(f"simulador.{name}"), fields)
@@ -1,20 +1,83 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, PlainTextResponse
+from starlette.background import BackgroundTask
 import os
 import json
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from pypdf import PdfReader
 import io
 
-# We import all generator methods
-from gemini_client import generate_exam_streaming as generate_exam_gemini
-from ollama_client import generate_exam_streaming as generate_exam_ollama
-from groq_client import generate_exam_streaming as generate_exam_groq
+BOOT_STARTED = time.perf_counter()
+
+# Engine modules (google.genai, httpx clients...) are imported on first use
+# through the registry, or in the background by the warm-up below
+from engines import ENGINE_MODULES, engine_status, get_engine, generate_exam_streaming, load_engine
+from coverage import Document, coverage_store
+from condense import CONDENSE_MODES, cached_document, condense_document, local_document
+from contexts import context_event, context_store
+from routing import router
+from prefetch import prefetch_store, watch_delivery
+from dedup import PendingQuestions, recent_questions
+from batch import Batch, BatchSources, archive_name, build_archive, parse_specs, run_batch
+from usage import BUDGET_ACTION, DAILY_TOKEN_BUDGET, seconds_until_tomorrow, usage_ledger
+from sse import format_sse, sse_chunks, sse_response  # noqa: F401 (format_sse re-exported)
+from metrics import BUDGET_EVENTS, CLIENT_DISCONNECTS, CONTENT_TYPE_LATEST, IMPORT_SECONDS, REQUESTS, STAGE_SECONDS, render_latest
+from tracing import Trace, trace_id_from_header
+from logs import get_logger
+from admin import is_admin
+from profiling import profile_paths, start_profile
+from scheduler import PRIORITIES, EngineSlot, Overloaded, scheduler
+from jobs import (DONE, IS_WORKER, JOB_MODE, SharedEngineSlots, cancel_if_abandoned, follow_queued_job,
+                  job_event_stream, job_store, new_job_id, parse_last_event_id, run_job)
 
 load_dotenv()
 
-app = FastAPI()
+log = get_logger("api")
+
+# With workers (JOB_MODE=queue) the engine limits hold across every process
+# that generates: each worker and the web process (batches) share them
+# through jobs.sqlite3 instead of each one allowing the full limit
+if JOB_MODE == "queue" or IS_WORKER:
+    scheduler.shared = SharedEngineSlots(job_store)
+
+# Engines to import at startup, in the background: "off" (default, fully
+# lazy), "all", or a comma list like "gemini,groq". /ready reports 503
+# until they are loaded.
+ENGINE_WARMUP = os.getenv("ENGINE_WARMUP", "off")
+STARTUP_SECONDS = time.perf_counter() - BOOT_STARTED
+IMPORT_SECONDS.set(STARTUP_SECONDS, module="main")
+warmup_done = asyncio.Event()
+
+def warmup_engines():
+    spec = ENGINE_WARMUP.strip().lower()
+    if spec in ("", "off", "none", "0"):
+        return []
+    if spec == "all":
+        return list(ENGINE_MODULES)
+    return [name.strip() for name in spec.split(",") if name.strip() in ENGINE_MODULES]
+
+async def warm_up(names):
+    for name in names:
+        try:
+            await asyncio.to_thread(load_engine, name)
+        except Exception as e:
+            log.warning("Engine warm-up failed", engine=name, error=f"{type(e).__name__}: {e}")
+    warmup_done.set()
+
+@asynccontextmanager
+async def lifespan(app):
+    names = warmup_engines()
+    log.info("API ready to serve", startup_ms=round(STARTUP_SECONDS * 1000, 1), warmup=names)
+    task = asyncio.create_task(warm_up(names))
+    try:
+        yield
+    finally:
+        task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS: Restrict to known origins in production
 ALLOWED_ORIGINS = ["*"] # Allow all origins for mobile access
@@ -25,9 +88,56 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
+async def enumerate_async(source):
+    seq = 0
+    async for item in source:
+        yield seq, item
+        seq += 1
+
+DISCONNECT_POLL_SECONDS = 1.0
+
+async def until_disconnected(request, source, on_disconnect=None):
+    """
+    Iterates `source`, checking the client while each step is pending. On
+    disconnect the pending step is cancelled, which aborts in-flight upstream
+    calls and retry sleeps inside the engine generators.
+    """
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(source.__anext__())
+            try:
+                while True:
+                    done, _ = await asyncio.wait({step}, timeout=DISCONNECT_POLL_SECONDS)
+                    if done:
+                        break
+                    if await request.is_disconnected():
+                        step.cancel()
+                        await asyncio.wait({step})
+                        if on_disconnect:
+                            on_disconnect()
+                        return
+            except BaseException:
+                # Cancelled from outside (e.g. the server noticed the disconnect first)
+                step.cancel()
+                raise
+            try:
+                item = step.result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        if step is None or step.done():
+            await source.aclose()
+        else:
+            # The source is still unwinding the cancellation: close it afterwards
+            step.add_done_callback(lambda _: asyncio.ensure_future(source.aclose()))
+
 def extract_text_from_pdf(file_bytes):
+    from pypdf import PdfReader  # only needed once a PDF arrives
     try:
         reader = PdfReader(io.BytesIO(file_bytes))
         text = ""
@@ -35,54 +145,457 @@ def extract_text_from_pdf(file_bytes):
             text += page.extract_text() + "\n"
         return text
     except Exception as e:
-        print(f"Error reading PDF: {e}")
+        log.warning("Error reading PDF", error=str(e))
         return ""
 
 @app.get("/")
 def read_root():
     return {"message": "Simulador TAI 2026 API is running"}
 
-@app.post("/generate-exam")
-async def create_exam(
+@app.get("/healthz")
+def read_health():
+    """Liveness: the process answers. Never depends on engines or upstreams."""
+    return {"status": "ok"}
+
+@app.get("/ready")
+def read_ready():
+    """Readiness: 503 until the ENGINE_WARMUP engines are imported."""
+    ready = warmup_done.is_set()
+    body = {
+        "ready": ready,
+        "startup_ms": round(STARTUP_SECONDS * 1000, 1),
+        "warmup": warmup_engines(),
+        "engines": engine_status(),
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+def read_metrics():
+    """Prometheus exposition of per-stage latencies and retry/fallback counters."""
+    return Response(render_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/queue")
+def read_queue():
+    """Generaciones en curso y en espera por motor (y en la cola de workers si JOB_MODE=queue)."""
+    return {"engines": scheduler.snapshot(), "jobs": {"mode": JOB_MODE, **job_store.queue_stats()},
+            "prefetched": prefetch_store.snapshot()}
+
+@app.get("/routing")
+def read_routing():
+    """Per (engine, model) EWMA latency, tokens/s and failure rate used by the "auto" engine."""
+    return {"targets": router.snapshot()}
+
+@app.get("/admin/usage")
+def read_usage(request: Request, days: int = 7):
+    """Tokens and estimated cost per day and (engine, model, key, mode), plus the configured budgets."""
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    return usage_ledger.snapshot(days=max(1, min(days, 30)))
+
+@app.get("/contexts/{context_id}")
+def read_context(context_id: str, request: Request):
+    """Stored context text. Content-addressed: the id is the ETag and never changes."""
+    etag = f'"{context_id}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") in (etag, f"W/{etag}"):
+        if context_store.exists(context_id):
+            return Response(status_code=304, headers=headers)
+    record = context_store.load(context_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="Contexto no encontrado o caducado")
+    return Response(json.dumps(record, ensure_ascii=False), media_type="application/json", headers=headers)
+
+@app.get("/coverage")
+def read_coverage():
+    """Porcentaje del temario ya preguntado, por documento/tema."""
+    return {"documents": coverage_store.summary()}
+
+@app.get("/profiles/{trace_id}")
+def read_profile(trace_id: str, request: Request, format: str = "alloc"):
+    """Perfil guardado de una peticion: asignaciones (JSON) o pilas plegadas (format=folded)."""
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    paths = profile_paths(trace_id)
+    if not paths:
+        raise HTTPException(status_code=400, detail="trace_id no valido")
+    folded_path, alloc_path = paths
+    try:
+        if format == "folded":
+            with open(folded_path, "r", encoding="utf-8") as f:
+                return PlainTextResponse(f.read())
+        with open(alloc_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except OSError:
+        raise HTTPException(status_code=404, detail="No hay perfil para esa traza")
+
+async def exam_form(
     file: UploadFile = File(None),
     num_questions: int = Form(10),
     topic: str = Form(None),
     difficulty: str = Form("Intermedio"),
     context: str = Form(None),
+    context_id: str = Form(None),
     directory_path: str = Form(None),
     mode: str = Form("manual"),
     ai_engine: str = Form("gemini"),
-    ollama_model: str = Form("deepseek-v3.2:cloud")
+    ollama_model: str = Form(None),
+    condense: str = Form("off"),
+    priority: str = Form("interactive"),
+    prefetch: bool = Form(False)
 ):
+    """Form fields shared by /generate-exam and /jobs."""
+    if condense not in CONDENSE_MODES:
+        condense = "off"
+    return {
+        "file": file, "num_questions": num_questions, "topic": topic, "difficulty": difficulty,
+        "context": context, "context_id": context_id, "directory_path": directory_path, "mode": mode, "ai_engine": ai_engine,
+        "ollama_model": ollama_model, "condense": condense,
+        "priority": priority if priority in PRIORITIES else "interactive",
+        "prefetch": prefetch,
+    }
+
+def request_trace(request, form):
+    return Trace("generate-exam", trace_id=trace_id_from_header(request.headers.get("traceparent")),
+                 engine=form["ai_engine"], mode=form["mode"], num_questions=form["num_questions"],
+                 difficulty=form["difficulty"], **{"client.address": request.client.host if request.client else None})
+
+async def exam_stream(trace, client_host, form, prefetch, **extra):
+    """
+    prepare_exam, or the exam prefetched for these same settings when there
+    is one. With `prefetch`, delivering the exam starts generating the next
+    one in the background (see prefetch.py).
+    """
+    if not (prefetch and JOB_MODE != "queue" and prefetch_store.eligible(form)):
+        return await prepare_exam(trace, client_host, **form, **extra)
+    key = prefetch_store.key(client_host, form)
+    entry = prefetch_store.claim(key)
+    if entry:
+        trace.root.set(prefetched=True, **{"prefetch.ready": entry.finished})
+        # Still queued in the background: it's the one the user is waiting for now
+        entry.promote()
+        source = entry.follow()
+    else:
+        source = await prepare_exam(trace, client_host, **form, **extra)
+
+    def start_next():
+        # Unseen until claimed and delivered: keep it out of the client's dedup history till then
+        history = PendingQuestions(recent_questions)
+
+        async def factory():
+            ptrace = Trace("generate-exam.prefetch", engine=form["ai_engine"], mode=form["mode"],
+                           num_questions=form["num_questions"], difficulty=form["difficulty"],
+                           **{"client.address": client_host, "prefetch.parent": trace.trace_id})
+            inputs = {**form, "context": None, "context_id": None, "priority": "background"}
+            slot = EngineSlot(client_host, "background", mode=form["mode"])
+            stream = await prepare_exam(ptrace, client_host, speculative=True, slot=slot, history=history, **inputs)
+            return stream, ptrace.finish, slot
+        prefetch_store.start(key, client_host, factory, history=history)
+
+    def on_delivered():
+        if entry:
+            entry.delivered()
+        start_next()
+
+    return watch_delivery(source, on_delivered)
+
+@app.post("/generate-exam")
+async def create_exam(request: Request, form: dict = Depends(exam_form)):
+    trace = request_trace(request, form)
+    prefetch = form.pop("prefetch")
+
+    # Opt-in profiling (admin only): header X-Profile: 1 or ?profile=1
+    profiler = None
+    if request.headers.get("x-profile") == "1" or request.query_params.get("profile") == "1":
+        if not is_admin(request):
+            raise HTTPException(status_code=403, detail="El perfilado requiere token de administrador")
+        profiler = start_profile(trace.trace_id)
+        trace.root.set(profiled=profiler is not None)
+
+    client_host = request.client.host if request.client else None
+    try:
+        event_stream = await exam_stream(trace, client_host, form, prefetch, profiler=profiler)
+    except BaseException:
+        # 404/429/503 before streaming: the profiler holds the process-wide tracemalloc slot
+        if profiler:
+            profiler.stop()
+        raise
+    stage_labels = {"engine": form["ai_engine"], "mode": form["mode"]}
+
+    def on_disconnect():
+        CLIENT_DISCONNECTS.inc(kind="stream", **stage_labels)
+        trace.root.set(**{"client.disconnected": True})
+
+    async def timed_stream():
+        """Formats SSE events, measures each write and closes the trace at the end."""
+        error = None
+        try:
+            events = enumerate_async(until_disconnected(request, event_stream, on_disconnect))
+            async for chunk in sse_chunks(events, trace.trace_id):
+                started = time.perf_counter()
+                yield chunk
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="sse_write", **stage_labels)
+        except BaseException as e:
+            error = e
+            if isinstance(e, asyncio.CancelledError):
+                on_disconnect()
+            raise
+        finally:
+            if profiler:
+                profiler.stop()
+            trace.finish(error)
+
+    # Also stops the profiler when the body is never iterated (stop() is idempotent)
+    background = BackgroundTask(profiler.stop) if profiler else None
+    return sse_response(request, timed_stream(), headers={"X-Trace-Id": trace.trace_id}, background=background)
+
+# Background generation tasks (kept referenced until they finish)
+_job_tasks = set()
+
+@app.post("/jobs")
+async def create_job(request: Request, response: Response, form: dict = Depends(exam_form)):
+    """Starts a generation job that survives client reloads; events are replayable."""
+    trace = request_trace(request, form)
+    # The trace id comes from the client's traceparent: never use it as the job key
+    job_id = new_job_id()
+    trace.root.set(**{"job.id": job_id})
+    prefetch = form.pop("prefetch")
+    client_host = request.client.host if request.client else None
+    params = {k: v for k, v in form.items() if k not in ("file", "context")}
+    params["file"] = form["file"].filename if form["file"] else None
+    if JOB_MODE == "queue":
+        # Worker mode: only persist the inputs; worker.py processes run the generation
+        upload = form["file"]
+        inputs = {k: v for k, v in form.items() if k != "file"}
+        inputs["client_host"] = client_host
+        job_store.enqueue(job_id, params, inputs, priority=form["priority"],
+                          file_name=upload.filename if upload else None,
+                          file_data=await upload.read() if upload else None, trace_id=trace.trace_id)
+        ahead = job_store.queued_ahead(job_id)
+        job_store.append(job_id, 0, {"type": "log", "msg": f"[COLA] Trabajo encolado para los workers ({ahead} por delante)."})
+        task = asyncio.create_task(follow_queued_job(job_id))
+        task.add_done_callback(lambda t: trace.finish(None if t.cancelled() else t.exception()))
+    else:
+        event_stream = await exam_stream(trace, client_host, form, prefetch)
+        job_store.create(job_id, params, trace_id=trace.trace_id)
+        task = asyncio.create_task(run_job(job_id, event_stream, on_finish=trace.finish))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+
+    # Nobody reading for JOB_ABANDON_SECONDS (not just a reload): stop spending quota on it
+    def on_abandon():
+        CLIENT_DISCONNECTS.inc(kind="job_abandoned", engine=form["ai_engine"], mode=form["mode"])
+        trace.root.set(**{"client.disconnected": True})
+    watcher = asyncio.create_task(cancel_if_abandoned(job_id, task, on_abandon))
+    _job_tasks.add(watcher)
+    watcher.add_done_callback(_job_tasks.discard)
+    response.headers["X-Trace-Id"] = trace.trace_id
+    return {"job_id": job_id, "events": f"/jobs/{job_id}/events"}
+
+@app.get("/jobs/{job_id}")
+def read_job(job_id: str):
+    """Job status and, once finished, the generated exam."""
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o caducado")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def read_job_events(job_id: str, request: Request, last_event_id: str = None):
+    """SSE replay + live tail of a job; resumes after Last-Event-ID (header or query)."""
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o caducado")
+    last_seq = parse_last_event_id(request.headers.get("last-event-id") or last_event_id)
+
+    async def stream():
+        job_store.attach(job_id)
+        try:
+            async for chunk in sse_chunks(until_disconnected(request, job_event_stream(job_id, last_seq)), job["trace_id"]):
+                yield chunk
+        finally:
+            job_store.detach(job_id)
+
+    return sse_response(request, stream(), headers={"X-Trace-Id": job["trace_id"]})
+
+@app.post("/batches")
+async def create_batch(request: Request, response: Response, spec: str = Form(...), name: str = Form(None),
+                       file: UploadFile = File(None)):
+    """
+    Generates several exams in one go (see batch.py). `spec` is JSON:
+    {"exam": {...}, "variants": N} or {"exams": [{...}, ...]}; an uploaded
+    file is shared by the manual exams. Progress on /jobs/{id}/events,
+    result on /batches/{id}/archive.
+    """
+    try:
+        specs = parse_specs(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    client_host = request.client.host if request.client else None
+    trace = Trace("batch", trace_id=trace_id_from_header(request.headers.get("traceparent")), exams=len(specs),
+                  **{"client.address": client_host})
+
+    for engine_name in sorted({s["ai_engine"] for s in specs}):
+        await asyncio.to_thread(load_engine, engine_name)
+        # With "downshift" each exam moves to the cheap model (or fails) when its turn comes
+        if BUDGET_ACTION != "downshift" and usage_ledger.daily_exceeded(get_engine(engine_name).engine_names()):
+            BUDGET_EVENTS.inc(scope="daily", action="reject")
+            error = HTTPException(status_code=429, detail=f"Presupuesto diario de {DAILY_TOKEN_BUDGET} tokens agotado. Vuelve manana.",
+                                  headers={"Retry-After": str(seconds_until_tomorrow())})
+            trace.finish(error)
+            raise error
+
+    # Shared ingestion: the upload is extracted once, folders are read once
+    upload = None
+    if file:
+        content = await file.read()
+        if file.filename.endswith(".pdf"):
+            text = await asyncio.to_thread(extract_text_from_pdf, content)
+        else:
+            text = content.decode("utf-8", errors="replace")
+        if text.strip():
+            upload = context_store.put(text, file.filename)
+    sources = BatchSources(extract_text_from_pdf, upload)
+    try:
+        with trace.span("ingest", exams=len(specs)):
+            await asyncio.to_thread(sources.prepare, specs)
+    except ValueError as e:
+        trace.finish(e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Server-side id, like /jobs: the trace id is whatever the client sent in traceparent
+    batch = Batch(new_job_id(), name, specs, sources, client_host)
+    trace.root.set(**{"batch.id": batch.id})
+    job_store.create(batch.id, {"batch": True, "name": batch.name, "exams": len(specs)}, trace_id=trace.trace_id)
+    log.info("Batch started", batch_id=batch.id, exams=len(specs), engines=sorted({s["ai_engine"] for s in specs}))
+    task = asyncio.create_task(run_batch(batch, on_finish=trace.finish))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    response.headers["X-Trace-Id"] = trace.trace_id
+    return {"batch_id": batch.id, "exams": len(specs), "events": f"/jobs/{batch.id}/events",
+            "status": f"/batches/{batch.id}", "archive": f"/batches/{batch.id}/archive"}
+
+@app.get("/batches/{batch_id}")
+def read_batch(batch_id: str):
+    """Batch status; once finished, the manifest (one entry per exam, without the questions)."""
+    job = job_store.get(batch_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Lote no encontrado o caducado")
+    result = job.pop("questions")
+    return {**job, "manifest": result.get("manifest") if isinstance(result, dict) else None}
+
+@app.get("/batches/{batch_id}/archive")
+def read_batch_archive(batch_id: str):
+    """Zip with manifest.json and one JSON file per generated exam."""
+    job = job_store.get(batch_id)
+    if not job or not isinstance(job["questions"], dict):
+        raise HTTPException(status_code=404, detail="Lote no encontrado o caducado")
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"El lote no ha terminado ({job['status']})")
+    filename = archive_name(job["questions"]["manifest"]["name"])
+    return Response(build_archive(job["questions"]), media_type="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}.zip"'})
+
+async def prepare_exam(trace, client_host, file, num_questions, topic, difficulty, context, directory_path,
+                       mode, ai_engine, ollama_model, condense, context_id=None, priority="interactive", profiler=None, speculative=False,
+                       slot=None, history=None):
+    """
+    Reads the request inputs (upload, topic folder, previous context) and
+    returns the exam's event generator, not started yet. `speculative`
+    marks a prefetch: it never downshifts over the daily budget, it just
+    doesn't run. `slot` is the scheduler turn to use (a prefetch keeps a
+    reference to promote it when claimed). `history` overrides the dedup
+    history the exam is recorded in (a prefetch records it on delivery).
+    """
     context_text = context
     selected_topics = []
+    stage_labels = {"engine": ai_engine, "mode": mode}
+    REQUESTS.inc(**stage_labels)
+
+    # Dynamically choose engine from the registry (the first use imports its
+    # module; off the event loop so other streams keep flowing)
+    await asyncio.to_thread(load_engine, ai_engine)
+    if ai_engine == "auto":
+        engine = get_engine(ai_engine, ollama_model=ollama_model, mode=mode)
+    else:
+        engine = get_engine(ai_engine, model_name=ollama_model if ai_engine == "ollama" else None)
+    # "auto" is admitted by the engine it routes to first; fallbacks queue again (EngineSlot)
+    queue_name = engine.provider(0).name
+    slot = slot or EngineSlot(client_host, priority, mode=mode)
+
+    # Load shedding: refuse up front when the engine queue is full
+    try:
+        scheduler.check_admission(queue_name, client_host, priority)
+    except Overloaded as e:
+        trace.finish(e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, int(e.retry_after)))})
+
+    # Daily token budget: downshift to the engine's cheap model, or refuse
+    budget_msg = None
+    if usage_ledger.daily_exceeded(engine.engine_names()):
+        if BUDGET_ACTION == "downshift" and not speculative and engine.downshift():
+            BUDGET_EVENTS.inc(scope="daily", action="downshift")
+            budget_msg = (f"[PRESUPUESTO] Presupuesto diario de {DAILY_TOKEN_BUDGET} tokens agotado: "
+                          f"se usa el modelo barato ({engine.attempt_target(0)[0]}).")
+        else:
+            BUDGET_EVENTS.inc(scope="daily", action="reject")
+            error = HTTPException(status_code=429, detail=f"Presupuesto diario de {DAILY_TOKEN_BUDGET} tokens agotado. Vuelve manana.",
+                                  headers={"Retry-After": str(seconds_until_tomorrow())})
+            trace.finish(error)
+            raise error
+
+    # Context stored server-side by a previous exam, referenced by hash
+    context_doc = None
+    if context_id and not (context or file or directory_path):
+        context_doc = context_store.get(context_id)
+        if context_doc is None:
+            trace.finish(LookupError(context_id))
+            raise HTTPException(status_code=404, detail="El contexto guardado ya no existe en el servidor; vuelve a subir el documento")
+        context_text = context_doc.text
+
+    ingest_span = trace.start_span("ingest", mode=mode)
+
+    def pdf_text(data):
+        with STAGE_SECONDS.time(stage="pdf_extract", **stage_labels):
+            return extract_text_from_pdf(data)
+    # Documents whose coverage is tracked for this request
+    documents = []
 
     # Helper function for reading fragments
-    def get_file_fragment(filepath, chunk_size=3000):
+    def get_file_fragment(filepath, chunk_tokens=750):
         try:
             if filepath.endswith(".pdf"):
                 with open(filepath, "rb") as f:
-                    text = extract_text_from_pdf(f.read())
+                    text = pdf_text(f.read())
             else:
                 with open(filepath, "r", encoding="utf-8") as f:
                     text = f.read()
             
-            # Simple truncation for now, can be improved to random slice
-            return text[:chunk_size]
+            # Fragment from the parts of the topic not asked yet
+            # (from its fact sheet when condensation is enabled; no AI call per topic here)
+            doc = Document(text, os.path.basename(filepath))
+            if condense != "off":
+                doc = cached_document(doc, condense) or local_document(doc)
+            documents.append(doc)
+            fragment, _ = doc.pack(chunk_tokens)
+            return fragment
         except Exception as e:
-            print(f"Error reading {filepath}: {e}")
+            log.warning("Error reading topic file", path=filepath, error=str(e))
             return ""
 
     # 1. Handle File Upload (Manual)
     if mode == "manual" and file:
-        content = await file.read()
+        with STAGE_SECONDS.time(stage="upload_read", **stage_labels):
+            content = await file.read()
         if file.filename.endswith(".pdf"):
-            context_text = extract_text_from_pdf(content)
+            context_text = pdf_text(content)
         elif file.filename.endswith(".txt") or file.filename.endswith(".md"):
             context_text = content.decode("utf-8")
         
         if context_text and len(context_text) < 50:
-             print("Warning: Extracted text is too short or empty.")
+             log.warning("Extracted text is too short or empty", filename=file.filename, chars=len(context_text))
+        if context_text:
+            context_doc = context_store.put(context_text, file.filename)
+            documents.append(context_doc)
 
     # 2. Handle Directory Modes (Roulette & Simulacro)
     elif directory_path and (mode == "random_1" or mode == "simulacro_3" or mode == "random"): # 'random' for legacy compatibility
@@ -95,7 +608,7 @@ async def create_exam(
                     glob.glob(os.path.join(directory_path, "*.pdf"))
             
             if not files:
-                print(f"[RULETA] No se encontraron archivos compatibles en: {directory_path}")
+                log.warning("No compatible topic files", mode=mode, directory=directory_path)
             else:
                 if mode == "simulacro_3":
                     # --- REAL SIMULATOR MODE ---
@@ -111,31 +624,53 @@ async def create_exam(
                         context_parts.append(f"### TEMA: {fname} ###\n{fragment}\n")
                     
                     context_text = "\n".join(context_parts)
-                    print(f"[SIMULACRO] Temas elegidos: {', '.join(selected_topics)}")
+                    context_doc = context_store.put(context_text, f"Simulacro: {', '.join(selected_topics)}")
+                    log.info("Simulacro topics", trace_id=trace.trace_id, topics=selected_topics)
                     
                 else: 
                     # --- SINGLE TOPIC ROULETTE ---
                     selected_file = random.choice(files)
                     fname = os.path.basename(selected_file)
                     selected_topics.append(fname)
-                    print(f"[RULETA] Tema seleccionado al azar: {fname}")
+                    log.info("Random topic", trace_id=trace.trace_id, topic=fname)
                     
                     # Read full content for single mode
                     if selected_file.endswith(".pdf"):
                         with open(selected_file, "rb") as f:
-                            context_text = extract_text_from_pdf(f.read())
+                            context_text = pdf_text(f.read())
                     else:
                         with open(selected_file, "r", encoding="utf-8") as f:
                             context_text = f.read()
+                    if context_text:
+                        context_doc = context_store.put(context_text, fname)
+                        documents.append(context_doc)
 
         except Exception as e:
-            print(f"[RULETA] Error al leer directorio: {e}")
+            log.error("Error reading topic directory", mode=mode, directory=directory_path, error=str(e))
+
+    # Reused context from a previous exam (no file/folder in this request)
+    if context_text and not documents:
+        if context_doc is None:
+            # Legacy clients still send the full text; store it so they get an id back
+            context_doc = context_store.put(context_text, topic or "contexto previo")
+        documents.append(context_doc)
+
+    ingest_span.set(topics=", ".join(selected_topics), documents=len(documents), context_chars=len(context_text or ""))
+    ingest_span.end()
 
-    print(f"Generating -> Questions: {num_questions} | Difficulty: {difficulty} | Topic: {topic or 'Default'} | Mode: {mode} | Engine: {ai_engine} ({ollama_model if ai_engine == 'ollama' else 'N/A'})")
+    log.info("Generating exam", trace_id=trace.trace_id, questions=num_questions, difficulty=difficulty,
+             topic=topic, mode=mode, engine=ai_engine, model=ollama_model if ai_engine == "ollama" else None)
 
     async def event_stream():
         """SSE stream: yields logs and question batches."""
-        
+        yield {'type': 'log', 'msg': f'[TRAZA] {trace.trace_id}'}
+        if budget_msg:
+            yield {'type': 'log', 'msg': budget_msg}
+        if profiler:
+            yield {'type': 'log', 'msg': '[PERFIL] Peticion perfilada (muestreo + tracemalloc).'}
+        elif trace.root.attributes.get("profiled") is False:
+            yield {'type': 'log', 'msg': '[PERFIL] Ya hay otra peticion perfilandose; esta no se perfila.'}
+
         # Log selected topics to Frontend
         if selected_topics:
              if mode == "simulacro_3":
@@ -143,36 +678,46 @@ async def create_exam(
              else:
                  msg = f"🎲 [RULETA] Tema: {selected_topics[0]}"
                  
-             yield f"data: {json.dumps({'type': 'log', 'msg': msg})}\n\n"
-             
-             # Yield context for persistence (optional, maybe heavy for 3 topics but useful)
-             if context_text:
-                 yield f"data: {json.dumps({'type': 'context', 'content': context_text})}\n\n"
-
-        # Yield context first if it was extracted from a file
-        if (mode == "manual") and file and context_text:
-             yield f"data: {json.dumps({'type': 'context', 'content': context_text})}\n\n"
-
-        # Dynamically choose generator based on engine
-        if ai_engine == "ollama":
-            generator_source = generate_exam_ollama(num_questions, context_text, topic, difficulty, mode=mode, model_name=ollama_model)
-        elif ai_engine == "groq":
-            generator_source = generate_exam_groq(num_questions, context_text, topic, difficulty, mode=mode)
-        else:
-            generator_source = generate_exam_gemini(num_questions, context_text, topic, difficulty, mode=mode)
-
-        async for item in generator_source:
-            if isinstance(item, dict) and item.get("type") == "log":
-                yield f"data: {json.dumps(item)}\n\n"
-            elif isinstance(item, list):
-                yield f"data: {json.dumps(item)}\n\n"
-        yield "data: [DONE]\n\n"
-
-    return StreamingResponse(
-        event_stream(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",  # Prevents Nginx/proxy buffering
-        }
-    )
+             yield {'type': 'log', 'msg': msg}
+
+        # Context id + preview for reuse (the text stays on the server)
+        if context_doc is not None and context_doc.id != context_id:
+            yield context_event(context_doc)
+
+        # Wait for a slot on the engine (position/ETA logs while queued). With
+        # "auto" the slot moves to the queue of whichever engine each attempt calls
+        try:
+            async for item in slot.acquire(queue_name, engine.provider(0).display_name):
+                yield item
+
+            # Optional fact sheet: condensed once per document, then reused as context
+            exam_context = context_text
+            if condense != "off" and len(documents) == 1:
+                result = {}
+                with trace.span("condense", method=condense, document=documents[0].name):
+                    async for item in condense_document(documents[0], condense, engine, result, slot=slot):
+                        yield item
+                documents[0] = result["document"]
+                exam_context = documents[0].text
+
+            generator_source = generate_exam_streaming(engine, num_questions, exam_context, topic, difficulty, mode=mode,
+                                                       client_id=client_host,
+                                                       document=documents[0] if len(documents) == 1 else None,
+                                                       trace=trace, slot=slot, history=history)
+
+            async for item in generator_source:
+                if isinstance(item, dict) and item.get("type") == "log":
+                    yield item
+                elif isinstance(item, list):
+                    yield item
+                    percents = coverage_store.record(documents, item)
+                    for doc in documents:
+                        if doc.id in percents:
+                            yield {'type': 'log', 'msg': f'[COBERTURA] {doc.name}: {percents[doc.id]}% del tema cubierto'}
+        except Overloaded as e:
+            yield {'type': 'log', 'msg': f'[ERROR] {e}'}
+        finally:
+            slot.release()
+        yield "[DONE]"
+
+    return event_stream()
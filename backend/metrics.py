@@ -0,0 +1,242 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# === METRICAS (formato de exposicion de Prometheus) ===
+# Implementacion minima sin dependencias: contadores e histogramas con
+# etiquetas, servidos en texto plano por GET /metrics.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        documentation = self.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines = [f"# HELP {self.name} {documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [cuentas por bucket (+Inf al final), suma]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, key, state):
+        counts, total = state
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render_latest():
+    """Todas las metricas registradas en formato texto de Prometheus."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# === METRICAS DE /generate-exam ===
+STAGE_LABELS = ("stage", "engine", "model", "key", "mode")
+
+# Etapas: upload_read, pdf_extract, queue_wait, prompt_build, upstream_ttfb,
+# upstream_total, json_parse, validation, shuffle, sse_write
+STAGE_SECONDS = Histogram(
+    "simulador_stage_seconds",
+    "Duracion de cada etapa de /generate-exam en segundos.",
+    STAGE_LABELS,
+)
+REQUESTS = Counter(
+    "simulador_requests_total",
+    "Peticiones de examen recibidas.",
+    ("engine", "mode"),
+)
+RETRIES = Counter(
+    "simulador_retries_total",
+    "Reintentos contra el motor tras un fallo.",
+    ("engine", "model", "key", "mode"),
+)
+FALLBACKS = Counter(
+    "simulador_fallbacks_total",
+    "Cambios de modelo dentro de la cadena de fallback de un motor, o de motor con \"auto\".",
+    ("engine", "from_model", "to_model", "mode"),
+)
+CANCELLED = Counter(
+    "simulador_cancelled_total",
+    "Peticiones al motor abortadas porque el cliente se fue, por etapa en curso (upstream, retry_sleep...).",
+    ("engine", "mode", "stage"),
+)
+CANCELLED_ATTEMPTS_SAVED = Counter(
+    "simulador_cancelled_attempts_saved_total",
+    "Intentos contra el motor que ya no se hicieron gracias a la cancelacion.",
+    ("engine", "mode"),
+)
+CANCELLED_SLEEP_SAVED = Counter(
+    "simulador_cancelled_sleep_seconds_total",
+    "Segundos de espera entre reintentos ahorrados por la cancelacion.",
+    ("engine", "mode"),
+)
+CLIENT_DISCONNECTS = Counter(
+    "simulador_client_disconnects_total",
+    "Clientes que se fueron antes de acabar: stream cortado o trabajo abandonado.",
+    ("engine", "mode", "kind"),
+)
+ENGINE_ACTIVE = Gauge(
+    "simulador_engine_active",
+    "Generaciones en curso por motor.",
+    ("engine",),
+)
+ENGINE_QUEUED = Gauge(
+    "simulador_engine_queued",
+    "Peticiones esperando turno por motor y prioridad.",
+    ("engine", "priority"),
+)
+SHED = Counter(
+    "simulador_shed_total",
+    "Peticiones rechazadas al entrar por cola llena (queue_full) o limite por cliente (client_limit).",
+    ("engine", "reason", "priority"),
+)
+IMPORT_SECONDS = Gauge(
+    "simulador_import_seconds",
+    "Tiempo de importacion de cada modulo de motor (carga perezosa) y del arranque.",
+    ("module",),
+)
+PARSE_FAILURES = Counter(
+    "simulador_parse_failures_total",
+    "Respuestas con JSON invalido: reparadas (repaired) o irrecuperables (failed).",
+    ("engine", "model", "key", "mode", "outcome"),
+)
+ROUTE_DECISIONS = Counter(
+    "simulador_route_decisions_total",
+    "Destino elegido en primer lugar por el motor \"auto\".",
+    ("engine", "model", "mode"),
+)
+ROUTE_EXPECTED_SECONDS = Gauge(
+    "simulador_route_expected_seconds",
+    "Segundos esperados por el enrutador para una respuesta de referencia, por motor y modelo.",
+    ("engine", "model"),
+)
+TOKENS = Counter(
+    "simulador_tokens_total",
+    "Tokens por intento contra el motor (prompt/output), tambien de intentos fallidos (outcome=failed).",
+    ("engine", "model", "key", "mode", "kind", "outcome", "purpose"),
+)
+COST_USD = Counter(
+    "simulador_cost_usd_total",
+    "Coste estimado en USD segun budget.MODEL_PRICES.",
+    ("engine", "model", "key", "mode"),
+)
+DAILY_TOKENS = Gauge(
+    "simulador_daily_tokens",
+    "Tokens consumidos hoy por los motores sujetos al presupuesto diario.",
+)
+BUDGET_EVENTS = Counter(
+    "simulador_budget_events_total",
+    "Presupuestos de tokens superados: por examen (request) o diario (daily), y la accion tomada.",
+    ("scope", "action"),
+)
+PREFETCH = Counter(
+    "simulador_prefetch_total",
+    "Examenes precargados: started, hit (entregado al instante), pending (reclamado aun generandose), "
+    "expired, evicted, failed, skipped.",
+    ("outcome", "mode"),
+)
+BATCH_EXAMS = Counter(
+    "simulador_batch_exams_total",
+    "Examenes generados dentro de lotes (/batches), por resultado (ok, failed).",
+    ("engine", "mode", "outcome"),
+)
@@ -0,0 +1,222 @@
+import json
+import re
+
+from questions import process_batch
+
+
+# === POST-PROCESADO COMPARTIDO ===
+# Todas las utilidades que antes vivian copiadas en gemini_client, groq_client
+# y ollama_client. Los motores solo implementan el transporte (engines.py);
+# limpieza y parseo se hacen una unica vez aqui; blindaje y barajado son
+# metodos de Question (questions.py).
+
+# Patrones precompilados (antes se recompilaban en cada llamada / por letra)
+_RE_NEWLINES = re.compile(r'\n+')
+_RE_WHITESPACE = re.compile(r'\s+')
+_RE_CONTROL_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\ufeff\u200b\u200c\u200d\u2060]')
+_RE_FENCE_START = re.compile(r'^```(?:json)?\s*\n?')
+_RE_FENCE_END = re.compile(r'\n?```\s*$')
+
+
+class ParseError(ValueError):
+    """La respuesta del modelo no contiene una lista de preguntas utilizable."""
+
+
+# === UTILIDADES ===
+def _clean_text(text):
+    """Colapsa saltos de linea y espacios multiples."""
+    if not text:
+        return ""
+    text = _RE_NEWLINES.sub('\n', text)
+    text = _RE_WHITESPACE.sub(' ', text)
+    return text.strip()
+
+
+def _clean_json_response(raw_text):
+    """
+    Limpia la respuesta de la IA antes de parsear JSON.
+    Elimina markdown code fences, caracteres de control, texto extra.
+    """
+    if not raw_text:
+        return "[]"
+
+    text = raw_text.strip()
+
+    # Remove invisible control characters (BOM, zero-width spaces, etc.)
+    text = _RE_CONTROL_CHARS.sub('', text)
+
+    # Remove markdown code fences
+    text = _RE_FENCE_START.sub('', text)
+    text = _RE_FENCE_END.sub('', text)
+    text = text.strip()
+
+    # Find the JSON array
+    if not text.startswith('['):
+        bracket_start = text.find('[')
+        if bracket_start != -1:
+            text = text[bracket_start:]
+
+    if not text.endswith(']'):
+        bracket_end = text.rfind(']')
+        if bracket_end != -1:
+            text = text[:bracket_end + 1]
+
+    return text
+
+
+def parse_questions(raw_text):
+    """
+    Convierte la respuesta cruda del modelo en una lista de preguntas.
+    Intenta json.loads directo y, si falla, limpia la respuesta y reintenta.
+    Devuelve (preguntas, limpiado) o lanza ParseError.
+    """
+    cleaned = False
+    try:
+        data = json.loads(raw_text)
+    except (json.JSONDecodeError, TypeError):
+        cleaned = True
+        try:
+            data = json.loads(_clean_json_response(raw_text))
+        except json.JSONDecodeError as je:
+            raise ParseError(f"JSON irrecuperable: {je}") from je
+
+    # Algunos modelos devuelven una unica pregunta como objeto suelto
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise ParseError("Respuesta no es una lista válida")
+    if not data:
+        raise ParseError("JSON structure is empty")
+    return data, cleaned
+
+
+def process_questions(raw_questions, timings=None):
+    """
+    Construye Question (descarta entradas inutilizables), numera, aplica el
+    blindaje y baraja. Devuelve (validadas, correcciones). Si se pasa
+    `timings`, acumula los segundos de "validation" y "shuffle".
+    """
+    return process_batch(raw_questions, timings=timings)
+
+
+# === PROMPTS ===
+def get_base_prompt(num_questions, difficulty, has_context=False, strict_json=False):
+    # === REGLAS UNIVERSALES DE BLINDAJE (OPTIMIZADO) ===
+    # 1. UNICIDAD: 1 Verdadera, 3 Falsas.
+    # 2. EXCLUSION: Prohibido "Todas/Ninguna", "A y B".
+    # 3. OBJETIVIDAD: Falsas por dato, no interpretacion.
+
+    # Requisitos dinámicos según el contexto
+    requisitos_contexto = ""
+    if has_context:
+        requisitos_contexto = "- Cíñete ESTRICTAMENTE al texto proporcionado."
+    else:
+        requisitos_contexto = "- Temas: Administrativo (Leyes 39/40), plazos y datos EXACTOS."
+
+    # Modelos locales necesitan el recordatorio de formato en la primera linea
+    formato = " obligatoriamente en formato JSON sin NADA mas." if strict_json else ""
+
+    if difficulty.upper() == "EXPERTO":
+        return f"""
+    Rol: Examinador TAI C1. Genera {num_questions} preguntas{formato or "."}
+
+    BLINDAJE RESPUESTA UNICA:
+    - REGLA: 1 Verdadera, 3 Falsas indiscutibles.
+    - PROHIBIDO: Compuestas ("Todas", "Ninguna", "A y B").
+
+    DISTRACTORES (Falsas):
+    - Altera 1 dato objetivo (plazo, organo, condicion).
+    - No inventes normativa ni conceptos. Modifica los reales del texto.
+
+    REQUISITOS:
+    - Temas: Practicos, sintaxis, excepciones.
+    - 25% Negativas.
+    {requisitos_contexto}
+
+    PROCESO (SELF-CORRECTION):
+    1. Piensa pregunta y Verdadera.
+    2. Genera 3 Falsas (dato alterado).
+    3. SELF-CHECK: ¿Alguna falsa es defendible? Si -> Reescribela.
+    4. REDACTA explicacion: "La respuesta correcta es [Letra] porque...".
+    5. Verifica: Si dices "Es la B", correct_index=1.
+
+    JSON SCHEMA:
+    [
+        {{
+            "id": 1,
+            "question": "Texto",
+            "options": ["A", "B", "C", "D"],
+            "correct_index": 0,
+            "explanation": "La respuesta correcta es A porque [Breve]..."
+        }}
+    ]
+    """
+
+    # BASICO / INTERMEDIO (OPTIMIZADO)
+    return f"""
+    Rol: Preparador Oposiciones. Test de {num_questions} preguntas{formato or "."}
+
+    NIVEL: {difficulty.upper()}
+
+    REGLAS (BLINDAJE):
+    1. 1 Correcta, 3 Falsas claras.
+    2. PROHIBIDO: "Todas/Ninguna correctas", "A y C".
+    3. FALSAS: Cambia 1 dato concreto.
+
+    {requisitos_contexto.replace("- Temas:", "REQUISITO:").replace("- ", "")}
+
+    CRITERIO OBLIGATORIO:
+    - "explanation" DEBE empezar: "La respuesta correcta es [Letra]...".
+
+    PROCESO:
+    1. Define Correcta.
+    2. Asegura 3 Falsas sin ambiguedad.
+    3. Explicacion: "La respuesta correcta es [Letra]..."
+    4. Asigna correct_index (0=A...).
+
+    Formato JSON:
+    [
+        {{
+            "id": 1,
+            "question": "Enunciado...",
+            "options": ["A", "B", "C", "D"],
+            "correct_index": 0,
+            "explanation": "La respuesta correcta es A porque..."
+        }}
+    ]
+    """
+
+
+DEFAULT_CONTEXT_RULES = (
+    "\n1. Genera las preguntas BASANDOTE UNICAMENTE EN EL TEXTO DE ARRIBA."
+    "\n2. IMPORTANTE: NO menciones 'el texto', 'el fragmento', 'la fuente' o 'el documento' en los enunciados. Formula la pregunta como si fuera un examen oficial."
+    "\n3. Si el texto es un fragmento, ignora el corte y pregunta solo sobre lo visible, PERO SIN MENCIONAR QUE ES UN FRAGMENTO."
+)
+
+
+def build_exam_prompt(num_questions, difficulty, context, topic=None, mode="manual",
+                      strict_json=False, context_rules=DEFAULT_CONTEXT_RULES, suffix="", avoid=None):
+    """Prompt completo: reglas base + tema + documento de referencia + instrucciones."""
+    has_content = bool(context or topic)
+    prompt = get_base_prompt(num_questions, difficulty, has_context=has_content, strict_json=strict_json)
+
+    # Inject Topic (Critical for context)
+    if topic:
+        prompt += f"\n\nCONTEXTO TEMATICO: {topic}"
+
+    if context:
+        # Use generic header to avoid confusing the model into writing "Según el fragmento..."
+        prompt += f"\n\nDOCUMENTO NORMATIVO DE REFERENCIA:\n{context}"
+
+        # STRICT CONTEXT INSTRUCTION (REFINED)
+        prompt += "\n\n⚠️ INSTRUCCION CRITICA DE JEFE DE TRIBUNAL:"
+        if mode == "simulacro_3":
+            prompt += "\n0. ESTÁS ANTE UN SIMULACRO MULTITEMA (3 Bloques). Debes generar preguntas equilibradas (aprox. una cantidad igual por cada bloque temático)."
+        prompt += context_rules
+
+    # Peticiones de reemplazo: no repetir lo que ya se ha aceptado
+    if avoid:
+        prompt += "\n\nNO REPITAS ni reformules ninguna de estas preguntas ya incluidas en el examen:"
+        prompt += "".join(f"\n- {q}" for q in avoid)
+
+    return prompt + suffix
@@ -0,0 +1,225 @@
+import asyncio
+import os
+import time
+
+from logs import get_logger
+from metrics import PREFETCH
+
+log = get_logger("prefetch")
+
+
+# === PRECARGA DEL SIGUIENTE EXAMEN ===
+# En ruleta (random_1) y simulacro (simulacro_3) el tema del siguiente
+# examen no depende de nada que elija el usuario. Si la peticion trae
+# prefetch=true, al entregar el examen se genera en segundo plano otro con
+# los mismos ajustes: pasa por prepare_exam como cualquiera (admision,
+# presupuesto diario, cuota del motor) pero con prioridad "background", asi
+# que no quita turno a nadie. La siguiente peticion igual del mismo cliente
+# se lo lleva: se reproducen los eventos ya generados y, si aun no ha
+# terminado, se sigue en vivo (su turno, y solo el suyo, pasa a "interactive").
+# Sus preguntas solo entran en el historial de dedup del cliente cuando se
+# entregan: una precarga que caduca o se descarta no deja rastro.
+# Como mucho PREFETCH_PER_CLIENT precargas por cliente (se descarta la mas
+# antigua) y PREFETCH_MAX en total; las que nadie reclama en
+# PREFETCH_TTL_SECONDS se cancelan y se descartan.
+# Solo con JOB_MODE=inline: en modo cola la generacion ocurre en los workers.
+
+PREFETCH_MODES = ("random_1", "simulacro_3")
+PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", "600"))
+PREFETCH_PER_CLIENT = int(os.getenv("PREFETCH_PER_CLIENT", "1"))
+PREFETCH_MAX = int(os.getenv("PREFETCH_MAX", "16"))
+# Campos del formulario que deben coincidir para reutilizar una precarga
+KEY_FIELDS = ("mode", "directory_path", "num_questions", "difficulty", "topic", "ai_engine", "ollama_model", "condense")
+
+
+class PrefetchedExam:
+    """Eventos de un examen generado por adelantado, reproducibles mientras se generan."""
+
+    def __init__(self, key, client):
+        self.key = key
+        self.client = client
+        self.mode = dict(key[1:]).get("mode")
+        self.created = time.monotonic()
+        self.events = []
+        self.has_questions = False
+        self.finished = False
+        self.task = None
+        self.expiry = None
+        # scheduler.EngineSlot de la generacion (para promoverla al reclamarla)
+        self.slot = None
+        # dedup.PendingQuestions: el historial del cliente solo cambia al entregarla
+        self.history = None
+        self._changed = asyncio.Event()
+
+    def append(self, item):
+        self.events.append(item)
+        if isinstance(item, list):
+            self.has_questions = True
+        self._wake()
+
+    def finish(self):
+        self.finished = True
+        self._wake()
+
+    def _wake(self):
+        # Un Event nuevo por cambio: los que esperaban el anterior despiertan
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def delivered(self):
+        """El usuario ya tiene el examen: sus preguntas pasan a su historial."""
+        if self.history:
+            self.history.commit()
+
+    def promote(self):
+        """La precarga pasa a ser lo que el usuario espera: su turno sube a "interactive"."""
+        if self.slot and not self.finished:
+            self.slot.promote()
+
+    def cancel(self):
+        if self.expiry:
+            self.expiry.cancel()
+        if self.task and not self.task.done() and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    async def follow(self):
+        """Reproduce lo ya generado y sigue en vivo hasta "[DONE]"."""
+        age = time.monotonic() - self.created
+        state = "listo" if self.finished else "en curso"
+        index = 0
+        try:
+            yield {"type": "log", "msg": f"[PRECARGA] Examen pregenerado hace {age:.0f}s ({state})."}
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.finished:
+                    return
+                await self._changed.wait()
+        finally:
+            # Reclamado y abandonado a medias: ya no lo va a leer nadie
+            if not self.finished:
+                self.cancel()
+
+
+async def watch_delivery(source, on_delivered):
+    """Pasa los eventos de `source` y llama a on_delivered() si el examen se entrego entero."""
+    delivered = False
+    try:
+        async for item in source:
+            if isinstance(item, list):
+                delivered = True
+            yield item
+    finally:
+        await source.aclose()
+    if delivered:
+        on_delivered()
+
+
+class PrefetchStore:
+    def __init__(self):
+        self.entries = {}
+
+    @staticmethod
+    def key(client, form):
+        return (client or "anon",) + tuple((field, form.get(field)) for field in KEY_FIELDS)
+
+    @staticmethod
+    def eligible(form):
+        return (form.get("mode") in PREFETCH_MODES and bool(form.get("directory_path"))
+                and not form.get("file") and PREFETCH_MAX > 0 and PREFETCH_PER_CLIENT > 0)
+
+    def claim(self, key):
+        """Saca la precarga de `key` si sirve (no caducada, sin fallar); None si no hay."""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        if entry.expiry:
+            entry.expiry.cancel()
+        if entry.finished and not entry.has_questions:
+            PREFETCH.inc(outcome="failed", mode=entry.mode)
+            return None
+        PREFETCH.inc(outcome="hit" if entry.finished else "pending", mode=entry.mode)
+        log.info("Precarga reclamada", client=entry.client, mode=entry.mode, ready=entry.finished,
+                 age_s=round(time.monotonic() - entry.created, 1))
+        return entry
+
+    def start(self, key, client, factory, history=None):
+        """
+        Lanza la precarga de `key`. `factory` es una corrutina que devuelve
+        (generador de eventos, on_finish(error), EngineSlot del turno); si
+        lanza HTTPException (cola llena, presupuesto agotado) la precarga se
+        omite. `history` (dedup.PendingQuestions) es el historial que usa la
+        generacion; se confirma cuando el examen se entrega.
+        """
+        mode = dict(key[1:]).get("mode")
+        if key in self.entries:
+            return None
+        if len(self.entries) >= PREFETCH_MAX:
+            PREFETCH.inc(outcome="skipped", mode=mode)
+            log.info("Precarga omitida: limite global", client=client, max=PREFETCH_MAX)
+            return None
+        own = sorted((e for e in self.entries.values() if e.client == (client or "anon")), key=lambda e: e.created)
+        for old in own[:max(0, len(own) - PREFETCH_PER_CLIENT + 1)]:
+            self._discard(old, "evicted")
+
+        entry = PrefetchedExam(key, client or "anon")
+        entry.history = history
+        self.entries[key] = entry
+        entry.task = asyncio.create_task(self._run(entry, factory))
+        entry.expiry = asyncio.get_running_loop().call_later(PREFETCH_TTL_SECONDS, self._discard, entry, "expired")
+        PREFETCH.inc(outcome="started", mode=mode)
+        log.info("Precarga iniciada", client=entry.client, mode=mode)
+        return entry
+
+    async def _run(self, entry, factory):
+        from fastapi import HTTPException
+
+        error = None
+        on_finish = None
+        try:
+            stream, on_finish, entry.slot = await factory()
+            try:
+                async for item in stream:
+                    entry.append(item)
+            finally:
+                await stream.aclose()
+        except HTTPException as e:
+            error = e
+            PREFETCH.inc(outcome="skipped", mode=entry.mode)
+            log.info("Precarga omitida", client=entry.client, reason=e.detail)
+            entry.append({"type": "log", "msg": f"[ERROR] {e.detail}"})
+            entry.append("[DONE]")
+        except asyncio.CancelledError as e:
+            error = e
+            raise
+        except Exception as e:
+            error = e
+            log.warning("Precarga fallida", client=entry.client, error=f"{type(e).__name__}: {e}")
+            entry.append({"type": "log", "msg": f"[ERROR] {type(e).__name__}: {str(e)[:200]}"})
+            entry.append("[DONE]")
+        finally:
+            entry.finish()
+            if not entry.has_questions:
+                # Sin examen que ofrecer: no ocupa el hueco del cliente
+                self._discard(entry, None if isinstance(error, HTTPException) else "failed")
+            if on_finish:
+                on_finish(error)
+
+    def _discard(self, entry, outcome=None):
+        """Cancela la precarga; solo cuenta si seguia guardada (no reclamada)."""
+        entry.cancel()
+        if self.entries.get(entry.key) is not entry:
+            return
+        del self.entries[entry.key]
+        if outcome:
+            PREFETCH.inc(outcome=outcome, mode=entry.mode)
+            log.info("Precarga descartada", client=entry.client, mode=entry.mode, reason=outcome)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return [{"mode": e.mode, "age_seconds": round(now - e.created, 1),
+                 "finished": e.finished, "has_questions": e.has_questions} for e in self.entries.values()]
+
+
+prefetch_store = PrefetchStore()
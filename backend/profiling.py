@@ -0,0 +1,131 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from storage import data_path
+
+
+# === PERFILADO BAJO DEMANDA ===
+# Una peticion marcada (solo admin) se ejecuta bajo un perfilador de muestreo
+# (pila del hilo del event loop cada SAMPLE_INTERVAL) y tracemalloc. Al acabar
+# se guardan, por trace id, en DATA_DIR/profiles/:
+#   <trace_id>.folded      pilas "a;b;c N" para flamegraph.pl / speedscope
+#   <trace_id>.alloc.json  lineas que mas memoria reservaron + pico
+# tracemalloc es global al proceso: solo se perfila una peticion a la vez.
+
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "600"))
+TRACEMALLOC_FRAMES = 16
+TOP_ALLOCATIONS = 30
+
+_RE_TRACE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+_active_lock = threading.Lock()
+
+
+def profile_paths(trace_id):
+    """(folded, alloc) del perfil de `trace_id`, o None si el id no es valido."""
+    if not _RE_TRACE_ID.match(trace_id or ""):
+        return None
+    return data_path("profiles", f"{trace_id}.folded"), data_path("profiles", f"{trace_id}.alloc.json")
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfiler:
+    def __init__(self, trace_id, thread_id):
+        self.trace_id = trace_id
+        self.thread_id = thread_id
+        self.samples = Counter()
+        self.started = time.perf_counter()
+        self._stop = threading.Event()
+        self._done = threading.Lock()
+        self._finished = False
+        self._own_tracemalloc = not tracemalloc.is_tracing()
+        if self._own_tracemalloc:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{trace_id[:8]}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+            if time.perf_counter() - self.started > PROFILE_MAX_SECONDS:
+                # Peticion colgada: no dejar tracemalloc activo indefinidamente
+                self._finish()
+                return
+
+    def stop(self):
+        """Para el muestreo y escribe el perfil. Devuelve las rutas escritas."""
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        return self._finish()
+
+    def _finish(self):
+        with self._done:
+            if self._finished:
+                return profile_paths(self.trace_id)
+            self._finished = True
+            self._stop.set()
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ))
+            _, peak = tracemalloc.get_traced_memory()
+            if self._own_tracemalloc:
+                tracemalloc.stop()
+            _active_lock.release()
+
+        folded_path, alloc_path = profile_paths(self.trace_id)
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        allocations = [
+            {
+                "file": stat.traceback[0].filename,
+                "line": stat.traceback[0].lineno,
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        ]
+        with open(alloc_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "trace_id": self.trace_id,
+                "duration_s": round(time.perf_counter() - self.started, 3),
+                "samples": sum(self.samples.values()),
+                "sample_interval_s": SAMPLE_INTERVAL,
+                "peak_kb": round(peak / 1024, 1),
+                "top_allocations": allocations,
+            }, f, ensure_ascii=False, indent=2)
+        return folded_path, alloc_path
+
+
+def start_profile(trace_id):
+    """
+    Empieza a perfilar el hilo actual (el del event loop). Devuelve None si ya
+    hay otra peticion perfilandose.
+    """
+    if not _active_lock.acquire(blocking=False):
+        return None
+    try:
+        return RequestProfiler(trace_id, threading.get_ident())
+    except Exception:
+        _active_lock.release()
+        raise
@@ -0,0 +1,261 @@
+import itertools
+import os
+import random
+import re
+import time
+import zlib
+from dataclasses import dataclass
+
+from logs import get_logger
+
+log = get_logger("questions")
+
+
+# === MODELO DE PREGUNTA ===
+# Las preguntas viajaban como dicts sueltos, mutados en cada etapa y
+# revisados con .get() por todas partes. Question valida y normaliza una vez
+# al construirse (tipos, rango de correct_index) y usa __slots__: en bancos
+# de decenas de miles de preguntas ocupa bastante menos que un dict. Hacia
+# fuera (SSE, trabajos, historial) se serializa con to_json().
+
+# === MOTOR DE BLINDAJE Y BARAJADO ===
+# Corre para cada pregunta servida, asi que todo esta precompilado:
+#   - la letra que la explicacion da por correcta sale de UNA pasada sobre
+#     el texto; se respeta la prioridad de siempre ("respuesta correcta es
+#     X" > "Correcta: X" > "X)" al inicio)
+#   - la reescritura de la letra tras barajar es un unico sub() por letra
+#     de origen, en lugar de cuatro patrones con format() en cada pregunta
+#   - las permutaciones de hasta MAX_TABLE_OPTIONS opciones estan tabuladas:
+#     barajar es elegir un indice. Con semilla (SHUFFLE_SEED o seed=) el
+#     indice sale del hash del enunciado: mismo orden para la misma pregunta
+#     sin importar el lote ni el orden de llegada.
+
+# Las dos formas principales contienen "correcta": se buscan en el texto en
+# minusculas a partir de ese literal (busqueda rapida de prefijo) y el
+# "respuesta" previo se comprueba solo en los candidatos.
+_RE_AFTER_CORRECTA = re.compile(r"correcta(?:\s+(?:es|sea)\s+(?:la\s+)?([a-d])\b|:\s*\[?([a-d])\]?)")
+_RE_RESPUESTA_BEFORE = re.compile(r"respuesta\s+$")
+_RE_LETTER_START = re.compile(r"([A-D])[).\s]")
+
+
+def _rewrite_pattern(letter):
+    """Las cuatro formas de citar la letra `letter` en la explicacion, en un solo patron."""
+    return re.compile(
+        r"(?P<main>respuesta\s+correcta\s+(?:es|sea)\s+(?:la\s+)?){0}\b"
+        r"|(?P<colon>correcta:\s*\[?){0}"
+        r"|(?P<solution>soluci[oó]n:\s*){0}\b"
+        r"|^{0}(?P<start>[.\)])".format(letter),
+        re.IGNORECASE,
+    )
+
+
+_REWRITE_PATTERNS = {letter: _rewrite_pattern(letter) for letter in "ABCDEFGH"}
+
+MAX_TABLE_OPTIONS = 6
+_PERMUTATIONS = {n: tuple(itertools.permutations(range(n))) for n in range(2, MAX_TABLE_OPTIONS + 1)}
+SHUFFLE_SEED = os.getenv("SHUFFLE_SEED")
+
+
+def stated_letter_index(explanation):
+    """Indice de la letra que `explanation` afirma correcta, o None (una sola pasada)."""
+    low = explanation.lower()
+    colon = None
+    for m in _RE_AFTER_CORRECTA.finditer(low):
+        main, colon_letter = m.groups()
+        if main and _RE_RESPUESTA_BEFORE.search(low, max(0, m.start() - 40), m.start()):
+            return ord(main) - 97
+        if colon_letter and colon is None:
+            colon = colon_letter
+    if colon:
+        return ord(colon) - 97
+    m = _RE_LETTER_START.match(explanation)
+    return ord(m.group(1)) - 65 if m else None
+
+
+def rewrite_letter(explanation, old_index, new_index):
+    """Cambia las citas de la letra `old_index` por `new_index` en la explicacion."""
+    old_letter, new_letter = chr(65 + old_index), chr(65 + new_index)
+    pattern = _REWRITE_PATTERNS.get(old_letter)
+    if pattern is None or old_letter == new_letter:
+        return explanation
+
+    def replace(m):
+        kind = m.lastgroup
+        if kind == "start":
+            return new_letter + m.group("start")
+        return m.group(kind) + new_letter
+
+    return pattern.sub(replace, explanation)
+
+
+def _seed_value(seed):
+    if seed is None:
+        return None
+    return seed if isinstance(seed, int) else zlib.crc32(str(seed).encode("utf-8"))
+
+
+def permutation(n, rng=random, seed=None, key=""):
+    """
+    Permutacion de range(n): aleatoria con `rng` o, si hay `seed`,
+    determinista para cada `key` (el enunciado).
+    """
+    table = _PERMUTATIONS.get(n)
+    if seed is not None:
+        h = zlib.crc32(key.encode("utf-8"), seed & 0xFFFFFFFF)
+        if table:
+            return table[h % len(table)]
+        order = list(range(n))
+        random.Random(h).shuffle(order)
+        return order
+    if table:
+        return table[int(rng.random() * len(table))]
+    order = list(range(n))
+    rng.shuffle(order)
+    return order
+
+
+def _as_index(value):
+    """correct_index tal como llega del modelo (int, "2", 2.0...) o None."""
+    if type(value) is int:
+        return value
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value.strip())
+    return None
+
+
+@dataclass(slots=True, eq=False)
+class Question:
+    id: int
+    question: str
+    options: list
+    correct_index: int
+    explanation: str
+
+    @classmethod
+    def from_raw(cls, raw, id=0):
+        """
+        Question a partir de un elemento de la respuesta del modelo, o None
+        si no es utilizable (no es un dict, sin enunciado o sin opciones).
+        Un correct_index ausente o fuera de rango pasa a 0, como hacia el
+        blindaje.
+        """
+        if type(raw) is not dict:
+            return None
+        stem = raw.get("question")
+        options = raw.get("options")
+        if type(stem) is not str or not stem or stem.isspace() or type(options) is not list or not options:
+            return None
+        options = list(map(str, options))
+        index = _as_index(raw.get("correct_index"))
+        if index is None or not 0 <= index < len(options):
+            log.debug("correct_index invalido, se usa 0", sample_key="blindaje.reset",
+                      question_id=raw.get("id"), correct_index=raw.get("correct_index"))
+            index = 0
+        explanation = raw.get("explanation")
+        return cls(id, stem, options, index, explanation.strip() if isinstance(explanation, str) else "")
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "question": self.question,
+            "options": self.options,
+            "correct_index": self.correct_index,
+            "explanation": self.explanation,
+        }
+
+    @property
+    def answer(self):
+        return self.options[self.correct_index]
+
+    def stated_index(self):
+        """Indice de la letra que la explicacion afirma correcta, o None."""
+        return stated_letter_index(self.explanation)
+
+    def fix_correct_index(self):
+        """
+        BLINDAJE STRICTO: la explicacion es la fuente de la verdad. Si dice
+        'La respuesta correcta es B', el indice DEBE ser 1. Devuelve True si
+        se corrigio.
+        """
+        expected = stated_letter_index(self.explanation)
+        if expected is None or expected == self.correct_index:
+            return False
+        if expected >= len(self.options):
+            log.debug("Letra de la explicacion fuera de rango", sample_key="blindaje.range",
+                      question_id=self.id, letter=chr(65 + expected), options=len(self.options))
+            return False
+        log.debug("Correccion de correct_index segun la explicacion", sample_key="blindaje.fix",
+                  question_id=self.id, old=self.correct_index, new=expected, letter=chr(65 + expected))
+        self.correct_index = expected
+        return True
+
+    def shuffle(self, rng=random, seed=None):
+        """
+        Aleatoriza el orden de las opciones para evitar el sesgo de posicion
+        (siempre A) y actualiza correct_index y la letra de la explicacion.
+        Con `seed` el orden es reproducible (ver permutation).
+        """
+        options = self.options
+        if len(options) < 2:
+            return
+        order = permutation(len(options), rng, _seed_value(seed), self.question)
+        old_index = self.correct_index
+        new_index = order.index(old_index)
+        self.options = [options[i] for i in order]
+        self.correct_index = new_index
+        if new_index != old_index:
+            # El modelo suele escribir "La respuesta correcta es A...": se cambia la letra
+            self.explanation = rewrite_letter(self.explanation, old_index, new_index)
+
+
+# === OPERACIONES EN BLOQUE ===
+def from_raw_list(raw_questions, first_id=1):
+    """Questions utilizables de la respuesta del modelo, numeradas desde `first_id`."""
+    questions = []
+    for raw in raw_questions:
+        q = Question.from_raw(raw, first_id + len(questions))
+        if q is not None:
+            questions.append(q)
+    return questions
+
+
+def fix_all(questions):
+    """Aplica el blindaje a todas; devuelve el numero de correcciones."""
+    return sum(1 for q in questions if q.fix_correct_index())
+
+
+def shuffle_all(questions, rng=random, seed=SHUFFLE_SEED):
+    seed = _seed_value(seed)
+    for q in questions:
+        q.shuffle(rng, seed)
+
+
+def process_batch(raw_questions, seed=SHUFFLE_SEED, timings=None):
+    """
+    Lote completo: construye, numera, aplica el blindaje y baraja.
+    Devuelve (preguntas, correcciones). Con `timings` acumula los segundos
+    de "validation" y "shuffle".
+    """
+    t0 = time.perf_counter()
+    questions = from_raw_list(raw_questions)
+    fixes = fix_all(questions)
+    t1 = time.perf_counter()
+    shuffle_all(questions, seed=seed)
+    if timings is not None:
+        t2 = time.perf_counter()
+        timings["validation"] = timings.get("validation", 0.0) + (t1 - t0)
+        timings["shuffle"] = timings.get("shuffle", 0.0) + (t2 - t1)
+    return questions, fixes
+
+
+def renumber(questions, first_id=1):
+    for i, q in enumerate(questions):
+        q.id = first_id + i
+
+
+def to_json_list(questions):
+    return [q.to_json() for q in questions]
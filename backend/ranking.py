@@ -0,0 +1,64 @@
+import json
+import os
+
+from logs import get_logger
+from storage import data_path
+
+log = get_logger("ranking")
+
+
+# === RANKING DE MODELOS ===
+# benchmarks/probe_models.py descubre los modelos de cada motor, les pasa
+# una sonda de examen pequena y escribe DATA_DIR/model_ranking.json:
+#     {"generated": ..., "probe": {...},
+#      "engines": {"gemini": {"chain": [modelos], "models": [medidas]}, ...}}
+# Al arrancar, los motores toman de aqui su cadena de fallback (Gemini) o
+# su modelo por defecto (Groq, Ollama) y el enrutador de "auto" sus
+# estimaciones iniciales. Sin fichero se usan los valores de siempre.
+
+RANKING_FILE = os.getenv("MODEL_RANKING_FILE") or data_path("model_ranking.json")
+
+
+def load_ranking(path=RANKING_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            ranking = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log.warning("Ranking de modelos ilegible, se ignora", path=path, error=str(e))
+        return {}
+    log.info("Ranking de modelos cargado", path=path, generated=ranking.get("generated"),
+             engines={name: entry.get("chain") for name, entry in ranking.get("engines", {}).items()})
+    return ranking
+
+
+def save_ranking(ranking, path=RANKING_FILE):
+    """Escritura atomica (tmp + replace)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(ranking, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+RANKING = load_ranking()
+
+
+def model_chain(engine, default):
+    """Modelos del motor de mejor a peor segun el ranking, o `default`."""
+    chain = RANKING.get("engines", {}).get(engine, {}).get("chain")
+    return list(chain) if chain else list(default)
+
+
+def default_model(engine, default):
+    chain = model_chain(engine, [default])
+    return chain[0]
+
+
+def probe_result(engine, model):
+    """Medidas de la sonda para (motor, modelo), o None."""
+    for entry in RANKING.get("engines", {}).get(engine, {}).get("models", ()):
+        if entry.get("model") == model:
+            return entry
+    return None
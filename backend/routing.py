@@ -0,0 +1,149 @@
+import os
+import time
+
+from logs import get_logger
+from metrics import ROUTE_EXPECTED_SECONDS
+from ranking import probe_result
+
+log = get_logger("routing")
+
+
+# === ESTADISTICAS DE ENRUTADO ===
+# Cada intento contra un motor (sea cual sea el ai_engine pedido) alimenta
+# una EWMA por (motor, modelo): latencia total, tokens/s de salida y tasa de
+# fallos. El motor "auto" (auto_client.py) ordena los destinos por el tiempo
+# esperado hasta una respuesta valida:
+#     segundos_referencia / (1 - tasa_fallos)
+# donde segundos_referencia = ROUTE_REFERENCE_TOKENS / tokens_por_segundo
+# (o la latencia media si aun no hay tokens/s). Tras ROUTE_TRIP_FAILURES
+# fallos seguidos el destino se da por caido durante ROUTE_COOLDOWN_SECONDS
+# y pasa al final del plan; el primer exito lo rehabilita.
+# Los destinos medidos por benchmarks/probe_models.py empiezan con los
+# valores de la sonda en lugar del tiempo supuesto.
+
+ROUTE_ALPHA = float(os.getenv("ROUTE_ALPHA", "0.3"))
+ROUTE_REFERENCE_TOKENS = int(os.getenv("ROUTE_REFERENCE_TOKENS", "1500"))
+# Tiempo supuesto para un destino sin observaciones: se prueba tras los ya conocidos y rapidos
+ROUTE_PRIOR_SECONDS = float(os.getenv("ROUTE_PRIOR_SECONDS", "20"))
+ROUTE_TRIP_FAILURES = int(os.getenv("ROUTE_TRIP_FAILURES", "3"))
+ROUTE_COOLDOWN_SECONDS = float(os.getenv("ROUTE_COOLDOWN_SECONDS", "60"))
+# Techo de la tasa de fallos al puntuar (evita dividir por cero)
+MAX_FAILURE_RATE = 0.95
+
+
+class TargetStats:
+    """EWMA de un (motor, modelo)."""
+
+    def __init__(self, engine, model):
+        self.engine = engine
+        self.model = model
+        self.latency = None
+        self.tokens_per_second = None
+        self.failure_rate = 0.0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.probed = False
+        probe = probe_result(engine, model)
+        if probe and probe.get("runs"):
+            self.probed = True
+            self.latency = probe.get("total_seconds")
+            self.tokens_per_second = probe.get("tokens_per_second")
+            self.failure_rate = 1.0 - probe.get("validity", 1.0)
+
+    def _ewma(self, current, sample):
+        return sample if current is None else current + ROUTE_ALPHA * (sample - current)
+
+    def record(self, ok, seconds=None, tokens=None):
+        self.failure_rate = self._ewma(self.failure_rate, 0.0 if ok else 1.0)
+        if ok:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.down_until = 0.0
+            if seconds:
+                self.latency = self._ewma(self.latency, seconds)
+                if tokens:
+                    self.tokens_per_second = self._ewma(self.tokens_per_second, tokens / seconds)
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= ROUTE_TRIP_FAILURES and self.healthy():
+                self.down_until = time.monotonic() + ROUTE_COOLDOWN_SECONDS
+                log.warning("Destino marcado como caido", engine=self.engine, model=self.model,
+                            failures=self.consecutive_failures, cooldown_s=ROUTE_COOLDOWN_SECONDS)
+
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def expected_seconds(self):
+        """Tiempo esperado hasta una respuesta valida de ROUTE_REFERENCE_TOKENS tokens."""
+        if self.tokens_per_second:
+            seconds = ROUTE_REFERENCE_TOKENS / self.tokens_per_second
+        elif self.latency is not None:
+            seconds = self.latency
+        else:
+            seconds = ROUTE_PRIOR_SECONDS
+        return seconds / (1 - min(self.failure_rate, MAX_FAILURE_RATE))
+
+    def snapshot(self):
+        return {
+            "engine": self.engine,
+            "model": self.model,
+            "healthy": self.healthy(),
+            "expected_seconds": round(self.expected_seconds(), 2),
+            "latency_seconds": round(self.latency, 2) if self.latency is not None else None,
+            "tokens_per_second": round(self.tokens_per_second, 1) if self.tokens_per_second else None,
+            "failure_rate": round(self.failure_rate, 3),
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+
+class Router:
+    def __init__(self):
+        self.targets = {}
+
+    def stats(self, engine, model):
+        key = (engine, model or "")
+        if key not in self.targets:
+            self.targets[key] = TargetStats(engine, model or "")
+        return self.targets[key]
+
+    def record(self, engine, model, ok, seconds=None, tokens=None):
+        """Resultado de un intento (exito = JSON utilizable)."""
+        stats = self.stats(engine, model)
+        stats.record(ok, seconds, tokens)
+        ROUTE_EXPECTED_SECONDS.set(round(stats.expected_seconds(), 3), engine=engine, model=model or "")
+
+    def rank(self, targets):
+        """
+        Ordena [(motor, modelo), ...]: primero los sanos por tiempo esperado;
+        los caidos al final (si todo esta caido se prueba igualmente). A
+        igualdad se respeta el orden recibido (preferencia configurada).
+        """
+        def key(item):
+            index, (engine, model) = item
+            stats = self.stats(engine, model)
+            return (not stats.healthy(), stats.expected_seconds(), index)
+        return [target for _, target in sorted(enumerate(targets), key=key)]
+
+    def describe(self, engine, model):
+        """Resumen corto para los logs SSE."""
+        stats = self.stats(engine, model)
+        parts = [f"~{stats.expected_seconds():.0f}s"]
+        if stats.tokens_per_second:
+            parts.append(f"{stats.tokens_per_second:.0f} tok/s")
+        if stats.successes or stats.failures or stats.probed:
+            parts.append(f"fallos {stats.failure_rate:.0%}")
+        else:
+            parts.append("sin datos")
+        if not stats.healthy():
+            parts.append("CAIDO")
+        return ", ".join(parts)
+
+    def snapshot(self):
+        return sorted((s.snapshot() for s in self.targets.values()), key=lambda s: (not s["healthy"], s["expected_seconds"]))
+
+
+router = Router()
@@ -0,0 +1,323 @@
+import asyncio
+import math
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from logs import get_logger
+from metrics import ENGINE_ACTIVE, ENGINE_QUEUED, SHED, STAGE_SECONDS
+
+log = get_logger("scheduler")
+
+
+# === ADMISION Y COLA JUSTA POR MOTOR ===
+# Cada motor tiene un limite de generaciones simultaneas (una sola instancia
+# de Ollama no gana nada atendiendo 5 a la vez; Gemini comparte cuota). Las
+# demas esperan en una cola acotada:
+#   - prioridad: "interactive" antes que "background" (precargas, lotes)
+#   - dentro de cada prioridad, turno rotatorio por cliente (IP), para que
+#     quien lanza 4 examenes no deje esperando a los demas
+#   - con la cola llena se rechaza al entrar (503 + Retry-After)
+# Mientras esperan, los clientes reciben su posicion y un ETA por SSE.
+# Con JOB_MODE=queue cada worker tiene su scheduler y el limite se aplica
+# ademas entre todos ellos (Scheduler.shared, ver jobs.SharedEngineSlots).
+
+PRIORITIES = ("interactive", "background")
+DEFAULT_LIMITS = {"ollama": 1, "gemini": 4, "groq": 4}
+DEFAULT_LIMIT = 2
+MAX_QUEUE = int(os.getenv("ENGINE_QUEUE_MAX", "32"))
+MAX_QUEUED_PER_CLIENT = int(os.getenv("ENGINE_QUEUE_PER_CLIENT", "4"))
+# Las peticiones en segundo plano solo pueden ocupar esta fraccion de la cola
+BACKGROUND_QUEUE_SHARE = 0.5
+# Duracion inicial estimada de una generacion (se ajusta con una EWMA)
+INITIAL_SERVICE_SECONDS = 30.0
+EWMA_ALPHA = 0.3
+POSITION_UPDATE_SECONDS = 5.0
+# Sondeo del hueco comun entre procesos (Scheduler.shared)
+SHARED_POLL_SECONDS = 1.0
+
+
+def _parse_limits(spec):
+    """"ollama=1,gemini=6" -> {"ollama": 1, "gemini": 6}"""
+    limits = dict(DEFAULT_LIMITS)
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip().isdigit():
+            limits[name.strip()] = max(1, int(value))
+    return limits
+
+
+ENGINE_LIMITS = _parse_limits(os.getenv("ENGINE_CONCURRENCY"))
+
+
+class Overloaded(Exception):
+    """La cola del motor esta llena: la peticion se rechaza al entrar."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(self, engine, client, priority):
+        self.engine = engine
+        self.client = client or "anon"
+        self.priority = priority if priority in PRIORITIES else PRIORITIES[0]
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.granted = asyncio.get_running_loop().create_future()
+        # Identificador de la reserva en Scheduler.shared (None si no tiene)
+        self.shared_id = None
+
+
+class EngineQueue:
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.service_seconds = INITIAL_SERVICE_SECONDS
+        # prioridad -> OrderedDict(cliente -> deque de tickets); el orden del
+        # OrderedDict es el turno rotatorio
+        self.waiting = {p: OrderedDict() for p in PRIORITIES}
+
+    # --- estado ---
+    def queued(self, priority=None):
+        priorities = [priority] if priority else PRIORITIES
+        return sum(len(q) for p in priorities for q in self.waiting[p].values())
+
+    def queued_for(self, client):
+        return sum(len(self.waiting[p].get(client, ())) for p in PRIORITIES)
+
+    def order(self):
+        """Tickets en el orden en que se atenderan (simulando el turno rotatorio)."""
+        result = []
+        for p in PRIORITIES:
+            queues = [list(q) for q in self.waiting[p].values()]
+            depth = max((len(q) for q in queues), default=0)
+            for i in range(depth):
+                result.extend(q[i] for q in queues if i < len(q))
+        return result
+
+    def position(self, ticket):
+        try:
+            return self.order().index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def eta(self, position):
+        """Segundos estimados hasta empezar estando en `position`."""
+        if position <= 0:
+            return 0.0
+        if self.active < self.limit and position <= self.limit - self.active:
+            return 0.0
+        rounds = math.ceil((position - (self.limit - self.active)) / self.limit)
+        return rounds * self.service_seconds
+
+    # --- admision ---
+    def check_admission(self, client, priority):
+        total = self.queued()
+        capacity = MAX_QUEUE if priority != "background" else int(MAX_QUEUE * BACKGROUND_QUEUE_SHARE)
+        if self.active < self.limit and total == 0:
+            return
+        if total >= capacity:
+            SHED.inc(engine=self.name, reason="queue_full", priority=priority)
+            raise Overloaded(f"Cola de {self.name} llena ({total} en espera). Prueba en unos minutos.",
+                             retry_after=self.eta(total + 1))
+        if self.queued_for(client) >= MAX_QUEUED_PER_CLIENT:
+            SHED.inc(engine=self.name, reason="client_limit", priority=priority)
+            raise Overloaded(f"Ya tienes {MAX_QUEUED_PER_CLIENT} examenes en cola en {self.name}.",
+                             retry_after=self.eta(total + 1))
+
+    def enqueue(self, ticket):
+        self.waiting[ticket.priority].setdefault(ticket.client, deque()).append(ticket)
+        self._dispatch()
+
+    def _next(self):
+        for p in PRIORITIES:
+            queues = self.waiting[p]
+            if queues:
+                client, q = next(iter(queues.items()))
+                ticket = q.popleft()
+                # El cliente pasa al final del turno (o sale si no le quedan)
+                del queues[client]
+                if q:
+                    queues[client] = q
+                return ticket
+        return None
+
+    def _dispatch(self):
+        while self.active < self.limit:
+            ticket = self._next()
+            if ticket is None:
+                break
+            self.active += 1
+            ticket.started = time.monotonic()
+            ticket.granted.set_result(True)
+        self._publish()
+
+    def release(self, ticket):
+        if ticket.started is not None:
+            self.active -= 1
+            elapsed = time.monotonic() - ticket.started
+            self.service_seconds += EWMA_ALPHA * (elapsed - self.service_seconds)
+        else:
+            # Se fue mientras esperaba
+            q = self.waiting[ticket.priority].get(ticket.client)
+            if q and ticket in q:
+                q.remove(ticket)
+                if not q:
+                    del self.waiting[ticket.priority][ticket.client]
+            if not ticket.granted.done():
+                ticket.granted.cancel()
+        self._dispatch()
+
+    def promote(self, ticket):
+        """Pasa a "interactive" un ticket en espera (p.ej. una precarga que ya se ha pedido)."""
+        q = self.waiting["background"].get(ticket.client)
+        if ticket.started is not None or not q or ticket not in q:
+            return False
+        q.remove(ticket)
+        if not q:
+            del self.waiting["background"][ticket.client]
+        ticket.priority = "interactive"
+        self.waiting["interactive"].setdefault(ticket.client, deque()).append(ticket)
+        self._dispatch()
+        return True
+
+    def _publish(self):
+        ENGINE_ACTIVE.set(self.active, engine=self.name)
+        for p in PRIORITIES:
+            ENGINE_QUEUED.set(self.queued(p), engine=self.name, priority=p)
+
+    def snapshot(self):
+        return {
+            "engine": self.name,
+            "limit": self.limit,
+            "active": self.active,
+            "queued": {p: self.queued(p) for p in PRIORITIES},
+            "service_seconds": round(self.service_seconds, 1),
+        }
+
+
+class Scheduler:
+    def __init__(self, limits=None, shared=None):
+        self.limits = limits or ENGINE_LIMITS
+        self.queues = {}
+        # Huecos por motor comunes a varios procesos (jobs.SharedEngineSlots) o None
+        self.shared = shared
+
+    def queue(self, engine):
+        if engine not in self.queues:
+            self.queues[engine] = EngineQueue(engine, self.limits.get(engine, DEFAULT_LIMIT))
+        return self.queues[engine]
+
+    def check_admission(self, engine, client, priority):
+        """Lanza Overloaded si la peticion no cabe en la cola del motor."""
+        self.queue(engine).check_admission(client or "anon", priority)
+
+    async def turn(self, engine, client, priority, display_name=None, mode=None, slot=None):
+        """
+        Async generator: espera turno emitiendo logs de posicion/ETA y
+        devuelve (como ultimo elemento) el Ticket concedido. Hay que liberarlo
+        con release() al acabar, tambien si la peticion falla o se cancela.
+        Vuelve a comprobar la admision (lanza Overloaded): entre la
+        comprobacion al recibir la peticion y el inicio del stream han podido
+        entrar otras. Con `slot` (EngineSlot) el ticket queda en slot.ticket
+        desde que entra en la cola.
+        """
+        queue = self.queue(engine)
+        queue.check_admission(client or "anon", priority)
+        ticket = Ticket(engine, client, priority)
+        queue.enqueue(ticket)
+        if slot is not None:
+            slot.ticket = ticket
+        try:
+            last_position = None
+            while not ticket.granted.done():
+                position = queue.position(ticket)
+                if position != last_position:
+                    last_position = position
+                    eta = queue.eta(position)
+                    yield {"type": "log", "msg": f"[COLA] Posicion {position} en {display_name or engine} "
+                                                 f"({queue.active}/{queue.limit} generando). ETA ~{int(eta)}s"}
+                await asyncio.wait({ticket.granted}, timeout=POSITION_UPDATE_SECONDS)
+            if self.shared is not None:
+                holder = uuid.uuid4().hex
+                while not self.shared.acquire(engine, holder, queue.limit):
+                    if last_position != "shared":
+                        last_position = "shared"
+                        yield {"type": "log", "msg": f"[COLA] {display_name or engine} ocupado por otros workers "
+                                                     f"({queue.limit} a la vez). Esperando hueco..."}
+                    await asyncio.sleep(SHARED_POLL_SECONDS)
+                ticket.shared_id = holder
+                # La generacion empieza ahora (la EWMA no cuenta la espera)
+                ticket.started = time.monotonic()
+        except BaseException:
+            self.release(ticket)
+            if slot is not None:
+                slot.ticket = None
+            raise
+        waited = ticket.started - ticket.enqueued
+        STAGE_SECONDS.observe(waited, stage="queue_wait", engine=engine, mode=mode)
+        if last_position is not None:
+            log.info("Turno concedido", engine=engine, client=ticket.client, priority=ticket.priority,
+                     waited_s=round(waited, 2))
+            yield {"type": "log", "msg": f"[COLA] Turno concedido tras {waited:.0f}s de espera."}
+        yield ticket
+
+    def release(self, ticket):
+        if ticket.shared_id is not None:
+            self.shared.release(ticket.shared_id)
+            ticket.shared_id = None
+        self.queue(ticket.engine).release(ticket)
+
+    def promote(self, ticket):
+        return self.queue(ticket.engine).promote(ticket)
+
+    def snapshot(self):
+        return [self.queue(name).snapshot() for name in sorted(set(self.limits) | set(self.queues))]
+
+
+scheduler = Scheduler()
+
+
+class EngineSlot:
+    """
+    Turno de una peticion que puede cambiar de motor. "auto" pasa a otro
+    proveedor cuando falla el primero, y cada llamada tiene que respetar el
+    limite y la cola del motor que la atiende de verdad: acquire() suelta el
+    turno que se tenga en otro motor y espera uno en el nuevo.
+    """
+
+    def __init__(self, client, priority, mode=None, scheduler=scheduler):
+        self.client = client
+        self.priority = priority
+        self.mode = mode
+        self.scheduler = scheduler
+        self.ticket = None
+
+    @property
+    def engine(self):
+        """Motor en el que se tiene (o se espera) turno; None sin turno."""
+        return self.ticket.engine if self.ticket else None
+
+    async def acquire(self, engine, display_name=None):
+        """Async generator de logs de cola (como turn); lanza Overloaded si no cabe."""
+        if self.engine == engine:
+            return
+        self.release()
+        async for item in self.scheduler.turn(engine, self.client, self.priority, display_name,
+                                              mode=self.mode, slot=self):
+            if not isinstance(item, Ticket):
+                yield item
+
+    def release(self):
+        if self.ticket:
+            ticket, self.ticket = self.ticket, None
+            self.scheduler.release(ticket)
+
+    def promote(self):
+        """Pasa a "interactive" el turno en espera y los que se pidan despues (fallbacks)."""
+        self.priority = "interactive"
+        return bool(self.ticket) and self.scheduler.promote(self.ticket)
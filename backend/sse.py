@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+import zlib
+
+from fastapi.responses import StreamingResponse
+
+try:
+    import orjson
+except ImportError:  # opcional: con json de la stdlib funciona igual, algo mas lento
+    orjson = None
+
+
+# === ESCRITOR SSE ===
+# Los eventos de un examen son muchos logs pequenos y unos pocos lotes de
+# preguntas. En vez de un write por evento:
+#   - JSON con orjson si esta instalado
+#   - los logs que llegan dentro de SSE_COALESCE_SECONDS se agrupan en un
+#     solo write; un lote de preguntas o [DONE] vacia el grupo al momento
+#   - comentario ": keep-alive" tras SSE_HEARTBEAT_SECONDS sin eventos, para
+#     que proxies y balanceadores no corten las esperas largas de Ollama
+#   - gzip por stream si el cliente lo acepta (SSE_COMPRESSION=off lo
+#     desactiva), con Z_SYNC_FLUSH en cada write para no retener eventos
+
+COALESCE_SECONDS = float(os.getenv("SSE_COALESCE_SECONDS", "0.05"))
+HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+COMPRESSION = os.getenv("SSE_COMPRESSION", "auto")
+HEARTBEAT = ": keep-alive\n\n"
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload).decode("utf-8")
+    return json.dumps(payload)
+
+
+def format_sse(payload, trace_id, seq):
+    """Un evento SSE. Todos llevan id (traza-secuencia); los dict llevan ademas trace_id."""
+    if payload == "[DONE]":
+        data = payload
+    else:
+        if isinstance(payload, dict):
+            payload = {**payload, "trace_id": trace_id}
+        data = dumps(payload)
+    return f"id: {trace_id}-{seq}\ndata: {data}\n\n"
+
+
+def _is_log(payload):
+    return isinstance(payload, dict) and payload.get("type") == "log"
+
+
+async def sse_chunks(events, trace_id, coalesce=COALESCE_SECONDS, heartbeat=HEARTBEAT_SECONDS):
+    """
+    Async generator de trozos de texto SSE a partir de `events`, un async
+    iterator de (seq, payload); un None de la fuente cuenta como latido.
+    """
+    loop = asyncio.get_running_loop()
+    buffer, deadline = [], None
+    step = None
+    try:
+        while True:
+            if step is None:
+                step = asyncio.ensure_future(events.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else heartbeat
+            done, _ = await asyncio.wait({step}, timeout=timeout)
+            if not done:
+                # Vence la ventana de agrupado (se vacia) o el latido; el paso sigue pendiente
+                if buffer:
+                    yield "".join(buffer)
+                    buffer, deadline = [], None
+                else:
+                    yield HEARTBEAT
+                continue
+            try:
+                item = step.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                step = None
+            if item is None:
+                if not buffer:
+                    yield HEARTBEAT
+                continue
+            seq, payload = item
+            buffer.append(format_sse(payload, trace_id, seq))
+            if _is_log(payload) and coalesce > 0:
+                if deadline is None:
+                    deadline = loop.time() + coalesce
+                if loop.time() < deadline:
+                    continue
+            yield "".join(buffer)
+            buffer, deadline = [], None
+        if buffer:
+            yield "".join(buffer)
+    except BaseException:
+        if step is not None:
+            step.cancel()
+        raise
+    finally:
+        if step is None or step.done():
+            await events.aclose()
+        else:
+            # La fuente aun esta deshaciendo la cancelacion: se cierra despues
+            step.add_done_callback(lambda _: asyncio.ensure_future(events.aclose()))
+
+
+def negotiate_encoding(request):
+    """"gzip" si el cliente lo acepta (q > 0) y la compresion esta activa; si no None."""
+    if COMPRESSION == "off":
+        return None
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() == "gzip":
+            q = params.strip()
+            if q.startswith("q="):
+                try:
+                    return "gzip" if float(q[2:]) > 0 else None
+                except ValueError:
+                    return None
+            return "gzip"
+    return None
+
+
+async def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        async for chunk in chunks:
+            data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            # SYNC_FLUSH: el cliente puede descomprimir el evento sin esperar al siguiente
+            yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        await chunks.aclose()
+
+
+def sse_response(request, chunks, headers=None, background=None):
+    """
+    StreamingResponse text/event-stream, comprimida si el cliente lo negocia.
+    `background` (BackgroundTask) corre al acabar la respuesta aunque el
+    cuerpo no llegue a iterarse.
+    """
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **(headers or {})}
+    encoding = negotiate_encoding(request)
+    if encoding == "gzip":
+        chunks = _gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    headers["Vary"] = "Accept-Encoding"
+    return StreamingResponse(chunks, media_type="text/event-stream", headers=headers, background=background)
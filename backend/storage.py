@@ -0,0 +1,100 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+
+from logs import get_logger
+
+log = get_logger("storage")
+
+
+# === ALMACEN LOCAL ===
+# Estado persistente del backend (historial, caches...). Por defecto en
+# backend/.data; SIMULADOR_DATA_DIR permite moverlo (p.ej. en Electron).
+DATA_DIR = os.getenv("SIMULADOR_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+
+# Los guardados diferidos (DeferredSave) escriben como mucho cada tantos segundos
+SAVE_DELAY_SECONDS = float(os.getenv("STORE_SAVE_SECONDS", "2"))
+
+_write_lock = threading.Lock()
+
+
+def data_path(*parts):
+    """Ruta dentro de DATA_DIR, creando los directorios intermedios."""
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def load_json(name, default):
+    """Lee un JSON del almacen; devuelve `default` si no existe o esta corrupto."""
+    try:
+        with open(data_path(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(name, data):
+    """Escritura atomica (tmp + replace) para no dejar ficheros a medias."""
+    path = data_path(name)
+    tmp = f"{path}.tmp"
+    with _write_lock:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+
+class DeferredSave:
+    """
+    Guardado diferido de un JSON del almacen para estado que cambia en cada
+    examen (historial, cobertura). mark() solo apunta que hay cambios: un
+    hilo escribe `snapshot()` como mucho cada `delay` segundos, y al salir.
+    Varios cambios seguidos se escriben una sola vez y el bucle de eventos
+    nunca espera al disco. Con delay <= 0 se escribe en el acto.
+    """
+
+    def __init__(self, name, snapshot, delay=SAVE_DELAY_SECONDS):
+        self.name = name
+        self.snapshot = snapshot
+        self.delay = delay
+        self._dirty = threading.Event()
+        self._flush_lock = threading.Lock()
+        if delay > 0:
+            threading.Thread(target=self._loop, name=f"save-{name}", daemon=True).start()
+            atexit.register(self.flush)
+
+    def mark(self):
+        self._dirty.set()
+        if self.delay <= 0:
+            self.flush()
+
+    def flush(self):
+        """Escribe ya si hay cambios pendientes."""
+        with self._flush_lock:
+            if not self._dirty.is_set():
+                return
+            self._dirty.clear()
+            try:
+                save_json(self.name, self.snapshot())
+            except OSError:
+                # Se reintenta en la siguiente vuelta
+                self._dirty.set()
+                raise
+
+    def _loop(self):
+        while True:
+            self._dirty.wait()
+            # Agrupa los cambios que lleguen mientras tanto
+            time.sleep(self.delay)
+            try:
+                self.flush()
+            except OSError as e:
+                log.warning("No se pudo guardar", file=self.name, error=f"{type(e).__name__}: {e}")
+
+
+def content_hash(text):
+    """Identificador estable de un documento (sha256 del texto)."""
+    return hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Los modulos del backend se importan por nombre (como hace uvicorn desde backend/)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Antes de importar nada: el estado (jobs.sqlite3, usage.sqlite3...) va a un directorio temporal
+os.environ.setdefault("SIMULADOR_DATA_DIR", tempfile.mkdtemp(prefix="simulador-tests-"))
+os.environ.setdefault("ADMIN_TOKEN", "test-admin-token")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
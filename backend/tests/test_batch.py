@@ -0,0 +1,162 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import batch
+import coverage
+import main
+from batch import SPEC_DEFAULTS, Batch, BatchSources, parse_specs
+from coverage import Document
+
+TOPICS = ["volcanes", "rios", "montañas", "desiertos", "glaciares"]
+
+
+def spec(variants=1, **fields):
+    return json.dumps({"exam": fields, "variants": variants})
+
+
+@pytest.fixture
+def topics_dir(tmp_path):
+    for topic in TOPICS:
+        (tmp_path / f"{topic}.md").write_text(f"Tema de {topic}. " + " ".join([topic] * 30), encoding="utf-8")
+    # Vacio: no cuenta como tema
+    (tmp_path / "vacio.txt").write_text("", encoding="utf-8")
+    return str(tmp_path)
+
+
+def sources():
+    return BatchSources(pdf_text=lambda data: "")
+
+
+def test_variants_expand_one_spec():
+    specs = parse_specs(json.dumps({"exam": {"topic": "Sumas", "num_questions": "5"}, "variants": 3}))
+    assert len(specs) == 3
+    assert all(s == {**SPEC_DEFAULTS, "topic": "Sumas", "num_questions": 5} for s in specs)
+    # Copias independientes
+    specs[0]["topic"] = "Restas"
+    assert specs[1]["topic"] == "Sumas"
+
+
+def test_exam_list_keeps_order_and_variants():
+    raw = json.dumps({"exams": [
+        {"topic": "Sumas", "variants": 2},
+        {"mode": "simulacro_3", "directory_path": "/temas", "ai_engine": "groq", "condense": "raro"},
+    ]})
+    specs = parse_specs(raw)
+    assert [s["mode"] for s in specs] == ["manual", "manual", "simulacro_3"]
+    assert specs[2]["ai_engine"] == "groq"
+    # Un condense desconocido se ignora
+    assert specs[2]["condense"] == "off"
+
+
+@pytest.mark.parametrize("raw, message", [
+    ("{no es json", "no es JSON"),
+    ("[1, 2]", "debe ser un objeto"),
+    ('{"variants": 2}', 'debe incluir "exam"'),
+    ('{"exams": {"topic": "x"}}', "lista de objetos"),
+    ('{"exams": []}', "no tiene examenes"),
+    (spec(topic="x", colour="rojo", size=1), "Campos desconocidos: colour, size"),
+    (spec(topic="x", variants="dos"), "enteros"),
+    (spec(topic="x", num_questions=0), "positivos"),
+    (spec(topic="x", variants=0), "positivos"),
+    (spec(mode="tema_libre"), "Modo no soportado"),
+    (spec(topic="x", ai_engine="gpt"), "Motor desconocido"),
+    (spec(mode="random_1"), "necesita directory_path"),
+])
+def test_invalid_specs(raw, message):
+    with pytest.raises(ValueError, match=message):
+        parse_specs(raw)
+
+
+def test_batch_size_is_capped(monkeypatch):
+    monkeypatch.setattr(batch, "BATCH_MAX_EXAMS", 4)
+    assert len(parse_specs(spec(topic="x", variants=4))) == 4
+    with pytest.raises(ValueError, match="Como mucho 4 examenes por lote \\(pedidos 5\\)"):
+        parse_specs(spec(topic="x", variants=5))
+
+
+def test_prepare_reports_missing_inputs(topics_dir, tmp_path_factory):
+    empty = str(tmp_path_factory.mktemp("sin_temas"))
+    with pytest.raises(ValueError, match="No hay temas"):
+        sources().prepare(parse_specs(spec(mode="random_1", directory_path=empty)))
+    with pytest.raises(ValueError, match="ya no existe"):
+        sources().prepare(parse_specs(spec(context_id="no-existe")))
+    with pytest.raises(ValueError, match="necesitan un fichero"):
+        sources().prepare(parse_specs(spec()))
+    # Con fichero subido no hace falta topic
+    BatchSources(pdf_text=lambda data: "", upload="texto").prepare(parse_specs(spec()))
+    sources().prepare(parse_specs(spec(mode="simulacro_3", directory_path=topics_dir)))
+
+
+def test_folder_is_read_once(topics_dir, monkeypatch):
+    shared = sources()
+    reads = []
+    read_file = shared._read_file
+    monkeypatch.setattr(shared, "_read_file", lambda path: reads.append(path) or read_file(path))
+    docs = shared.folder(topics_dir, "off")
+    assert sorted(doc.name for doc in docs) == sorted(f"{topic}.md" for topic in TOPICS)
+    assert shared.folder(topics_dir, "off") is docs
+    assert len(reads) == len(TOPICS) + 1
+
+
+def test_deal_rotates_without_repeats(topics_dir):
+    shared = sources()
+    docs = shared.folder(topics_dir, "off")
+    dealt = [shared.deal(topics_dir, "off", 3) for _ in range(3)]
+    # Sin repetir dentro de un examen y en rotacion entre examenes
+    assert all(len({doc.id for doc in exam}) == 3 for exam in dealt)
+    flat = [doc for exam in dealt for doc in exam]
+    assert flat == [docs[i % len(docs)] for i in range(9)]
+    # Mas temas de los que hay: cada uno una vez
+    assert len(shared.deal(topics_dir, "off", 10)) == len(TOPICS)
+
+
+def test_fragment_continues_where_the_last_use_ended(monkeypatch):
+    monkeypatch.setattr(coverage, "CHUNK_TOKENS", 1)
+    doc = Document("\n\n".join(f"Parrafo {i}: " + " ".join([f"palabra{i}"] * 10) + "." for i in range(4)), "doc")
+    assert len(doc.chunks) == 4
+    shared = sources()
+    budget = doc.costs[0] + doc.costs[1]
+    assert shared.fragment(doc, budget) == " ".join(doc.chunks[:2])
+    assert shared.fragment(doc, doc.costs[2] + doc.costs[3]) == " ".join(doc.chunks[2:])
+    # Da la vuelta al documento
+    assert shared.fragment(doc, doc.costs[0]) == doc.chunks[0]
+    # Otra ingesta empieza desde el principio
+    assert sources().fragment(doc, doc.costs[0]) == doc.chunks[0]
+
+
+def test_oversized_chunk_is_cut_to_the_budget(monkeypatch):
+    monkeypatch.setattr(coverage, "CHUNK_TOKENS", 10_000)
+    doc = Document(" ".join(f"Frase numero {i} del documento." for i in range(200)), "largo")
+    fragment = sources().fragment(doc, 50)
+    assert fragment and len(fragment) < len(doc.text)
+    assert fragment.startswith("Frase numero 0")
+    assert sources().fragment(Document("", "vacio")) == ""
+
+
+def test_cross_duplicates_counts_repeats_of_earlier_exams():
+    def exam(*topics):
+        return {"questions": [{"question": f"¿Cual es la capital de {topic}?", "options": ["A", "B"],
+                               "correct_index": 0} for topic in topics]}
+
+    specs = parse_specs(spec(topic="Capitales", num_questions=2, variants=3))
+    lote = Batch("b" * 32, None, specs, sources(), "cliente")
+    lote.exams = [exam("Francia", "Italia"), None, exam("Italia", "Portugal")]
+    assert lote.name == "lote-bbbbbbbb"
+    assert lote.cross_duplicates() == [0, 0, 1]
+
+
+def test_repeated_traceparent_gets_distinct_batches(monkeypatch):
+    async def run_batch(batch, on_finish=None):
+        on_finish(None)
+    monkeypatch.setattr(main, "run_batch", run_batch)
+    trace_id = "0123456789abcdef0123456789abcdef"
+    headers = {"traceparent": f"00-{trace_id}-0123456789abcdef-01"}
+    with TestClient(main.app) as client:
+        responses = [client.post("/batches", data={"spec": spec(topic="Sumas", ai_engine="ollama")}, headers=headers)
+                     for _ in range(2)]
+        assert [r.status_code for r in responses] == [200, 200]
+        ids = [r.json()["batch_id"] for r in responses]
+        assert ids[0] != ids[1] and trace_id not in ids
+        assert all(r.headers["X-Trace-Id"] == trace_id for r in responses)
@@ -0,0 +1,66 @@
+import budget
+from budget import context_budget, estimate_cost, estimate_tokens, get_window, pack_context
+
+LAW = """Articulo 1. Objeto.
+La presente ley regula el procedimiento administrativo comun. Se aplica a todas las administraciones publicas.
+
+Articulo 2. Ambito.
+1. El plazo maximo para resolver es de tres meses. Transcurrido el plazo, el silencio es positivo.
+2. Los interesados pueden recurrir en alzada. El recurso se presenta ante el organo superior.
+
+Articulo 3. Recursos.
+Contra las resoluciones que agotan la via administrativa cabe recurso potestativo de reposicion."""
+
+
+def test_estimate_tokens_counts_words_and_punctuation():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hola") == 1
+    # "administraciones" (16 letras) = 4 tokens, mas el punto
+    assert estimate_tokens("administraciones.") == 5
+
+
+def test_whole_document_fits():
+    text, used = pack_context(LAW, 10_000)
+    assert text.startswith("Articulo 1. Objeto.") and text.endswith("reposicion.")
+    assert used == estimate_tokens(text)
+
+
+def test_packing_keeps_whole_articles_then_paragraphs_then_sentences():
+    first = "Articulo 1. Objeto. La presente ley regula el procedimiento administrativo comun. " \
+            "Se aplica a todas las administraciones publicas."
+    assert pack_context(LAW, 40) == (first, 40)
+    # Del articulo 2 solo entra su primer parrafo (el titulo)
+    assert pack_context(LAW, 50) == (first + " Articulo 2. Ambito.", 48)
+    # Del parrafo que no cabe entero, frases completas
+    text, used = pack_context(LAW, 70)
+    assert text.endswith("Ambito. 1. El plazo maximo para resolver es de tres meses.") and used <= 70
+
+
+def test_packing_never_cuts_a_sentence():
+    for token_budget in range(5, estimate_tokens(LAW), 3):
+        text, used = pack_context(LAW, token_budget)
+        assert used <= token_budget
+        if text:
+            assert text.endswith((".", ":")), (token_budget, text[-30:])
+
+
+def test_unstructured_text_is_cut_on_a_space():
+    text, used = pack_context("palabra " * 500, 20)
+    assert text and not text.endswith(" ") and len(text) <= 60
+    assert pack_context("", 100) == ("", 0) and pack_context(LAW, 0) == ("", 0)
+
+
+def test_context_budget_leaves_room_for_output_and_prompt(monkeypatch):
+    assert get_window("groq", "llama-3.3-70b-versatile") == 12_000
+    assert get_window("ollama", "desconocido") == 8_192
+    assert get_window("otro", None) == budget.FALLBACK_WINDOW
+    assert context_budget("groq", "llama-3.3-70b-versatile", 4000, 1000) == int(7000 * (1 - budget.SAFETY_MARGIN))
+    assert context_budget("groq", "llama-3.3-70b-versatile", 20_000) == 0
+    monkeypatch.setattr(budget, "CONTEXT_TOKEN_CAP", 500)
+    assert context_budget("gemini", "gemini-2.5-flash", 4000) == 500
+
+
+def test_estimate_cost_uses_model_then_engine_prices():
+    assert estimate_cost("groq", "llama-3.1-8b-instant", 1_000_000, 1_000_000) == 0.05 + 0.08
+    assert estimate_cost("gemini", "nuevo", 1_000_000, 0) == budget.ENGINE_DEFAULT_PRICES["gemini"][0]
+    assert estimate_cost("ollama", "qwen2.5:7b", 10**6, 10**6) == 0.0
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+import engines
+import main
+from engines import EngineProvider
+from jobs import INTERRUPTED, cancel_if_abandoned, job_store, run_job
+from metrics import CANCELLED
+from scheduler import EngineSlot, Scheduler
+from tracing import Trace
+
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+@pytest.fixture
+def hanging_engine(monkeypatch):
+    """Motor registrado cuya llamada no termina nunca; anota si se cancelo."""
+    monkeypatch.setattr(main, "DISCONNECT_POLL_SECONDS", 0.01)
+
+    def register(name):
+        class HangingEngine(EngineProvider):
+            display_name = "Colgado"
+            cancelled = []
+
+            async def complete(self, prompt, model, attempt):
+                try:
+                    await asyncio.Event().wait()
+                except asyncio.CancelledError:
+                    HangingEngine.cancelled.append(attempt)
+                    raise
+
+        HangingEngine.name = name
+        monkeypatch.setitem(engines.ENGINES, name, HangingEngine)
+        return HangingEngine
+    return register
+
+
+async def start(engine_name, scheduler):
+    slot = EngineSlot("cliente", "interactive", mode="manual", scheduler=scheduler)
+    return await main.prepare_exam(Trace("test"), "cliente", file=None, num_questions=2, topic="Plazos",
+                                   difficulty="Intermedio", context=None, directory_path=None, mode="manual",
+                                   ai_engine=engine_name, ollama_model=None, condense="off", slot=slot)
+
+
+def test_disconnect_mid_stream_cancels_the_upstream_call(hanging_engine):
+    engine = hanging_engine("fake-disconnect")
+
+    async def scenario():
+        scheduler = Scheduler(limits={engine.name: 1})
+        request, disconnects = FakeRequest(), []
+        events = main.until_disconnected(request, await start(engine.name, scheduler), lambda: disconnects.append(1))
+        async for item in events:
+            if isinstance(item, dict) and item["msg"].startswith("[LOG] Intento 1"):
+                assert scheduler.queue(engine.name).active == 1
+                # El cliente cierra la pestana mientras el motor esta generando
+                request.disconnected = True
+        assert disconnects == [1] and engine.cancelled == [0]
+        assert scheduler.queue(engine.name).active == 0
+
+    asyncio.run(scenario())
+    assert CANCELLED.value(engine=engine.name, mode="manual", stage="upstream") == 1
+
+
+def test_abandoned_job_cancels_the_upstream_call(hanging_engine):
+    engine = hanging_engine("fake-abandon")
+
+    async def scenario():
+        scheduler = Scheduler(limits={engine.name: 1})
+        job_store.create("job-abandonado", {})
+        task = asyncio.create_task(run_job("job-abandonado", await start(engine.name, scheduler)))
+        await asyncio.sleep(0.05)
+        assert scheduler.queue(engine.name).active == 1
+        # Nadie lee el trabajo: se cancela tras el margen
+        abandoned = []
+        await cancel_if_abandoned("job-abandonado", task, lambda: abandoned.append(1), grace=0.05)
+        await asyncio.gather(task, return_exceptions=True)
+        assert abandoned == [1] and engine.cancelled == [0]
+        assert scheduler.queue(engine.name).active == 0
+        assert job_store.get("job-abandonado")["status"] == INTERRUPTED
+
+    asyncio.run(scenario())
+    assert CANCELLED.value(engine=engine.name, mode="manual", stage="upstream") == 1
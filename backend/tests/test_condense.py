@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+from condense import cached_document, condense_document, local_fact_sheet, load_fact_sheet
+from coverage import Document
+from engines import EngineProvider
+
+LAW = """Articulo 21. Obligacion de resolver.
+La Administracion esta obligada a dictar resolucion expresa. El plazo maximo sera de tres meses.
+
+Articulo 24. Silencio administrativo.
+Esta ley tiene una larga tradicion. En los procedimientos iniciados a solicitud del interesado el silencio tendra efecto estimatorio, salvo excepciones."""
+
+
+class FakeEngine(EngineProvider):
+    name = "fake"
+    display_name = "Fake"
+    max_retries = 2
+
+    def __init__(self, replies):
+        super().__init__()
+        self.replies = list(replies)
+        self.prompts = []
+
+    async def complete(self, prompt, model, attempt):
+        self.prompts.append(prompt)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def retry_delay(self, attempt, error):
+        return 0, ""
+
+
+def condense(doc, mode, engine=None):
+    async def run():
+        result = {}
+        logs = [item["msg"] async for item in condense_document(doc, mode, engine, result)]
+        return result["document"], logs
+    return asyncio.run(run())
+
+
+def test_local_sheet_keeps_headers_and_sentences_with_data():
+    sheet = local_fact_sheet(LAW)
+    lines = sheet.splitlines()
+    assert lines[0] == "Articulo 21. Obligacion de resolver."
+    assert "- El plazo maximo sera de tres meses." in lines
+    assert "Articulo 24. Silencio administrativo." in lines
+    assert any("salvo excepciones" in line for line in lines)
+    # Prosa sin datos examinables
+    assert "tradicion" not in sheet
+
+
+def test_off_returns_the_original_document():
+    doc = Document(LAW, "tema1")
+    assert condense(doc, "off") == (doc, [])
+
+
+def test_local_sheet_is_cached_by_document_hash():
+    doc = Document(LAW + "\nlocal", "tema1")
+    sheet, logs = condense(doc, "local")
+    assert sheet.text == local_fact_sheet(doc.text) and sheet.name == "tema1"
+    assert "ficha heuristica" in logs[0]
+    assert load_fact_sheet(doc.id, "local")["text"] == sheet.text
+    cached, logs = condense(doc, "local")
+    assert cached.text == sheet.text and "ficha cacheada" in logs[0]
+
+
+def test_engine_sheet_is_built_once_and_reused_by_local_mode():
+    doc = Document(LAW + "\nengine", "tema2")
+    engine = FakeEngine([json.dumps(["Art. 21: plazo maximo de 3 meses.", "Art. 24: silencio estimatorio."])])
+    sheet, logs = condense(doc, "engine", engine)
+    assert sheet.text == "- Art. 21: plazo maximo de 3 meses.\n- Art. 24: silencio estimatorio."
+    assert len(engine.prompts) == 1 and "FICHA DE HECHOS" in engine.prompts[0]
+    assert "Cacheada" in logs[-1]
+    # La ficha del motor tambien sirve cuando se pide la local
+    assert cached_document(doc, "local").text == sheet.text
+    again, _ = condense(doc, "engine", FakeEngine([]))
+    assert again.text == sheet.text
+
+
+def test_engine_failures_fall_back_to_the_local_sheet():
+    doc = Document(LAW + "\nfallo", "tema3")
+    engine = FakeEngine([ConnectionError("caido"), "no es json"])
+    sheet, logs = condense(doc, "engine", engine)
+    assert len(engine.prompts) == 2
+    # El bloque sin resumen conserva su extraccion heuristica
+    assert "El plazo maximo sera de tres meses." in sheet.text and "tradicion" not in sheet.text
+    assert any("ConnectionError" in msg for msg in logs)
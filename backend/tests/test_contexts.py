@@ -0,0 +1,63 @@
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import contexts
+import main
+from contexts import ContextStore, context_event, preview, valid_context_id
+
+
+@pytest.fixture
+def store():
+    return ContextStore()
+
+
+def test_put_is_content_addressed(store):
+    doc = store.put("Articulo 1. Texto del tema uno.", "tema1.pdf")
+    assert valid_context_id(doc.id)
+    # El mismo texto no se vuelve a escribir y devuelve el Document ya troceado
+    assert store.put("Articulo 1. Texto del tema uno.", "otro.pdf") is doc
+    record = store.load(doc.id)
+    assert record["name"] == "tema1.pdf" and record["text"] == doc.text and record["chars"] == len(doc.text)
+
+
+def test_get_reloads_from_disk_after_eviction(store, monkeypatch):
+    monkeypatch.setattr(contexts, "CONTEXT_CACHE_SIZE", 1)
+    first = store.put("Primer documento.", "uno")
+    store.put("Segundo documento.", "dos")
+    again = store.get(first.id)
+    assert again is not first and again.text == "Primer documento." and again.name == "uno"
+    assert store.get("0" * 64) is None
+    # Ids que no son un sha256 no llegan al disco (p.ej. "../../etc/passwd")
+    assert store.get("../secreto") is None and store.load("../secreto") is None and not store.exists("../secreto")
+
+
+def test_unused_contexts_expire(store, monkeypatch):
+    doc = store.put("Documento viejo.", "viejo")
+    fresh = store.put("Documento reciente.", "reciente")
+    old = time.time() - 3600
+    os.utime(store._path(doc.id), (old, old))
+    monkeypatch.setattr(contexts, "CONTEXT_TTL_SECONDS", 60)
+    store.cleanup()
+    assert not store.exists(doc.id) and store.exists(fresh.id)
+
+
+def test_context_event_carries_a_preview_not_the_text():
+    text = "palabra " * 200
+    event = context_event(ContextStore().put(text, "largo"))
+    assert set(event) == {"type", "id", "name", "chars", "preview"}
+    assert event["chars"] == len(text) and event["preview"].endswith("…")
+    assert len(event["preview"]) <= contexts.PREVIEW_CHARS + 1
+    assert preview("  corto \n texto ") == "corto texto"
+
+
+def test_context_endpoint_uses_the_id_as_etag():
+    doc = contexts.context_store.put("Contexto servido por HTTP.", "http")
+    with TestClient(main.app) as client:
+        response = client.get(f"/contexts/{doc.id}")
+        assert response.status_code == 200 and response.json()["text"] == "Contexto servido por HTTP."
+        assert response.headers["etag"] == f'"{doc.id}"'
+        assert client.get(f"/contexts/{doc.id}", headers={"If-None-Match": f'"{doc.id}"'}).status_code == 304
+        assert client.get(f"/contexts/{'f' * 64}").status_code == 404
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+import coverage
+from coverage import CoverageStore, Document
+from storage import data_path
+
+TOPICS = ["volcanes y lava", "rios y afluentes", "montañas y cordilleras", "desiertos y dunas"]
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # Un chunk por parrafo
+    monkeypatch.setattr(coverage, "CHUNK_TOKENS", 1)
+
+
+def document():
+    return Document("\n\n".join(f"Tema de {topic}: " + " ".join([topic] * 20) + "." for topic in TOPICS), "geografia")
+
+
+def question(topic):
+    return {"question": f"¿Que sabes de {topic}?", "options": [topic, "otra"], "correct_index": 0,
+            "explanation": f"Sobre {topic}."}
+
+
+def test_questions_mark_their_chunks_covered(small_chunks):
+    store = CoverageStore("test_coverage_mark.json", save_delay=60)
+    doc = document()
+    assert len(doc.chunks) == 4
+    assert store.record([doc], [question(TOPICS[1]), question(TOPICS[3])]) == {doc.id: 50.0}
+    assert store.summary() == [{"doc_id": doc.id, "name": "geografia", "chunks": 4, "covered": 2, "percent": 50.0}]
+
+
+def test_selector_prefers_uncovered_chunks(small_chunks):
+    store = CoverageStore("test_coverage_select.json", save_delay=60)
+    doc = document()
+    budget = doc.costs[2] + doc.costs[3]
+    store.record([doc], [question(TOPICS[0]), question(TOPICS[1])])
+    text, used = store.select(doc, budget)
+    assert TOPICS[2] in text and TOPICS[3] in text and TOPICS[0] not in text
+    assert used <= budget
+    # Todo el documento cabe: se devuelve entero
+    assert store.select(doc, sum(doc.costs)) == (" ".join(doc.chunks), sum(doc.costs))
+
+
+def test_full_coverage_starts_a_new_round(small_chunks):
+    store = CoverageStore("test_coverage_round.json", save_delay=60)
+    doc = document()
+    assert store.record([doc], [question(topic) for topic in TOPICS]) == {doc.id: 100.0}
+    text, _ = store.select(doc, doc.costs[0])
+    assert TOPICS[0] in text
+    assert store.record([doc], [question(TOPICS[2])]) == {doc.id: 25.0}
+
+
+def test_record_saves_in_the_background(small_chunks):
+    store = CoverageStore("test_coverage_save.json", save_delay=60)
+    doc = document()
+    store.record([doc], [question(TOPICS[0])])
+    # record() no toca el disco (corre en el bucle de eventos)
+    assert not os.path.exists(data_path("test_coverage_save.json"))
+    store.flush()
+    with open(data_path("test_coverage_save.json"), encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved[doc.id]["bitmap"] == "1" and saved[doc.id]["chunks"] == 4
+    assert CoverageStore("test_coverage_save.json", save_delay=60).summary()[0]["covered"] == 1
+
+
+def test_nothing_to_record():
+    store = CoverageStore("test_coverage_empty.json", save_delay=60)
+    assert store.record([], [question(TOPICS[0])]) == {}
+    assert store.record([Document("")], [question(TOPICS[0])]) == {}
+    store.flush()
+    assert not os.path.exists(data_path("test_coverage_empty.json"))
@@ -0,0 +1,81 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from dedup import RecentQuestions, find_duplicates, question_text, vectorize
+from questions import Question
+from storage import data_path
+
+
+def q(stem, answer="Madrid", options=None):
+    options = options or ["Paris", answer, "Roma", "Lisboa"]
+    return {"question": stem, "options": options, "correct_index": options.index(answer)}
+
+
+def test_near_identical_questions_in_a_batch_are_dropped():
+    questions = [
+        q("¿Cual es la capital de España?"),
+        q("¿Cuál es la capital de españa? "),
+        q("¿Que organo aprueba los Presupuestos Generales del Estado?", "Las Cortes",
+          ["El Gobierno", "Las Cortes", "El Senado", "El Rey"]),
+    ]
+    keep, dropped = find_duplicates(questions)
+    assert keep == [0, 2] and dropped == [1]
+
+
+def test_same_stem_with_another_answer_is_not_a_duplicate():
+    options = ["Paris", "Madrid", "Roma", "Lisboa"]
+    first = q("¿Cual es la capital de España?", "Madrid", options)
+    second = q("¿Cual es la capital de España?", "Roma", options)
+    assert find_duplicates([first, second], threshold=0.95) == ([0, 1], [])
+
+
+def test_history_vectors_drop_repeats_from_earlier_exams():
+    seen = vectorize([question_text(q("¿Cual es la capital de España?"))])
+    keep, dropped = find_duplicates([q("¿Cual es la capital de España?"), q("¿Cuantos son los colores del arcoiris?", "7",
+                                                                             ["5", "6", "7", "8"])], seen)
+    assert keep == [1] and dropped == [0]
+    # Historial vacio: solo cuenta el propio lote
+    assert find_duplicates([q("¿Capital?")], np.zeros((0, 1))) == ([0], [])
+    assert find_duplicates([]) == ([], [])
+
+
+def test_question_text_accepts_dicts_models_and_strings():
+    question = Question.from_raw(q("¿Cual es la capital de España?"))
+    assert question_text(question) == question_text(q("¿Cual es la capital de España?")) == "¿Cual es la capital de España? Madrid"
+    assert question_text("texto") == "texto"
+
+
+def test_history_is_saved_in_the_background():
+    history = RecentQuestions("test_history.json", size=3, save_delay=60)
+    path = data_path("test_history.json")
+    history.add("cliente", [q(f"Pregunta {i}") for i in range(2)])
+    history.add("cliente", [q(f"Pregunta {i}") for i in range(2, 4)])
+    # add() no toca el disco (corre en el bucle de eventos)
+    assert not os.path.exists(path)
+    assert len(history.vectors("cliente")) == 3
+
+    history.flush()
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"cliente": [f"Pregunta {i} Madrid" for i in range(1, 4)]}
+    # Otra instancia (p.ej. al reiniciar) lo recarga desde disco
+    assert len(RecentQuestions("test_history.json", save_delay=60).vectors("cliente")) == 3
+
+
+def test_pending_history_is_written_after_the_delay():
+    history = RecentQuestions("test_history_delay.json", save_delay=0.05)
+    history.add("cliente", [q("Pregunta")])
+    deadline = time.monotonic() + 5
+    while not os.path.exists(data_path("test_history_delay.json")) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    with open(data_path("test_history_delay.json"), encoding="utf-8") as f:
+        assert json.load(f) == {"cliente": ["Pregunta Madrid"]}
+
+
+def test_memory_only_history_never_touches_disk():
+    history = RecentQuestions(filename=None)
+    history.add("lote", [q("Pregunta")])
+    history.flush()
+    assert len(history.vectors("lote")) == 1
@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+import pytest
+
+from engines import EngineProvider, _request_questions, generate_exam_streaming
+from metrics import CANCELLED, CANCELLED_ATTEMPTS_SAVED, PARSE_FAILURES, RETRIES
+from pipeline import ParseError, parse_questions
+from tracing import Trace
+
+QUESTIONS = [{"question": f"¿Pregunta {i} sobre plazos administrativos?",
+              "options": ["A) uno", "B) dos", "C) tres", "D) cuatro"], "correct_index": 1,
+              "explanation": "La respuesta correcta es B."} for i in range(2)]
+VALID = json.dumps(QUESTIONS)
+
+
+class ScriptedProvider(EngineProvider):
+    """Responde (o falla) con el guion dado, un elemento por intento."""
+
+    display_name = "Guion"
+
+    def __init__(self, name, script, delay=0):
+        super().__init__()
+        self.name = name
+        self.script = list(script)
+        self.delay = delay
+        self.calls = 0
+
+    async def complete(self, prompt, model, attempt):
+        self.calls += 1
+        step = self.script.pop(0)
+        if isinstance(step, asyncio.Event):
+            await step.wait()
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+    def retry_delay(self, attempt, error):
+        return self.delay, f"[DEBUG] Reintento en {self.delay}s"
+
+
+async def collect(source):
+    return [item async for item in source]
+
+
+def request(engine, result):
+    return _request_questions(engine, 2, "Intermedio", None, "Plazos", "manual", result, trace=Trace("test"))
+
+
+def messages(logs):
+    return [item["msg"] for item in logs]
+
+
+def test_malformed_json_is_retried():
+    engine = ScriptedProvider("fake-malformed", ["Lo siento, no puedo", VALID])
+    labels = {"engine": engine.name, "model": "", "key": "Guion", "mode": "manual"}
+    result = {}
+    logs = asyncio.run(collect(request(engine, result)))
+    assert engine.calls == 2 and result["attempt"] == 1
+    assert [q["question"] for q in result["questions"]] == [q["question"] for q in QUESTIONS]
+    assert result["attempts"] == 2
+    assert PARSE_FAILURES.value(outcome="failed", **labels) == 1
+    assert RETRIES.value(**labels) == 1
+    assert any("JSON irrecuperable" in msg for msg in messages(logs))
+    assert messages(logs)[-1] == "[Guion] JSON OK: 2 preguntas."
+
+
+def test_fenced_json_is_repaired_without_retrying():
+    engine = ScriptedProvider("fake-fenced", [f"Aqui tienes:\n```json\n{VALID}\n```"])
+    result = {}
+    logs = asyncio.run(collect(request(engine, result)))
+    assert engine.calls == 1 and len(result["questions"]) == 2
+    assert PARSE_FAILURES.value(outcome="repaired", engine=engine.name, model="", key="Guion", mode="manual") == 1
+    assert "JSON limpiado: 2 preguntas" in messages(logs)[-1]
+
+
+def test_all_attempts_failing_yields_no_questions():
+    engine = ScriptedProvider("fake-failing", ["[]", ConnectionError("sin red"), "{roto"])
+    logs = asyncio.run(collect(generate_exam_streaming(engine, 2, topic="Plazos", trace=Trace("test"))))
+    assert engine.calls == engine.max_retries == 3
+    msgs = messages(logs)
+    assert any("JSON structure is empty" in msg for msg in msgs)
+    assert "[ERROR] ConnectionError: sin red" in msgs
+    assert "[ERROR] No se generaron preguntas tras todos los intentos." in msgs
+    # Nada de preguntas: el ultimo evento es el consumo, no una lista
+    assert not any(isinstance(item, list) for item in logs)
+    assert msgs[-1].startswith("[CONSUMO]") and "en 3 intentos" in msgs[-1]
+
+
+@pytest.mark.parametrize("stage", ["upstream", "retry_sleep"])
+def test_cancellation_is_reraised_and_counted(stage):
+    engine_name = f"fake-cancel-{stage}"
+
+    async def scenario():
+        hang = asyncio.Event()
+        script = [hang] if stage == "upstream" else [ConnectionError("caido"), VALID]
+        engine = ScriptedProvider(engine_name, script, delay=60)
+        result = {}
+        task = asyncio.create_task(collect(request(engine, result)))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert engine.calls == 1 and result["questions"] == []
+
+    asyncio.run(scenario())
+    assert CANCELLED.value(engine=engine_name, mode="manual", stage=stage) == 1
+    # Cancelado durante el primer intento o la espera que le sigue: se ahorran el 2 y el 3
+    assert CANCELLED_ATTEMPTS_SAVED.value(engine=engine_name, mode="manual") == 2
+
+
+def test_parse_questions_shapes():
+    assert parse_questions(VALID) == (QUESTIONS, False)
+    # Una pregunta suelta como objeto
+    assert parse_questions(json.dumps(QUESTIONS[0])) == ([QUESTIONS[0]], False)
+    assert parse_questions("\ufeff" + VALID + "\nEspero que te sirva.") == (QUESTIONS, True)
+    for raw in ("[]", '"texto"', "", None):
+        with pytest.raises(ParseError):
+            parse_questions(raw)
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from engines import ENGINE_MODULES
+
+
+@pytest.fixture
+def warmup(monkeypatch):
+    """Arranque con ENGINE_WARMUP=`spec` cuya carga espera a `gate`."""
+    gate = threading.Event()
+    load_engine = main.load_engine
+
+    def slow_load(name):
+        gate.wait(5)
+        if name == "ollama":
+            raise ImportError("sin modulo")
+        return load_engine(name)
+
+    def configure(spec):
+        monkeypatch.setattr(main, "ENGINE_WARMUP", spec)
+        monkeypatch.setattr(main, "warmup_done", main.asyncio.Event())
+        monkeypatch.setattr(main, "load_engine", slow_load)
+        return gate
+    return configure
+
+
+def wait_ready(client, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get("/ready")
+        if response.status_code == 200:
+            return response.json()
+        time.sleep(0.02)
+    raise AssertionError("/ready no llego a 200")
+
+
+def test_ready_waits_for_the_warmup_engines(warmup):
+    gate = warmup("groq")
+    with TestClient(main.app) as client:
+        response = client.get("/ready")
+        assert response.status_code == 503 and response.json()["ready"] is False
+        # Liveness no depende de los motores
+        assert client.get("/healthz").status_code == 200
+        assert client.get("/healthz").json() == {"status": "ok"}
+        gate.set()
+        body = wait_ready(client)
+    assert body["ready"] is True and body["warmup"] == ["groq"]
+    assert set(body["engines"]) == set(ENGINE_MODULES)
+    assert body["engines"]["groq"]["loaded"] is True
+    assert body["engines"]["groq"]["import_ms"] is not None
+    assert body["startup_ms"] > 0
+
+
+def test_failed_warmup_does_not_block_readiness(warmup):
+    gate = warmup("ollama,desconocido")
+    gate.set()
+    with TestClient(main.app) as client:
+        body = wait_ready(client)
+        assert client.get("/healthz").status_code == 200
+    # Los nombres desconocidos se ignoran; un motor que falla al cargar no deja /ready en 503
+    assert body["warmup"] == ["ollama"]
+
+
+def test_without_warmup_ready_immediately(warmup):
+    warmup("off")
+    with TestClient(main.app) as client:
+        body = wait_ready(client, timeout=1.0)
+    assert body["warmup"] == []
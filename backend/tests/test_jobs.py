@@ -0,0 +1,198 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from jobs import DONE, INTERRUPTED, JobStore, SharedEngineSlots, job_event_stream, job_store, parse_last_event_id, run_job
+from scheduler import EngineSlot, Scheduler
+
+
+async def collect(source):
+    return [item async for item in source]
+
+
+def stores(name):
+    # Dos conexiones al mismo fichero: como el proceso web y un worker
+    return JobStore(name, interrupt=False), JobStore(name, interrupt=False)
+
+
+def test_engine_slots_are_shared_between_stores():
+    first, second = stores("test_slots.sqlite3")
+    assert first.acquire_engine_slot("ollama", "a", limit=1)
+    assert not second.acquire_engine_slot("ollama", "b", limit=1)
+    # Otro motor tiene sus propios huecos
+    assert second.acquire_engine_slot("groq", "c", limit=1)
+    assert second.engine_slot_counts() == {"ollama": 1, "groq": 1}
+    first.release_engine_slot("a")
+    assert second.acquire_engine_slot("ollama", "b", limit=1)
+
+
+def test_dead_holder_lease_expires():
+    first, second = stores("test_slots_lease.sqlite3")
+    assert first.acquire_engine_slot("ollama", "muerto", limit=1, lease=0.05)
+    assert not second.acquire_engine_slot("ollama", "vivo", limit=1)
+    time.sleep(0.1)
+    assert second.acquire_engine_slot("ollama", "vivo", limit=1)
+    # Renovada, una reserva no caduca
+    second.renew_engine_slots(["vivo"], lease=30)
+    assert not first.acquire_engine_slot("ollama", "otro", limit=1)
+
+
+def test_worker_schedulers_respect_the_global_limit():
+    async def scenario():
+        first, second = stores("test_slots_sched.sqlite3")
+        # Cada "worker" permite 1 en local; el limite comun tambien es 1
+        workers = [Scheduler(limits={"ollama": 1}, shared=SharedEngineSlots(store)) for store in (first, second)]
+        running = EngineSlot("c1", "interactive", scheduler=workers[0])
+        await collect(running.acquire("ollama"))
+
+        waiting = EngineSlot("c2", "interactive", scheduler=workers[1])
+        logs = []
+
+        async def wait_turn():
+            async for item in waiting.acquire("ollama"):
+                logs.append(item["msg"])
+
+        task = asyncio.create_task(wait_turn())
+        await asyncio.sleep(0.2)
+        assert not task.done()
+        assert any("ocupado por otros workers" in msg for msg in logs)
+        assert first.engine_slot_counts() == {"ollama": 1}
+
+        running.release()
+        await asyncio.wait_for(task, 5)
+        assert waiting.ticket.shared_id is not None
+        waiting.release()
+        assert first.engine_slot_counts() == {}
+
+    asyncio.run(scenario())
+
+
+def test_abandoned_shared_wait_keeps_nothing():
+    async def scenario():
+        first, second = stores("test_slots_cancel.sqlite3")
+        assert first.acquire_engine_slot("ollama", "otro", limit=1)
+        scheduler = Scheduler(limits={"ollama": 1}, shared=SharedEngineSlots(second))
+        slot = EngineSlot("c1", "interactive", scheduler=scheduler)
+        task = asyncio.create_task(collect(slot.acquire("ollama")))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert slot.ticket is None and scheduler.queue("ollama").active == 0
+        assert first.engine_slot_counts() == {"ollama": 1}
+
+    asyncio.run(scenario())
+
+
+def test_only_orphaned_inline_jobs_are_interrupted():
+    # Tres procesos web sobre el mismo DATA_DIR (uvicorn --workers 3)
+    alive = JobStore("test_inline_lease.sqlite3", interrupt=False)
+    dead = JobStore("test_inline_lease.sqlite3", interrupt=False, lease=0.2)
+    renewing = JobStore("test_inline_lease.sqlite3", interrupt=False, lease=0.2)
+    alive.create("job-vivo", {})
+    dead.create("job-huerfano", {})
+    renewing.create("job-renovado", {})
+    time.sleep(0.15)
+    renewing.renew_owned()
+    # Un proceso que arranca no cierra lo que otros siguen ejecutando
+    assert JobStore("test_inline_lease.sqlite3", interrupt=False).reap_orphaned() == 0
+    time.sleep(0.1)
+    # "dead" dejo de renovar: su reserva caduca y cualquier otro proceso lo cierra (una sola vez)
+    assert alive.reap_orphaned() == 1 and renewing.reap_orphaned() == 0
+    assert alive.get("job-vivo")["status"] == alive.get("job-renovado")["status"] == "running"
+    assert alive.get("job-huerfano")["status"] == INTERRUPTED
+    assert alive.events_after("job-huerfano", -1)[-1] == (1, "[DONE]")
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id("4e1d0294f6e45b43-7") == 7
+    assert parse_last_event_id("12") == 12
+    assert parse_last_event_id(None) == parse_last_event_id("") == parse_last_event_id("basura") == -1
+
+
+async def exam(gate):
+    yield {"type": "log", "msg": "[LOG] Intento 1"}
+    yield {"type": "log", "msg": "[LOG] Respuesta recibida"}
+    await gate.wait()
+    yield [{"id": 1, "question": "¿2+2?"}]
+    yield "[DONE]"
+
+
+async def read(job_id, last_seq):
+    return [item async for item in job_event_stream(job_id, last_seq, poll=0.05) if item is not None]
+
+
+def test_reconnect_resumes_after_the_last_event_while_running():
+    async def scenario():
+        gate = asyncio.Event()
+        job_store.create("job-resume", {})
+        task = asyncio.create_task(run_job("job-resume", exam(gate)))
+        await asyncio.sleep(0.05)
+        # Primera conexion: recibe dos eventos y se corta (recarga de la pagina)
+        first = job_event_stream("job-resume", -1, poll=0.05)
+        received = [await first.__anext__(), await first.__anext__()]
+        await first.aclose()
+        assert [seq for seq, _ in received] == [0, 1]
+
+        # Reconecta con Last-Event-ID = 1: sigue en vivo sin repetir nada
+        resumed = asyncio.create_task(read("job-resume", 1))
+        await asyncio.sleep(0.1)
+        assert not resumed.done()
+        gate.set()
+        events = await asyncio.wait_for(resumed, 5)
+        await task
+        assert events == [(2, [{"id": 1, "question": "¿2+2?"}]), (3, "[DONE]")]
+        assert job_store.get("job-resume")["status"] == DONE
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_job_closes_its_stream():
+    async def scenario():
+        job_store.create("job-cancel", {})
+        task = asyncio.create_task(run_job("job-cancel", exam(asyncio.Event())))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        events = await read("job-cancel", 1)
+        assert events[-1] == (3, "[DONE]") and "[ERROR]" in events[0][1]["msg"]
+        assert job_store.get("job-cancel")["status"] == INTERRUPTED
+
+    asyncio.run(scenario())
+
+
+def test_events_endpoint_replays_after_last_event_id():
+    job_store.create("job-http", {})
+    for seq, payload in enumerate([{"type": "log", "msg": "uno"}, {"type": "log", "msg": "dos"}, [], "[DONE]"]):
+        job_store.append("job-http", seq, payload)
+    job_store.finish("job-http", DONE, [])
+    with TestClient(main.app) as client:
+        body = client.get("/jobs/job-http/events", headers={"Last-Event-ID": "job-http-1"}).text
+        assert "id: job-http-1" not in body and "uno" not in body and "dos" not in body
+        assert "id: job-http-2\ndata: []" in body and "id: job-http-3\ndata: [DONE]" in body
+        # Tambien por query (EventSource no deja poner cabeceras al reconectar a mano)
+        body = client.get("/jobs/job-http/events?last_event_id=0").text
+        assert "uno" not in body and "dos" in body
+        assert client.get("/jobs/no-existe/events").status_code == 404
+
+
+def test_repeated_traceparent_gets_distinct_jobs(monkeypatch):
+    async def exam_stream(trace, client_host, form, prefetch):
+        async def stream():
+            yield [{"id": 1, "question": "¿2+2?"}]
+            yield "[DONE]"
+        return stream()
+    monkeypatch.setattr(main, "exam_stream", exam_stream)
+    trace_id = "0123456789abcdef0123456789abcdef"
+    headers = {"traceparent": f"00-{trace_id}-0123456789abcdef-01"}
+    with TestClient(main.app) as client:
+        responses = [client.post("/jobs", data={"ai_engine": "ollama", "topic": "Sumas"}, headers=headers) for _ in range(2)]
+        assert [r.status_code for r in responses] == [200, 200]
+        ids = [r.json()["job_id"] for r in responses]
+        # El id lo genera el servidor; la traza del cliente sigue en X-Trace-Id
+        assert ids[0] != ids[1] and trace_id not in ids
+        assert all(r.headers["X-Trace-Id"] == trace_id for r in responses)
+        events = client.get(f"/jobs/{ids[1]}/events")
+        assert events.headers["X-Trace-Id"] == trace_id and f"id: {trace_id}-0" in events.text
+        assert client.get(f"/jobs/{ids[0]}").json()["trace_id"] == trace_id
@@ -0,0 +1,59 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from logs import DroppingQueueHandler, JsonFormatter, StructLogger
+
+
+@pytest.fixture
+def small_queue():
+    log_queue = queue.Queue(2)
+    handler = DroppingQueueHandler(log_queue)
+    logger = logging.getLogger("simulador.test_logs")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    yield log_queue, handler, StructLogger(logger)
+    logger.removeHandler(handler)
+
+
+def drain(log_queue):
+    records = []
+    while not log_queue.empty():
+        records.append(log_queue.get_nowait())
+    return records
+
+
+def test_json_line_format(small_queue):
+    log_queue, _, log = small_queue
+    log.bind(engine="groq").info("Respuesta %s", model="llama", questions=3)
+    try:
+        raise ValueError("JSON roto")
+    except ValueError:
+        log.exception("Intento fallido")
+    lines = [json.loads(JsonFormatter().format(record)) for record in drain(log_queue)]
+    first, second = lines
+    assert set(first) == {"ts", "level", "logger", "msg", "engine", "model", "questions"}
+    assert (first["level"], first["logger"], first["msg"]) == ("info", "simulador.test_logs", "Respuesta %s")
+    assert (first["engine"], first["model"], first["questions"]) == ("groq", "llama", 3)
+    assert second["level"] == "error" and "ValueError: JSON roto" in second["exc"]
+    # ASCII escapado: una consola cp1252 lo escribe sin fallar
+    record = logging.LogRecord("simulador.x", logging.INFO, __file__, 1, "Año ✓", None, None)
+    assert JsonFormatter().format(record).isascii()
+
+
+def test_full_queue_drops_and_counts(small_queue):
+    log_queue, handler, log = small_queue
+    for i in range(5):
+        log.info(f"evento {i}")
+    # Nunca bloquea: caben 2, los otros 3 se descartan y se cuentan
+    assert log_queue.qsize() == 2 and handler.dropped == 3
+    assert [r.msg for r in drain(log_queue)] == ["evento 0", "evento 1"]
+    # El siguiente registro que entra avisa de cuantos se perdieron
+    log.warning("de vuelta")
+    record, = drain(log_queue)
+    assert record.fields == {"dropped_before": 3} and handler.dropped == 0
+    log.info("normal")
+    assert drain(log_queue)[0].fields == {}
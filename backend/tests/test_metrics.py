@@ -0,0 +1,56 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import metrics
+from metrics import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, render_latest
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # Metricas de prueba fuera del registro global (/metrics no las ve despues)
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+    return metrics.REGISTRY
+
+
+def test_counter_and_gauge_exposition(registry):
+    requests = Counter("test_requests_total", "Peticiones\\n de prueba\ncon salto.", ("engine", "mode"))
+    requests.inc(engine="groq", mode="manual")
+    requests.inc(2, engine='ol"la\\ma\n', mode="random_1")
+    loaded = Gauge("test_loaded", "Motores cargados.")
+    loaded.set(3)
+    assert render_latest().splitlines() == [
+        "# HELP test_requests_total Peticiones\\\\n de prueba\\ncon salto.",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{engine="groq",mode="manual"} 1',
+        'test_requests_total{engine="ol\\"la\\\\ma\\n",mode="random_1"} 2',
+        "# HELP test_loaded Motores cargados.",
+        "# TYPE test_loaded gauge",
+        "test_loaded 3",
+    ]
+
+
+def test_histogram_exposition(registry):
+    seconds = Histogram("test_seconds", "Duracion.", ("stage",), buckets=(0.1, 1, 10))
+    for value in (0.05, 0.1, 0.5, 20):
+        seconds.observe(value, stage="parse")
+    lines = render_latest().splitlines()
+    assert lines[1] == "# TYPE test_seconds histogram"
+    # Acumulados; el limite es inclusivo (0.1 cae en le="0.1")
+    assert lines[2:] == [
+        'test_seconds_bucket{stage="parse",le="0.1"} 2',
+        'test_seconds_bucket{stage="parse",le="1.0"} 3',
+        'test_seconds_bucket{stage="parse",le="10.0"} 3',
+        'test_seconds_bucket{stage="parse",le="+Inf"} 4',
+        'test_seconds_sum{stage="parse"} 20.65',
+        'test_seconds_count{stage="parse"} 4',
+    ]
+
+
+def test_metrics_endpoint():
+    with TestClient(main.app) as client:
+        response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == CONTENT_TYPE_LATEST
+    assert "# TYPE simulador_stage_seconds histogram" in response.text
+    assert response.text.endswith("\n")
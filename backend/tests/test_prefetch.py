@@ -0,0 +1,193 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import prefetch
+from dedup import PendingQuestions, RecentQuestions
+from prefetch import PrefetchStore, watch_delivery
+from scheduler import EngineSlot, Scheduler
+
+FORM = {"mode": "random_1", "directory_path": "/temas", "num_questions": 5, "difficulty": "Intermedio",
+        "topic": None, "ai_engine": "groq", "ollama_model": None, "condense": "off", "file": None}
+
+
+def factory(gate=None, error=None, slot=None, finished=None):
+    async def stream():
+        yield {"type": "log", "msg": "[LOG] generando"}
+        if gate:
+            await gate.wait()
+        yield [{"id": 1}]
+        yield "[DONE]"
+
+    async def make():
+        if error:
+            raise error
+        return stream(), (finished.append if finished is not None else lambda e: None), slot
+    return make
+
+
+async def collect(source):
+    return [item async for item in source]
+
+
+def test_eligible_only_for_folder_modes(monkeypatch):
+    assert PrefetchStore.eligible(FORM)
+    assert not PrefetchStore.eligible({**FORM, "mode": "manual"})
+    assert not PrefetchStore.eligible({**FORM, "directory_path": None})
+    assert not PrefetchStore.eligible({**FORM, "file": object()})
+    monkeypatch.setattr(prefetch, "PREFETCH_MAX", 0)
+    assert not PrefetchStore.eligible(FORM)
+
+
+def test_claim_replays_a_finished_prefetch():
+    async def scenario():
+        store = PrefetchStore()
+        key = store.key("c1", FORM)
+        finished = []
+        entry = store.start(key, "c1", factory(finished=finished))
+        await entry.task
+        assert finished == [None]
+        # Otros ajustes u otro cliente no se lo llevan
+        assert store.claim(store.key("c1", {**FORM, "num_questions": 10})) is None
+        assert store.claim(store.key("c2", FORM)) is None
+        claimed = store.claim(key)
+        assert claimed is entry and store.claim(key) is None
+        events = await collect(claimed.follow())
+        assert "[PRECARGA]" in events[0]["msg"] and "listo" in events[0]["msg"]
+        assert events[1:] == [{"type": "log", "msg": "[LOG] generando"}, [{"id": 1}], "[DONE]"]
+
+    asyncio.run(scenario())
+
+
+def test_claiming_an_unfinished_prefetch_follows_it_live_and_promotes_only_its_slot():
+    async def scenario():
+        scheduler = Scheduler(limits={"groq": 1})
+        busy = EngineSlot("otro", "interactive", scheduler=scheduler)
+        await collect(busy.acquire("groq"))
+        slot = EngineSlot("c1", "background", scheduler=scheduler)
+        batch = EngineSlot("c1", "background", scheduler=scheduler)
+        waits = [asyncio.create_task(collect(s.acquire("groq"))) for s in (slot, batch)]
+        await asyncio.sleep(0.01)
+
+        store, gate = PrefetchStore(), asyncio.Event()
+        key = store.key("c1", FORM)
+        store.start(key, "c1", factory(gate, slot=slot))
+        await asyncio.sleep(0.01)
+        entry = store.claim(key)
+        entry.promote()
+        assert slot.ticket.priority == "interactive" and batch.ticket.priority == "background"
+
+        reader = asyncio.create_task(collect(entry.follow()))
+        await asyncio.sleep(0.01)
+        assert not reader.done()
+        gate.set()
+        events = await reader
+        assert "en curso" in events[0]["msg"] and events[-1] == "[DONE]"
+
+        for task in waits:
+            task.cancel()
+        await asyncio.gather(*waits, return_exceptions=True)
+        busy.release()
+
+    asyncio.run(scenario())
+
+
+def test_abandoning_a_claimed_prefetch_cancels_it():
+    async def scenario():
+        store, gate = PrefetchStore(), asyncio.Event()
+        key = store.key("c1", FORM)
+        entry = store.start(key, "c1", factory(gate))
+        await asyncio.sleep(0.01)
+        follower = store.claim(key).follow()
+        await follower.__anext__()
+        await follower.aclose()
+        await asyncio.gather(entry.task, return_exceptions=True)
+        assert entry.task.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_one_prefetch_per_client_and_ttl(monkeypatch):
+    monkeypatch.setattr(prefetch, "PREFETCH_TTL_SECONDS", 0.05)
+
+    async def scenario():
+        store, gate = PrefetchStore(), asyncio.Event()
+        first = store.start(store.key("c1", FORM), "c1", factory(gate))
+        second = store.start(store.key("c1", {**FORM, "mode": "simulacro_3"}), "c1", factory(gate))
+        await asyncio.sleep(0.01)
+        # La mas antigua del cliente se descarta
+        assert first.task.cancelled() and list(store.entries.values()) == [second]
+        await asyncio.sleep(0.1)
+        assert store.entries == {} and second.task.cancelled()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("error", [HTTPException(status_code=503, detail="Cola llena"), RuntimeError("fallo")])
+def test_failed_prefetch_is_not_offered(error):
+    async def scenario():
+        store = PrefetchStore()
+        key = store.key("c1", FORM)
+        entry = store.start(key, "c1", factory(error=error))
+        await entry.task
+        assert entry.finished and store.claim(key) is None
+
+    asyncio.run(scenario())
+
+
+def test_watch_delivery_fires_only_when_questions_were_sent():
+    async def scenario():
+        delivered = []
+
+        async def events(*items):
+            for item in items:
+                yield item
+
+        await collect(watch_delivery(events({"type": "log"}, [{"id": 1}], "[DONE]"), lambda: delivered.append(1)))
+        await collect(watch_delivery(events({"type": "log"}, "[DONE]"), lambda: delivered.append(2)))
+        assert delivered == [1]
+
+    asyncio.run(scenario())
+
+
+QUESTION = {"question": "¿Que es un volcan?", "options": ["A", "B"], "correct_index": 0}
+
+
+def history_factory(history, client="c1"):
+    # Como generate_exam_streaming: deduplica contra el historial y anade lo generado
+    async def stream():
+        history.vectors(client)
+        history.add(client, [QUESTION])
+        yield [QUESTION]
+        yield "[DONE]"
+
+    async def make():
+        return stream(), lambda e: None, None
+    return make
+
+
+
+def test_prefetch_history_is_recorded_only_on_delivery(monkeypatch):
+    monkeypatch.setattr(prefetch, "PREFETCH_TTL_SECONDS", 0.05)
+
+    async def scenario():
+        recent = RecentQuestions(filename=None)
+        store = PrefetchStore()
+        # Caduca sin que nadie la reclame: el historial no cambia
+        expired = PendingQuestions(recent)
+        entry = store.start(store.key("c1", FORM), "c1", history_factory(expired), history=expired)
+        await entry.task
+        await asyncio.sleep(0.1)
+        assert store.entries == {} and len(recent.vectors("c1")) == 0
+
+        # Reclamada y entregada: sus preguntas pasan al historial del cliente
+        pending = PendingQuestions(recent)
+        key = store.key("c1", FORM)
+        store.start(key, "c1", history_factory(pending), history=pending)
+        await store.entries[key].task
+        entry = store.claim(key)
+        await collect(watch_delivery(entry.follow(), entry.delivered))
+        assert len(recent.vectors("c1")) == 1
+
+    asyncio.run(scenario())
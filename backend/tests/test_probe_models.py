@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+from probe_models import MIN_VALIDITY, rank_models  # noqa: E402
+
+FAST = ["--latency", "0", "--jitter", "0", "--tokens-per-sec", "100000"]
+
+
+def probe(output, *args):
+    # Proceso aparte: los motores leen URLs y claves del entorno al importarse
+    completed = subprocess.run(
+        [sys.executable, os.path.join("benchmarks", "probe_models.py"), "--fake", "--output", str(output), *FAST, *args],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    return completed.stdout
+
+
+def test_fake_probe_writes_a_ranking(tmp_path):
+    output = tmp_path / "ranking.json"
+    # Lo ya sondeado de otros motores se conserva
+    output.write_text(json.dumps({"engines": {"gemini": {"chain": ["gemini-x"], "models": []}}}), encoding="utf-8")
+    stdout = probe(output, "--engines", "groq,ollama", "--runs", "2", "--malformed", "0.3")
+    ranking = json.loads(output.read_text(encoding="utf-8"))
+
+    assert ranking["probe"] == {"questions": 3, "runs": 2, "fake": True}
+    assert ranking["engines"]["gemini"]["chain"] == ["gemini-x"]
+    groq = ranking["engines"]["groq"]
+    # whisper no genera texto: se excluye antes de sondear
+    assert sorted(m["model"] for m in groq["models"]) == ["llama-3.1-8b-instant", "llama-3.3-70b-versatile"]
+    for name in ("groq", "ollama"):
+        engine = ranking["engines"][name]
+        usable = [m for m in engine["models"] if m["validity"] >= MIN_VALIDITY]
+        assert engine["chain"] == [m["model"] for m in usable]
+        assert [m["expected_seconds"] for m in usable] == sorted(m["expected_seconds"] for m in usable)
+        assert all(m["runs"] == 2 and m["tokens_per_second"] > 0 for m in engine["models"])
+        assert f"[{name}] cadena: {' -> '.join(engine['chain'])}" in stdout
+
+
+def test_list_only_enumerates(tmp_path):
+    output = tmp_path / "ranking.json"
+    stdout = probe(output, "--engines", "ollama", "--list")
+    assert "[ollama] 2 modelos, 2 seleccionados: deepseek-v3.2:cloud, qwen2.5:7b" in stdout
+    assert not output.exists()
+
+
+def test_rank_models_puts_unreliable_models_last():
+    def entry(model, validity, seconds, cost=0.0):
+        return {"model": model, "validity": validity, "expected_seconds": seconds, "cost_usd": cost}
+
+    ranked, chain = rank_models([
+        entry("rapido-pero-roto", 0.25, 1.0),
+        entry("caro", 1.0, 5.0, cost=0.01),
+        entry("barato", 1.0, 5.0, cost=0.001),
+        entry("sin-respuesta", 0.0, None),
+        entry("lento", 0.75, 9.0),
+        entry("mas-lento", 1.0, 12.0),
+    ])
+    assert [e["model"] for e in ranked] == ["barato", "caro", "lento", "mas-lento", "rapido-pero-roto", "sin-respuesta"]
+    assert chain == ["barato", "caro", "lento"]
@@ -0,0 +1,56 @@
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import profiling
+from scheduler import Overloaded
+
+PROFILED = {"X-Profile": "1", "X-Admin-Token": "test-admin-token"}
+UNKNOWN_CONTEXT = {"ai_engine": "ollama", "context_id": "0" * 64}
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def assert_profiler_released():
+    assert not profiling._active_lock.locked()
+    assert not tracemalloc.is_tracing()
+
+
+def test_unknown_context_releases_profiler(client):
+    response = client.post("/generate-exam", data=UNKNOWN_CONTEXT, headers=PROFILED)
+    assert response.status_code == 404
+    assert_profiler_released()
+    # La siguiente peticion perfilada vuelve a conseguir el perfilador
+    response = client.post("/generate-exam", data=UNKNOWN_CONTEXT, headers=PROFILED)
+    assert response.status_code == 404
+    assert_profiler_released()
+
+
+def test_overloaded_queue_releases_profiler(client, monkeypatch):
+    def overloaded(*args):
+        raise Overloaded("Cola llena", retry_after=3)
+    monkeypatch.setattr(main.scheduler, "check_admission", overloaded)
+    response = client.post("/generate-exam", data={"ai_engine": "ollama", "topic": "Plazos"}, headers=PROFILED)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "3"
+    assert_profiler_released()
+
+
+def test_daily_budget_rejection_releases_profiler(client, monkeypatch):
+    monkeypatch.setattr(main, "BUDGET_ACTION", "reject")
+    monkeypatch.setattr(main.usage_ledger, "daily_exceeded", lambda engines: True)
+    response = client.post("/generate-exam", data={"ai_engine": "ollama", "topic": "Plazos"}, headers=PROFILED)
+    assert response.status_code == 429
+    assert_profiler_released()
+
+
+def test_profiling_requires_admin(client):
+    response = client.post("/generate-exam", data=UNKNOWN_CONTEXT, headers={"X-Profile": "1"})
+    assert response.status_code == 403
+    assert_profiler_released()
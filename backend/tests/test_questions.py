@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from questions import Question, from_raw_list, process_batch, rewrite_letter, stated_letter_index
+
+OPTIONS = ["A) Un mes", "B) Tres meses", "C) Seis meses", "D) Un año"]
+
+
+def raw(**fields):
+    return {"question": "¿Plazo maximo para resolver?", "options": list(OPTIONS), "correct_index": 1,
+            "explanation": "La respuesta correcta es B, art. 21.", **fields}
+
+
+@pytest.mark.parametrize("explanation, index", [
+    ("La respuesta correcta es B porque lo dice el art. 21.", 1),
+    ("la respuesta correcta sea la c", 2),
+    ("Correcta: D. El resto son falsos.", 3),
+    ("Correcta: [a]", 0),
+    ("C) Seis meses, segun el art. 24.", 2),
+    ("El plazo es de tres meses.", None),
+    # "respuesta correcta es X" manda sobre "Correcta: Y" aunque vaya despues
+    ("Correcta: A. Revisado: la respuesta correcta es D.", 3),
+    # "correcta es" sin "respuesta" delante no cuenta
+    ("La opcion correcta es A segun unos; Correcta: B", 1),
+])
+def test_stated_letter_index(explanation, index):
+    assert stated_letter_index(explanation) == index
+
+
+def test_from_raw_normalizes_types():
+    q = Question.from_raw(raw(correct_index="2", options=[1, 2, 3], explanation="  Ver art. 21.  "), id=7)
+    assert (q.id, q.options, q.correct_index, q.explanation) == (7, ["1", "2", "3"], 2, "Ver art. 21.")
+    assert Question.from_raw(raw(correct_index=1.0)).correct_index == 1
+    assert Question.from_raw(raw(explanation=None)).explanation == ""
+
+
+@pytest.mark.parametrize("correct_index", [None, 9, -1, True, "b", 1.5])
+def test_from_raw_resets_invalid_correct_index(correct_index):
+    assert Question.from_raw(raw(correct_index=correct_index)).correct_index == 0
+
+
+@pytest.mark.parametrize("item", [
+    "no es un dict", None, raw(question=""), raw(question="   "), raw(question=3),
+    raw(options=[]), raw(options="A) uno"),
+])
+def test_from_raw_rejects_unusable_items(item):
+    assert Question.from_raw(item) is None
+
+
+def test_from_raw_list_numbers_only_usable_items():
+    questions = from_raw_list([raw(), "basura", raw(question="¿Otra?")], first_id=5)
+    assert [(q.id, q.question) for q in questions] == [(5, "¿Plazo maximo para resolver?"), (6, "¿Otra?")]
+
+
+def test_blindaje_trusts_the_explanation():
+    q = Question.from_raw(raw(correct_index=0))
+    assert q.fix_correct_index() and q.correct_index == 1
+    assert not q.fix_correct_index()
+    # Letra fuera de rango: no se toca
+    q = Question.from_raw(raw(options=["A) si", "B) no"], correct_index=0, explanation="Correcta: D"))
+    assert not q.fix_correct_index() and q.correct_index == 0
+
+
+def test_shuffle_moves_the_answer_and_its_letter():
+    for seed in range(20):
+        q = Question.from_raw(raw())
+        q.shuffle(random.Random(seed))
+        assert q.answer == "B) Tres meses"
+        assert stated_letter_index(q.explanation) == q.correct_index
+        assert sorted(q.options) == sorted(OPTIONS)
+
+
+def test_seeded_shuffle_is_stable_per_question():
+    first, _ = process_batch([raw(), raw(question="¿Otra?")], seed="examen")
+    second, _ = process_batch([raw(question="¿Otra?"), raw()], seed="examen")
+    assert first[0].options == second[1].options and first[1].options == second[0].options
+
+
+def test_rewrite_letter_only_touches_citations():
+    text = "La respuesta correcta es A. Solucion: A. La A de Administracion."
+    assert rewrite_letter(text, 0, 2) == "La respuesta correcta es C. Solucion: C. La A de Administracion."
+    # "X)" solo al principio de la explicacion
+    assert rewrite_letter("A) Un mes. Ver A) del art. 21.", 0, 3) == "D) Un mes. Ver A) del art. 21."
+    assert rewrite_letter(text, 0, 0) == text
+
+
+def test_to_json_round_trips():
+    q = Question.from_raw(raw(), id=3)
+    assert Question.from_raw(q.to_json(), id=3).to_json() == q.to_json() == {
+        "id": 3, "question": "¿Plazo maximo para resolver?", "options": OPTIONS, "correct_index": 1,
+        "explanation": "La respuesta correcta es B, art. 21."}
@@ -0,0 +1,86 @@
+import pytest
+
+import auto_client
+import routing
+from engines import EngineProvider
+from routing import Router
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = Router()
+    monkeypatch.setattr(auto_client, "router", router)
+    return router
+
+
+def test_unknown_targets_get_the_prior_and_keep_configured_order(router):
+    assert router.stats("groq", "m").expected_seconds() == routing.ROUTE_PRIOR_SECONDS
+    assert router.rank([("groq", "m"), ("gemini", "m")]) == [("groq", "m"), ("gemini", "m")]
+    assert "sin datos" in router.describe("groq", "m")
+
+
+def test_faster_and_more_reliable_targets_rank_first(router):
+    router.record("gemini", "m", ok=True, seconds=10, tokens=500)   # 50 tok/s
+    router.record("groq", "m", ok=True, seconds=2, tokens=500)      # 250 tok/s
+    assert router.rank([("gemini", "m"), ("groq", "m")]) == [("groq", "m"), ("gemini", "m")]
+    expected = routing.ROUTE_REFERENCE_TOKENS / 250
+    assert router.stats("groq", "m").expected_seconds() == pytest.approx(expected)
+    # Un fallo encarece el destino por su tasa de fallos (EWMA)
+    router.record("groq", "m", ok=False)
+    assert router.stats("groq", "m").failure_rate == pytest.approx(routing.ROUTE_ALPHA)
+    assert router.stats("groq", "m").expected_seconds() == pytest.approx(expected / (1 - routing.ROUTE_ALPHA))
+
+
+def test_consecutive_failures_trip_the_target_until_a_success(router):
+    router.record("groq", "m", ok=True, seconds=1, tokens=500)
+    for _ in range(routing.ROUTE_TRIP_FAILURES):
+        router.record("groq", "m", ok=False)
+    stats = router.stats("groq", "m")
+    assert not stats.healthy() and "CAIDO" in router.describe("groq", "m")
+    # Caido: al final aunque sea el mas rapido
+    assert router.rank([("groq", "m"), ("ollama", "lento")]) == [("ollama", "lento"), ("groq", "m")]
+    stats.down_until = 0.0
+    router.record("groq", "m", ok=True, seconds=1, tokens=500)
+    assert stats.healthy() and stats.consecutive_failures == 0
+
+
+class FakeProvider(EngineProvider):
+    def __init__(self, name, models):
+        super().__init__()
+        self.name = name
+        self.display_name = name
+        self.models = models
+        self.max_retries = len(models)
+
+    def attempt_target(self, attempt):
+        return self.models[attempt], "key"
+
+
+def auto_engine(monkeypatch, providers):
+    monkeypatch.setattr(auto_client, "ROUTE_ENGINES", list(providers))
+    monkeypatch.setattr(auto_client, "get_engine", lambda name, **options: providers[name])
+    return auto_client.AutoEngine(mode="manual")
+
+
+def test_plan_tries_each_engine_leader_before_secondary_models(monkeypatch, router):
+    providers = {"gemini": FakeProvider("gemini", ["g1", "g1", "g2"]), "groq": FakeProvider("groq", ["q1"])}
+    router.record("gemini", "g1", ok=True, seconds=1, tokens=1000)
+    router.record("gemini", "g2", ok=True, seconds=1, tokens=900)
+    router.record("groq", "q1", ok=True, seconds=1, tokens=100)
+    engine = auto_engine(monkeypatch, providers)
+    plan = [(provider.name, provider.attempt_target(attempt)[0]) for provider, attempt in engine.plan]
+    # g2 es mas rapido que q1, pero groq entra antes que el segundo modelo de gemini
+    assert plan == [("gemini", "g1"), ("gemini", "g1"), ("groq", "q1"), ("gemini", "g2")]
+    assert engine.provider(2) is providers["groq"] and engine.max_retries == 4
+    # Al cambiar de destino no se espera
+    assert engine.retry_delay(1, RuntimeError())[0] == 0
+    assert engine.engine_names() == ["gemini", "groq"]
+
+
+def test_plan_is_capped_and_unready_engines_are_skipped(monkeypatch, router):
+    monkeypatch.setattr(auto_client, "ROUTE_MAX_ATTEMPTS", 2)
+    down = FakeProvider("ollama", ["o1"])
+    down.check_ready = lambda: "Ollama no responde"
+    engine = auto_engine(monkeypatch, {"groq": FakeProvider("groq", ["q1", "q2", "q3"]), "ollama": down})
+    assert [provider.name for provider, _ in engine.plan] == ["groq", "groq"]
+    assert auto_engine(monkeypatch, {"ollama": down}).check_ready()
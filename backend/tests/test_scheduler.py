@@ -0,0 +1,278 @@
+import asyncio
+import json
+
+import pytest
+
+from engines import EngineProvider, _request_questions
+from scheduler import EngineSlot, Overloaded, Scheduler
+from tracing import Trace
+
+QUESTIONS = json.dumps([{"question": "¿2+2?", "options": ["A) 3", "B) 4", "C) 5", "D) 6"], "correct_index": 1}])
+
+
+class FakeProvider(EngineProvider):
+    max_retries = 1
+
+    def __init__(self, name, fail=False):
+        super().__init__()
+        self.name = name
+        self.display_name = name.upper()
+        self.fail = fail
+        self.calls = []
+
+    async def complete(self, prompt, model, attempt):
+        self.calls.append(attempt)
+        if self.fail:
+            raise ConnectionError(f"{self.name} caido")
+        return QUESTIONS
+
+    def retry_delay(self, attempt, error):
+        return 0, ""
+
+
+class FakeAuto(EngineProvider):
+    """Como auto_client.AutoEngine: un intento por proveedor, en orden."""
+
+    name = "auto"
+    display_name = "Auto"
+
+    def __init__(self, providers):
+        super().__init__()
+        self.providers = providers
+        self.max_retries = len(providers)
+
+    def provider(self, attempt):
+        return self.providers[attempt]
+
+    async def complete(self, prompt, model, attempt):
+        return await self.providers[attempt].complete(prompt, model, 0)
+
+    def retry_delay(self, attempt, error):
+        return 0, ""
+
+
+async def collect(source):
+    return [item async for item in source]
+
+
+def run(engine, slot, result):
+    return _request_questions(engine, 1, "Intermedio", None, "Sumas", "manual", result,
+                              trace=Trace("test"), slot=slot)
+
+
+def test_auto_fallback_waits_for_the_engine_it_calls():
+    async def scenario():
+        scheduler = Scheduler(limits={"a": 1, "b": 1})
+        primary, backup = FakeProvider("a", fail=True), FakeProvider("b")
+        # Otra peticion ocupa el unico hueco de "b"
+        busy = EngineSlot("otro", "interactive", scheduler=scheduler)
+        await collect(busy.acquire("b"))
+
+        slot = EngineSlot("cliente", "interactive", scheduler=scheduler)
+        await collect(slot.acquire("a"))
+        result = {}
+        task = asyncio.create_task(collect(run(FakeAuto([primary, backup]), slot, result)))
+        await asyncio.sleep(0.05)
+        # Tras fallar "a" suelta su turno y espera en la cola de "b" sin llamarlo
+        assert primary.calls == [0] and backup.calls == []
+        assert scheduler.queue("a").active == 0
+        assert scheduler.queue("b").queued() == 1
+
+        busy.release()
+        logs = await task
+        assert backup.calls == [0] and len(result["questions"]) == 1
+        assert slot.engine == "b" and scheduler.queue("b").active == 1
+        assert any("[COLA] Posicion 1 en B" in item["msg"] for item in logs)
+        slot.release()
+        assert scheduler.queue("b").active == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_backup_queue_skips_the_attempt(monkeypatch):
+    async def scenario():
+        scheduler = Scheduler(limits={"a": 1, "b": 1})
+        primary, backup = FakeProvider("a", fail=True), FakeProvider("b")
+        busy = EngineSlot("otro", "interactive", scheduler=scheduler)
+        await collect(busy.acquire("b"))
+        monkeypatch.setattr(scheduler.queue("b"), "check_admission",
+                            lambda client, priority: (_ for _ in ()).throw(Overloaded("Cola de b llena", 5)))
+
+        slot = EngineSlot("cliente", "interactive", scheduler=scheduler)
+        await collect(slot.acquire("a"))
+        result = {}
+        logs = await collect(run(FakeAuto([primary, backup]), slot, result))
+        assert backup.calls == [] and result["questions"] == []
+        assert any(item["msg"] == "[COLA] Cola de b llena" for item in logs)
+        assert slot.ticket is None and scheduler.queue("a").active == 0
+
+    asyncio.run(scenario())
+
+
+def test_slot_stays_put_for_a_single_engine():
+    async def scenario():
+        scheduler = Scheduler(limits={"a": 1})
+        provider = FakeProvider("a")
+        slot = EngineSlot("cliente", "interactive", scheduler=scheduler)
+        await collect(slot.acquire("a"))
+        ticket = slot.ticket
+        result = {}
+        await collect(run(provider, slot, result))
+        assert slot.ticket is ticket and len(result["questions"]) == 1
+        slot.release()
+        assert scheduler.queue("a").active == 0
+
+    asyncio.run(scenario())
+
+
+def test_abandoned_wait_leaves_the_queue():
+    async def scenario():
+        scheduler = Scheduler(limits={"a": 1})
+        busy = EngineSlot("otro", "interactive", scheduler=scheduler)
+        await collect(busy.acquire("a"))
+        slot = EngineSlot("cliente", "interactive", scheduler=scheduler)
+        task = asyncio.create_task(collect(slot.acquire("a")))
+        await asyncio.sleep(0.05)
+        assert scheduler.queue("a").queued() == 1 and slot.engine == "a"
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.queue("a").queued() == 0 and slot.ticket is None
+
+    asyncio.run(scenario())
+
+
+def test_promote_moves_only_that_ticket():
+    async def scenario():
+        scheduler = Scheduler(limits={"a": 1})
+        busy = EngineSlot("otro", "interactive", scheduler=scheduler)
+        await collect(busy.acquire("a"))
+        # Mismo cliente: dos variantes de un lote y una precarga, todas en segundo plano
+        batch = [EngineSlot("cliente", "background", scheduler=scheduler) for _ in range(2)]
+        prefetch = EngineSlot("cliente", "background", scheduler=scheduler)
+        tasks = [asyncio.create_task(collect(slot.acquire("a"))) for slot in batch + [prefetch]]
+        await asyncio.sleep(0.05)
+
+        assert prefetch.promote()
+        queue = scheduler.queue("a")
+        assert queue.queued("interactive") == 1 and queue.queued("background") == 2
+        assert queue.order()[0] is prefetch.ticket
+        assert all(slot.ticket.priority == "background" for slot in batch)
+        # Ya es "interactive": promoverlo otra vez no hace nada
+        assert not prefetch.promote()
+
+        busy.release()
+        await asyncio.sleep(0.05)
+        assert prefetch.ticket.started is not None
+        assert all(slot.ticket.started is None for slot in batch)
+        prefetch.release()
+        # Las variantes del lote se abandonan mientras esperan
+        for task in tasks[:2]:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert queue.active == 0 and queue.queued() == 0
+
+    asyncio.run(scenario())
+
+
+def test_promoted_slot_requeues_as_interactive():
+    async def scenario():
+        scheduler = Scheduler(limits={"a": 1, "b": 1})
+        slot = EngineSlot("cliente", "background", scheduler=scheduler)
+        await collect(slot.acquire("a"))
+        slot.promote()
+        # El fallback de "auto" a otro motor conserva la prioridad promovida
+        await collect(slot.acquire("b"))
+        assert slot.ticket.priority == "interactive"
+        slot.release()
+
+    asyncio.run(scenario())
+
+
+def test_round_robin_between_clients():
+    async def scenario():
+        scheduler = Scheduler(limits={"a": 1})
+        busy = EngineSlot("otro", "interactive", scheduler=scheduler)
+        await collect(busy.acquire("a"))
+        # "c1" encola 3 examenes antes de que "c2" y "c3" pidan uno cada uno
+        slots = [EngineSlot(client, "interactive", scheduler=scheduler) for client in ("c1", "c1", "c1", "c2", "c3")]
+        tasks = [asyncio.create_task(collect(slot.acquire("a"))) for slot in slots]
+        await asyncio.sleep(0.05)
+        queue = scheduler.queue("a")
+        assert [ticket.client for ticket in queue.order()] == ["c1", "c2", "c3", "c1", "c1"]
+        assert queue.position(slots[3].ticket) == 2
+
+        served = []
+        busy.release()
+        for _ in slots:
+            await asyncio.sleep(0.01)
+            current = next(slot for slot in slots if slot.ticket and slot.ticket.started is not None)
+            served.append(current.client)
+            current.release()
+        await asyncio.gather(*tasks)
+        assert served == ["c1", "c2", "c3", "c1", "c1"]
+
+    asyncio.run(scenario())
+
+
+def test_interactive_goes_before_background():
+    async def scenario():
+        scheduler = Scheduler(limits={"a": 1})
+        busy = EngineSlot("otro", "interactive", scheduler=scheduler)
+        await collect(busy.acquire("a"))
+        background = EngineSlot("lote", "background", scheduler=scheduler)
+        interactive = EngineSlot("usuario", "interactive", scheduler=scheduler)
+        tasks = [asyncio.create_task(collect(slot.acquire("a"))) for slot in (background, interactive)]
+        await asyncio.sleep(0.05)
+        busy.release()
+        await asyncio.sleep(0.01)
+        assert interactive.ticket.started is not None and background.ticket.started is None
+        interactive.release()
+        await asyncio.gather(*tasks)
+        background.release()
+
+    asyncio.run(scenario())
+
+
+def test_admission_sheds_full_queues(monkeypatch):
+    import scheduler as scheduler_module
+    monkeypatch.setattr(scheduler_module, "MAX_QUEUE", 4)
+    monkeypatch.setattr(scheduler_module, "MAX_QUEUED_PER_CLIENT", 2)
+
+    async def scenario():
+        scheduler = Scheduler(limits={"a": 1})
+        # Con hueco libre y nadie esperando siempre se admite
+        scheduler.check_admission("a", "c1", "interactive")
+        busy = EngineSlot("otro", "interactive", scheduler=scheduler)
+        await collect(busy.acquire("a"))
+        waiting = [EngineSlot(client, "interactive", scheduler=scheduler) for client in ("c1", "c1")]
+        tasks = [asyncio.create_task(collect(slot.acquire("a"))) for slot in waiting]
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(Overloaded, match="Ya tienes 2"):
+            scheduler.check_admission("a", "c1", "interactive")
+        # Segundo plano: solo la mitad de la cola
+        with pytest.raises(Overloaded, match="llena") as shed:
+            scheduler.check_admission("a", "c2", "background")
+        assert shed.value.retry_after > 0
+        scheduler.check_admission("a", "c2", "interactive")
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        busy.release()
+        assert scheduler.queue("a").queued() == 0 and scheduler.queue("a").active == 0
+
+    asyncio.run(scenario())
+
+
+def test_eta_counts_rounds_of_the_engine_limit():
+    async def scenario():
+        queue = Scheduler(limits={"a": 2}).queue("a")
+        queue.service_seconds = 10.0
+        assert queue.eta(0) == queue.eta(2) == 0.0
+        queue.active = 2
+        assert queue.eta(1) == queue.eta(2) == 10.0
+        assert queue.eta(3) == 20.0
+
+    asyncio.run(scenario())
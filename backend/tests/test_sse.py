@@ -0,0 +1,75 @@
+import asyncio
+import json
+import zlib
+
+from starlette.requests import Request
+
+import sse
+from sse import HEARTBEAT, _gzip_chunks, format_sse, negotiate_encoding, sse_chunks
+
+
+async def source(items, delay=0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+def chunks(events, **options):
+    async def run():
+        return [chunk async for chunk in sse_chunks(events, "t", **options)]
+    return asyncio.run(run())
+
+
+def request(accept_encoding):
+    return Request({"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+
+def test_format_sse_tags_events_with_trace_and_seq():
+    event = format_sse({"type": "log", "msg": "hola"}, "t", 3)
+    assert event.startswith("id: t-3\ndata: ") and event.endswith("\n\n")
+    assert json.loads(event.split("data: ", 1)[1]) == {"type": "log", "msg": "hola", "trace_id": "t"}
+    assert format_sse("[DONE]", "t", 4) == "id: t-4\ndata: [DONE]\n\n"
+    assert "trace_id" not in format_sse([{"id": 1}], "t", 5)
+
+
+def test_logs_are_coalesced_and_questions_flush_immediately():
+    log = {"type": "log", "msg": "x"}
+    out = chunks(source([(0, log), (1, log), (2, log), (3, [{"id": 1}]), (4, "[DONE]")]), coalesce=10)
+    # Los tres logs y el lote de preguntas salen juntos; [DONE] en su propio write
+    assert len(out) == 2
+    assert out[0].count("id: t-") == 4 and out[1] == "id: t-4\ndata: [DONE]\n\n"
+
+
+def test_coalesce_window_expires_while_the_source_waits():
+    log = {"type": "log", "msg": "x"}
+    out = chunks(source([(0, log), (1, log)], delay=0.1), coalesce=0.02)
+    assert len(out) == 2
+
+
+def test_heartbeat_when_idle():
+    out = chunks(source([(0, "[DONE]")], delay=0.15), heartbeat=0.05)
+    assert out[0] == HEARTBEAT and out[-1] == "id: t-0\ndata: [DONE]\n\n"
+    # Un None de la fuente tambien es un latido
+    assert chunks(source([None, (0, "[DONE]")]))[0] == HEARTBEAT
+
+
+def test_negotiate_encoding(monkeypatch):
+    assert negotiate_encoding(request("gzip, deflate, br")) == "gzip"
+    assert negotiate_encoding(request("br;q=1.0, gzip;q=0.5")) == "gzip"
+    assert negotiate_encoding(request("gzip;q=0")) is None
+    assert negotiate_encoding(request("identity")) is None
+    monkeypatch.setattr(sse, "COMPRESSION", "off")
+    assert negotiate_encoding(request("gzip")) is None
+
+
+def test_gzip_chunks_are_readable_as_they_arrive():
+    async def run():
+        decompressor = zlib.decompressobj(31)
+        seen = []
+        async for data in _gzip_chunks(source(["id: t-0\ndata: uno\n\n", "id: t-1\ndata: dos\n\n"])):
+            seen.append(decompressor.decompress(data).decode())
+        return seen
+    seen = asyncio.run(run())
+    # Cada evento se puede descomprimir sin esperar al siguiente (Z_SYNC_FLUSH)
+    assert seen[:2] == ["id: t-0\ndata: uno\n\n", "id: t-1\ndata: dos\n\n"]
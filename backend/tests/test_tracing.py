@@ -0,0 +1,51 @@
+import json
+import logging.handlers
+import threading
+import time
+
+from storage import data_path
+from tracing import TRACE_FILE, Trace, trace_id_from_header
+
+
+def read_trace(trace_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open(data_path(TRACE_FILE), encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    spans = record["resourceSpans"][0]["scopeSpans"][0]["spans"]
+                    if spans[0]["traceId"] == trace_id:
+                        return spans
+        except FileNotFoundError:
+            pass
+        time.sleep(0.02)
+    raise AssertionError(f"La traza {trace_id} no llego al fichero")
+
+
+def test_trace_is_written_off_the_calling_thread(monkeypatch):
+    writers = []
+    emit = logging.handlers.RotatingFileHandler.emit
+
+    def spy(self, record):
+        writers.append(threading.current_thread())
+        emit(self, record)
+
+    monkeypatch.setattr(logging.handlers.RotatingFileHandler, "emit", spy)
+    trace = Trace("generate-exam", engine="groq", attempt=1, cached=False)
+    with trace.span("parse", questions=3):
+        pass
+    trace.finish(ValueError("JSON invalido"))
+    spans = read_trace(trace.trace_id)
+    assert writers and threading.current_thread() not in writers
+    root, child = spans
+    assert root["name"] == "generate-exam" and child["parentSpanId"] == root["spanId"]
+    assert root["status"] == {"code": 2, "message": "ValueError: JSON invalido"}
+    assert {a["key"]: a["value"] for a in root["attributes"]} == {
+        "engine": {"stringValue": "groq"}, "attempt": {"intValue": "1"}, "cached": {"boolValue": False}}
+
+
+def test_traceparent_reuses_only_valid_ids():
+    assert trace_id_from_header("00-0123456789ABCDEF0123456789abcdef-0123456789abcdef-01") == "0123456789abcdef0123456789abcdef"
+    assert trace_id_from_header("00-1234-5678-01") is None
+    assert trace_id_from_header(None) is None
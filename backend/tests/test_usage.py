@@ -0,0 +1,116 @@
+import multiprocessing
+import threading
+import uuid
+
+import pytest
+
+import usage
+from usage import Usage, UsageLedger, over_request_budget
+
+RECORDS = 200
+
+
+def ledger_file():
+    return f"usage-{uuid.uuid4().hex}.sqlite3"
+
+
+def record_many(filename, count, flush_every=7):
+    """Un "proceso" que anota intentos y vuelca a menudo (mismo fichero que los demas)."""
+    ledger = UsageLedger(filename, flush_interval=0)
+    for i in range(count):
+        ledger.record("groq", "llama", "main", "manual", Usage(10, 5), ok=i % 4 != 0)
+        if i % flush_every == 0:
+            ledger.flush()
+    ledger.flush()
+
+
+def totals(filename):
+    day = UsageLedger(filename, flush_interval=0).snapshot(days=1)["days"][0]
+    return day["totals"]
+
+
+def test_record_does_no_io_until_flush():
+    filename = ledger_file()
+    ledger = UsageLedger(filename, flush_interval=0)
+    ledger.record("gemini", "flash", "main", "manual", Usage(100, 50), ok=True)
+    # Cuenta ya para el presupuesto de este proceso...
+    assert ledger.daily_tokens() == 150
+    # ...pero otro proceso no lo ve hasta el volcado
+    other = UsageLedger(filename, flush_interval=0)
+    assert other.daily_tokens() == 0
+    ledger.flush()
+    other.flush()
+    assert other.daily_tokens() == 150
+
+
+def test_daily_tokens_only_counts_budget_engines():
+    ledger = UsageLedger(ledger_file(), flush_interval=0)
+    ledger.record("ollama", "local", "", "manual", Usage(1000, 1000), ok=True)
+    ledger.record("groq", "llama", "main", "manual", Usage(10, 10), ok=False)
+    ledger.flush()
+    assert ledger.daily_tokens() == 20
+    rows = ledger.snapshot(days=1)["days"][0]["rows"]
+    groq = next(r for r in rows if r["engine"] == "groq")
+    assert groq["failed"] == 1 and groq["wasted_tokens"] == 20
+
+
+def test_concurrent_flushes_from_threads_lose_nothing():
+    filename = ledger_file()
+    threads = [threading.Thread(target=record_many, args=(filename, RECORDS)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = totals(filename)
+    assert result["attempts"] == 4 * RECORDS
+    assert result["prompt_tokens"] == 4 * RECORDS * 10
+    assert result["output_tokens"] == 4 * RECORDS * 5
+    assert result["failed"] == 4 * RECORDS // 4
+
+
+def test_concurrent_flushes_from_processes_lose_nothing():
+    filename = ledger_file()
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=record_many, args=(filename, RECORDS, 3)) for _ in range(3)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join(60)
+        assert p.exitcode == 0
+    result = totals(filename)
+    assert result["attempts"] == 3 * RECORDS
+    assert result["prompt_tokens"] + result["output_tokens"] == 3 * RECORDS * 15
+
+
+class FakeEngine:
+    def __init__(self, budget_model):
+        self.budget_model = budget_model
+        self.downshifted = False
+
+    def downshift(self):
+        if not self.budget_model:
+            return False
+        self.downshifted = True
+        return True
+
+
+@pytest.fixture
+def request_budget(monkeypatch):
+    monkeypatch.setattr(usage, "REQUEST_TOKEN_BUDGET", 1000)
+    monkeypatch.setattr(usage, "BUDGET_ACTION", "downshift")
+
+
+def test_request_budget_downshifts_then_stops(request_budget):
+    engine = FakeEngine("cheap")
+    assert over_request_budget(engine, 999) == (True, None)
+    proceed, msg = over_request_budget(engine, 1000)
+    assert proceed and "modelo barato" in msg and engine.downshifted
+    # Tras bajar de modelo el tope es DOWNSHIFT_REQUEST_FACTOR veces el presupuesto
+    assert over_request_budget(engine, 1999) == (True, None)
+    proceed, _ = over_request_budget(engine, 2000)
+    assert not proceed
+
+
+def test_request_budget_without_cheap_model_stops(request_budget):
+    proceed, msg = over_request_budget(FakeEngine(None), 1000)
+    assert not proceed and "no se hacen mas intentos" in msg
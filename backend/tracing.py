@@ -0,0 +1,177 @@
+import json
+import logging
+import logging.handlers
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from logs import DroppingQueueHandler, get_logger, queued
+from storage import data_path
+
+log = get_logger("tracing")
+
+
+# === TRAZAS POR PETICION ===
+# Cada /generate-exam tiene un trace id (cabecera X-Trace-Id y campo en cada
+# evento SSE). Los spans (intentos por motor/modelo/llave, esperas, parseo...)
+# se escriben al terminar la peticion en un JSONL rotativo con la forma de
+# OTLP/JSON (una ExportTraceServiceRequest por linea, como el file exporter
+# del OpenTelemetry Collector), para reconstruir incidentes offline. Como los
+# logs, la traza solo se encola: la serializacion, la escritura y la rotacion
+# del fichero ocurren en el hilo de un QueueListener, fuera del event loop.
+
+SERVICE_NAME = "simulador-tai-backend"
+TRACE_FILE = "traces/traces.jsonl"
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUPS = 5
+
+# W3C traceparent: version-traceid-spanid-flags
+_RE_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$")
+
+# Codigos de estado OTLP
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_trace_logger = None
+_trace_lock = threading.Lock()
+
+
+class _OtlpFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False)
+
+
+class _TraceQueueHandler(DroppingQueueHandler):
+    """Encola el dict de la traza tal cual: se serializa en el hilo escritor."""
+
+    def prepare(self, record):
+        if self.dropped:
+            log.warning("Trazas descartadas: cola llena", count=self.dropped)
+            self.dropped = 0
+        return record
+
+
+def _get_trace_logger():
+    global _trace_logger
+    with _trace_lock:
+        if _trace_logger is None:
+            logger = logging.getLogger("simulador.traces")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(
+                data_path(TRACE_FILE), maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, encoding="utf-8"
+            )
+            handler.setFormatter(_OtlpFormatter())
+            logger.addHandler(queued(handler, _TraceQueueHandler)[0])
+            _trace_logger = logger
+    return _trace_logger
+
+
+def _attr_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def trace_id_from_header(traceparent):
+    """Reutiliza el trace id de una cabecera traceparent valida."""
+    m = _RE_TRACEPARENT.match((traceparent or "").strip().lower())
+    return m.group(1) if m else None
+
+
+class Span:
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def error(self, exc):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(exc).__name__}: {str(exc)[:200]}"
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": k, "value": _attr_value(v)} for k, v in self.attributes.items() if v is not None],
+            "status": {"code": self.status, "message": self.status_message} if self.status_message else {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """Traza de una peticion: span raiz + spans hijos, volcados al final."""
+
+    def __init__(self, name, trace_id=None, **attributes):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans = []
+        self.root = self._new_span(name, None, attributes)
+        self._finished = False
+
+    def _new_span(self, name, parent, attributes):
+        span = Span(self, name, parent.span_id if parent else None, attributes)
+        self.spans.append(span)
+        return span
+
+    def start_span(self, name, parent=None, **attributes):
+        """Span hijo sin context manager (hay que llamar a span.end())."""
+        return self._new_span(name, parent or self.root, attributes)
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Span hijo de `parent` (por defecto el raiz); marca error si hay excepcion."""
+        span = self._new_span(name, parent or self.root, attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.error(e)
+            raise
+        finally:
+            span.end()
+
+    def finish(self, error=None):
+        """Cierra el span raiz y escribe la traza completa (una sola vez)."""
+        if self._finished:
+            return
+        self._finished = True
+        if error is not None:
+            self.root.error(error)
+        self.root.end()
+        record = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{
+                    "scope": {"name": "simulador.tracing"},
+                    "spans": [s.to_otlp() for s in self.spans],
+                }],
+            }]
+        }
+        try:
+            _get_trace_logger().info(record)
+        except OSError as e:
+            log.error("No se pudo abrir el fichero de trazas", trace_id=self.trace_id, error=str(e))
@@ -0,0 +1,255 @@
+import atexit
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+from budget import estimate_cost, estimate_tokens
+from logs import get_logger
+from metrics import BUDGET_EVENTS, COST_USD, DAILY_TOKENS, TOKENS
+from storage import data_path
+
+log = get_logger("usage")
+
+
+# === CONSUMO DE TOKENS Y COSTE ===
+# Cada intento contra un motor (tambien los fallidos y los del condensado)
+# anota los tokens que declara la respuesta: usage_metadata en Gemini,
+# usage en Groq, prompt_eval_count/eval_count en Ollama. Si la respuesta no
+# los trae se estiman (budget.estimate_tokens) y si no hubo respuesta (HTTP
+# 429, timeout) el intento cuenta con 0 tokens.
+# record() solo acumula en memoria; un hilo vuelca lo pendiente cada
+# USAGE_FLUSH_SECONDS (y al salir) en DATA_DIR/usage.sqlite3, por dia y
+# (motor, modelo, llave, modo). El volcado es un UPSERT que suma dentro de
+# una transaccion, asi que varios procesos (web y workers) pueden escribir
+# a la vez sin perder intentos; de paso relee el total del dia, que incluye
+# lo que han gastado los demas procesos.
+#
+# Presupuestos opcionales (0 = sin limite), en tokens de entrada + salida:
+#   - REQUEST_TOKEN_BUDGET: por examen, sumando reintentos y reemplazos
+#   - DAILY_TOKEN_BUDGET: por dia natural, solo motores de BUDGET_ENGINES
+# BUDGET_ACTION decide que pasa al superarlos: "downshift" pasa al modelo
+# barato del motor (budget_model; si no tiene, se rechaza) y "reject" corta
+# los intentos / rechaza el examen con 429.
+
+USAGE_DB = "usage.sqlite3"
+USAGE_HISTORY_DAYS = 30
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "2"))
+REQUEST_TOKEN_BUDGET = int(os.getenv("REQUEST_TOKEN_BUDGET", "0"))
+DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", "0"))
+BUDGET_ACTION = os.getenv("BUDGET_ACTION", "downshift")
+# Ollama local no cuesta: por defecto no consume presupuesto diario
+BUDGET_ENGINES = [name.strip() for name in os.getenv("BUDGET_ENGINES", "gemini,groq").split(",") if name.strip()]
+# Con "downshift" el examen puede seguir hasta este multiplo del presupuesto por peticion
+DOWNSHIFT_REQUEST_FACTOR = 2
+
+_KEYS = ("engine", "model", "key", "mode")
+_FIELDS = ("attempts", "failed", "prompt_tokens", "output_tokens", "wasted_tokens", "cost_usd")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    model TEXT NOT NULL,
+    key TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    wasted_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, engine, model, key, mode)
+);
+"""
+
+_UPSERT = (
+    f"INSERT INTO usage (day, {', '.join(_KEYS)}, {', '.join(_FIELDS)}) "
+    f"VALUES ({', '.join('?' * (1 + len(_KEYS) + len(_FIELDS)))}) "
+    f"ON CONFLICT (day, {', '.join(_KEYS)}) DO UPDATE SET "
+    + ", ".join(f"{field} = {field} + excluded.{field}" for field in _FIELDS)
+)
+
+
+@dataclass(slots=True)
+class Usage:
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    estimated: bool = False
+
+    @property
+    def total(self):
+        return self.prompt_tokens + self.output_tokens
+
+
+def attempt_usage(provider, prompt, raw_text):
+    """Uso declarado por el transporte en el ultimo intento, o estimado si no lo hay."""
+    if provider.usage is not None:
+        return provider.usage
+    if raw_text is None:
+        return Usage()
+    return Usage(estimate_tokens(prompt), estimate_tokens(raw_text), estimated=True)
+
+
+def seconds_until_tomorrow():
+    now = datetime.now()
+    return int((datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds()) + 1
+
+
+class UsageLedger:
+    def __init__(self, filename=USAGE_DB, flush_interval=USAGE_FLUSH_SECONDS):
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(data_path(filename), check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        # day -> (motor, modelo, llave, modo) -> deltas aun sin volcar
+        self._pending = {}
+        # (dia, tokens en disco de BUDGET_ENGINES) segun el ultimo volcado
+        self._daily = (None, 0)
+        self.flush()
+        self._stop = threading.Event()
+        if flush_interval > 0:
+            threading.Thread(target=self._flush_loop, args=(flush_interval,), name="usage-flush", daemon=True).start()
+            atexit.register(self.close)
+
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning("No se pudo volcar el consumo", error=f"{type(e).__name__}: {e}")
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def record(self, engine, model, key, mode, usage, ok, purpose="exam"):
+        """Anota un intento (en memoria, sin E/S); devuelve su coste estimado en USD."""
+        cost = estimate_cost(engine, model, usage.prompt_tokens, usage.output_tokens)
+        outcome = "ok" if ok else "failed"
+        labels = {"engine": engine, "model": model, "key": key, "mode": mode}
+        TOKENS.inc(usage.prompt_tokens, kind="prompt", outcome=outcome, purpose=purpose, **labels)
+        TOKENS.inc(usage.output_tokens, kind="output", outcome=outcome, purpose=purpose, **labels)
+        COST_USD.inc(cost, **labels)
+        delta = {"attempts": 1, "failed": 0 if ok else 1, "prompt_tokens": usage.prompt_tokens,
+                 "output_tokens": usage.output_tokens, "wasted_tokens": 0 if ok else usage.total, "cost_usd": cost}
+        row_key = tuple(value or "" for value in (engine, model, key, mode))
+        with self._lock:
+            row = self._pending.setdefault(date.today().isoformat(), {}).setdefault(row_key, dict.fromkeys(_FIELDS, 0))
+            for field, value in delta.items():
+                row[field] += value
+        return cost
+
+    def flush(self):
+        """
+        Suma lo pendiente a la base (una transaccion, atomica frente a otros
+        procesos) y relee de ella el total de hoy. Bloqueante: se llama desde
+        el hilo de volcado, no desde el event loop.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        today = date.today().isoformat()
+        rows = [(day, *row_key, *(delta[field] for field in _FIELDS))
+                for day, day_rows in pending.items() for row_key, delta in day_rows.items()]
+        placeholders = ", ".join("?" * len(BUDGET_ENGINES))
+        with self._db_lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(_UPSERT, rows)
+                cutoff = (date.today() - timedelta(days=USAGE_HISTORY_DAYS)).isoformat()
+                self._conn.execute("DELETE FROM usage WHERE day < ?", (cutoff,))
+                tokens = self._conn.execute(
+                    f"SELECT COALESCE(SUM(prompt_tokens + output_tokens), 0) FROM usage "
+                    f"WHERE day = ? AND engine IN ({placeholders})", (today, *BUDGET_ENGINES)).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                self._requeue(pending)
+                raise
+        with self._lock:
+            self._daily = (today, tokens)
+        DAILY_TOKENS.set(self.daily_tokens())
+
+    def _requeue(self, pending):
+        """Devuelve a memoria lo que no se pudo volcar (se reintenta en el siguiente volcado)."""
+        with self._lock:
+            for day, day_rows in pending.items():
+                for row_key, delta in day_rows.items():
+                    row = self._pending.setdefault(day, {}).setdefault(row_key, dict.fromkeys(_FIELDS, 0))
+                    for field, value in delta.items():
+                        row[field] += value
+
+    def daily_tokens(self):
+        """Tokens de hoy en los motores que cuentan para el presupuesto diario (sin E/S)."""
+        today = date.today().isoformat()
+        with self._lock:
+            day, tokens = self._daily
+            if day != today:
+                tokens = 0
+            for row_key, delta in self._pending.get(today, {}).items():
+                if row_key[0] in BUDGET_ENGINES:
+                    tokens += delta["prompt_tokens"] + delta["output_tokens"]
+        return tokens
+
+    def daily_exceeded(self, engines):
+        """True si hay presupuesto diario, se ha agotado y alguno de `engines` cuenta para el."""
+        if not DAILY_TOKEN_BUDGET or not any(name in BUDGET_ENGINES for name in engines):
+            return False
+        return self.daily_tokens() >= DAILY_TOKEN_BUDGET
+
+    def snapshot(self, days=7):
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT day, {', '.join(_KEYS)}, {', '.join(_FIELDS)} FROM usage "
+                f"WHERE day IN (SELECT DISTINCT day FROM usage ORDER BY day DESC LIMIT ?) "
+                f"ORDER BY day DESC, {', '.join(_KEYS)}", (days,)).fetchall()
+        by_day = {}
+        for row in rows:
+            item = dict(zip(_KEYS + _FIELDS, row[1:]))
+            item["cost_usd"] = round(item["cost_usd"], 6)
+            by_day.setdefault(row[0], []).append(item)
+        result = []
+        for day, items in by_day.items():
+            totals = {f: sum(r[f] for r in items) for f in _FIELDS}
+            totals["cost_usd"] = round(totals["cost_usd"], 6)
+            result.append({"day": day, "totals": totals, "rows": items})
+        return {
+            "budgets": {
+                "request_tokens": REQUEST_TOKEN_BUDGET or None,
+                "daily_tokens": DAILY_TOKEN_BUDGET or None,
+                "daily_used": self.daily_tokens(),
+                "action": BUDGET_ACTION,
+                "engines": BUDGET_ENGINES,
+            },
+            "days": result,
+        }
+
+
+def request_limit(engine):
+    """Tope de tokens por examen en este momento (0 = sin tope)."""
+    if not REQUEST_TOKEN_BUDGET:
+        return 0
+    return REQUEST_TOKEN_BUDGET * (DOWNSHIFT_REQUEST_FACTOR if engine.downshifted else 1)
+
+
+def over_request_budget(engine, spent):
+    """
+    Comprueba el presupuesto por examen antes de un intento. Devuelve
+    (seguir, mensaje): con "downshift" el primer exceso pasa al modelo barato.
+    """
+    limit = request_limit(engine)
+    if not limit or spent < limit:
+        return True, None
+    if BUDGET_ACTION == "downshift" and not engine.downshifted and engine.downshift():
+        BUDGET_EVENTS.inc(scope="request", action="downshift")
+        return True, (f"[PRESUPUESTO] {spent} tokens gastados (limite {REQUEST_TOKEN_BUDGET} por examen): "
+                      f"se sigue con el modelo barato.")
+    BUDGET_EVENTS.inc(scope="request", action="reject")
+    return False, f"[PRESUPUESTO] {spent} tokens gastados (limite {limit} por examen): no se hacen mas intentos."
+
+
+usage_ledger = UsageLedger()
@@ -0,0 +1,136 @@
+"""
+Workers de generacion fuera del proceso web (JOB_MODE=queue).
+
+El backend solo encola los trabajos de POST /jobs en DATA_DIR/jobs.sqlite3;
+estos procesos los reservan, ejecutan la generacion completa (lectura del
+PDF, condensado, llamadas al motor, validacion) y escriben los eventos en el
+mismo store, de donde los lee /jobs/{id}/events. Los limites por motor
+(ENGINE_CONCURRENCY) valen para todos los workers juntos: cada llamada
+reserva su hueco en el mismo jobs.sqlite3 (jobs.SharedEngineSlots).
+
+Uso (desde backend/):
+    JOB_MODE=queue uvicorn main:app --port 8000
+    python worker.py --processes 4 --concurrency 2
+
+En otra maquina basta con apuntar SIMULADOR_DATA_DIR al mismo directorio
+(un sistema de ficheros compartido con bloqueos POSIX; SQLite en WAL no
+funciona sobre todos los NFS) y tener las mismas claves de API y carpetas
+de temas.
+"""
+import argparse
+import asyncio
+import io
+import multiprocessing
+import os
+import signal
+
+# Antes de importar jobs: un worker no cierra los trabajos del proceso web
+os.environ["SIMULADOR_WORKER"] = "1"
+
+from starlette.datastructures import UploadFile  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+from jobs import JOB_LEASE_SECONDS, job_store, run_job, worker_name  # noqa: E402
+from logs import get_logger  # noqa: E402
+from main import prepare_exam  # noqa: E402
+from tracing import Trace  # noqa: E402
+
+log = get_logger("worker")
+
+POLL_SECONDS = 1.0
+
+
+async def execute(job_id, inputs, file_name, file_data, worker):
+    """Ejecuta un trabajo reservado renovando la reserva; cancela si lo piden."""
+    client_host = inputs.pop("client_host", None)
+    job = job_store.get(job_id)
+    trace = Trace("generate-exam.worker", trace_id=job["trace_id"] if job else None, engine=inputs["ai_engine"],
+                  mode=inputs["mode"], num_questions=inputs["num_questions"], worker=worker,
+                  **{"client.address": client_host, "job.id": job_id})
+    upload = UploadFile(io.BytesIO(file_data), filename=file_name) if file_name is not None else None
+    seq = job_store.next_seq(job_id)
+    try:
+        stream = await prepare_exam(trace, client_host, file=upload, **inputs)
+    except Exception as e:
+        # p.ej. cola del motor llena en este worker (HTTPException 503): se informa, no se reintenta
+        trace.finish(e)
+        job_store.interrupt(job_id, e.detail if isinstance(e, HTTPException) else f"{type(e).__name__}: {e}")
+        return
+
+    task = asyncio.create_task(run_job(job_id, stream, on_finish=trace.finish, seq=seq))
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=JOB_LEASE_SECONDS / 3)
+            if not task.done() and job_store.renew(job_id, worker):
+                log.info("Cancelacion pedida: se detiene el trabajo", job_id=job_id)
+                task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        job_store.dequeue(job_id)
+
+
+async def serve(concurrency, stop):
+    worker = worker_name()
+    running = set()
+    log.info("Worker listo", worker=worker, concurrency=concurrency)
+    while not stop.is_set():
+        job_store.reap_expired()
+        while len(running) < concurrency and not stop.is_set():
+            claimed = job_store.claim(worker)
+            if not claimed:
+                break
+            job_id, inputs, file_name, file_data = claimed
+            log.info("Trabajo reservado", job_id=job_id, worker=worker, engine=inputs.get("ai_engine"))
+            task = asyncio.create_task(execute(job_id, inputs, file_name, file_data, worker))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        try:
+            await asyncio.wait_for(stop.wait(), POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+    # Apagado: los trabajos en curso se cierran como interrumpidos (run_job escribe [DONE])
+    for task in list(running):
+        task.cancel()
+    await asyncio.gather(*running, return_exceptions=True)
+    log.info("Worker detenido", worker=worker)
+
+
+def run_process(concurrency):
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await serve(concurrency, stop)
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Workers de generacion para JOB_MODE=queue")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("JOB_WORKER_PROCESSES", "1")),
+                        help="procesos worker en esta maquina")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_WORKER_CONCURRENCY", "2")),
+                        help="trabajos simultaneos por proceso")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_process(args.concurrency)
+        return
+    # Un proceso por nucleo: el parseo y la extraccion de PDFs no comparten GIL.
+    # "spawn": cada hijo abre su propia conexion SQLite y su hilo de logs.
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_process, args=(args.concurrency,)) for _ in range(args.processes)]
+    for p in processes:
+        p.start()
+    # SIGTERM al padre se reenvia a los hijos (Ctrl+C ya les llega a todos)
+    signal.signal(signal.SIGTERM, lambda *_: [p.terminate() for p in processes if p.is_alive()])
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()
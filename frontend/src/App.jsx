@@ -22,11 +22,17 @@ function App() {
   const [lastContext, setLastContext] = useState(null);
   const terminalEndRef = useRef(null);
 
-  // Load lastContext from localStorage
+  // Load lastContext from localStorage: {id, name, preview} of the server-side context.
+  // Older versions stored the full text; it is sent once more and replaced by its id.
   useEffect(() => {
     const savedContext = localStorage.getItem("lastContext");
     if (savedContext) {
-      setLastContext(savedContext);
+      try {
+        const parsed = JSON.parse(savedContext);
+        setLastContext(parsed && parsed.id ? parsed : { text: savedContext });
+      } catch {
+        setLastContext({ text: savedContext });
+      }
     }
   }, []);
 
@@ -42,7 +48,152 @@ function App() {
     setTerminalLogs(prev => [...prev, `[${timestamp}] ${msg}`]);
   };
 
-  // Generate Exam (SSE Streaming)
+  // Apply one SSE payload; returns the question batch it carried (or [])
+  const handleEvent = (payload) => {
+    if (payload === "[DONE]") {
+      addLog("Stream finalizado.");
+      return [];
+    }
+    try {
+      const parsed = JSON.parse(payload);
+
+      // Log event from backend
+      if (parsed && parsed.type === "log") {
+        addLog(parsed.msg);
+        return [];
+      }
+
+      // Context update event (only the id and a preview; the text stays on the server)
+      if (parsed && parsed.type === "context") {
+        if (parsed.id) {
+          const newContext = { id: parsed.id, name: parsed.name, chars: parsed.chars, preview: parsed.preview };
+          setLastContext(newContext);
+          localStorage.setItem("lastContext", JSON.stringify(newContext));
+          addLog(`Contexto guardado: ${parsed.name || parsed.id.slice(0, 12)} (${parsed.chars} caracteres).`);
+        }
+        return [];
+      }
+
+      // Question batch
+      if (!Array.isArray(parsed)) {
+        addLog(`[WARN] Respuesta no es array: ${payload.slice(0, 200)}`);
+        setDebugInfo(prev => (prev || "") + "\n[NOT ARRAY] " + payload.slice(0, 500));
+        return [];
+      }
+      return parsed;
+    } catch (e) {
+      addLog(`[ERROR] Parse JSON falló: ${payload.slice(0, 100)}`);
+      setDebugInfo(prev => (prev || "") + "\n[PARSE ERROR] " + payload.slice(0, 500));
+      return [];
+    }
+  };
+
+  // Read a job's event stream, reconnecting with Last-Event-ID if the connection drops
+  const streamJob = async (jobId) => {
+    let allQuestions = [];
+    let lastEventId = null;
+    let finished = false;
+    let failures = 0;
+
+    while (!finished) {
+      try {
+        const headers = lastEventId ? { "Last-Event-ID": lastEventId } : {};
+        const res = await fetch(`${API_URL}/jobs/${jobId}/events`, { headers });
+        if (res.status === 404) {
+          throw new Error("El trabajo ya no existe en el servidor");
+        }
+        if (!res.ok) {
+          throw new Error(`Error del servidor (${res.status})`);
+        }
+
+        // === SSE STREAM READER ===
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+
+          buffer += decoder.decode(value, { stream: true });
+
+          // Parse SSE events (format: "id: <trace>-<seq>\ndata: <json>\n\n")
+          const parts = buffer.split("\n\n");
+          buffer = parts.pop(); // Keep incomplete part in buffer
+
+          for (const part of parts) {
+            const lines = part.split("\n");
+            const idLine = lines.find(line => line.startsWith("id: "));
+            const dataLine = lines.find(line => line.startsWith("data: "));
+            if (idLine) lastEventId = idLine.slice(4).trim();
+            if (!dataLine) continue; // keep-alive comment
+            const payload = dataLine.slice(6).trim();
+            if (payload === "[DONE]") finished = true;
+            const batch = handleEvent(payload);
+            if (batch.length > 0) {
+              allQuestions = [...allQuestions, ...batch];
+              setStreamProgress(allQuestions.length);
+            }
+          }
+        }
+        failures = 0;
+      } catch (error) {
+        if (error.message.startsWith("El trabajo")) throw error;
+        failures += 1;
+        if (failures > 5) throw error;
+      }
+      if (!finished) {
+        addLog("Conexión interrumpida. Reanudando...");
+        await new Promise(resolve => setTimeout(resolve, 2000));
+      }
+    }
+    return allQuestions;
+  };
+
+  // Follow a generation job to the end (also used to resume after a reload)
+  const runJob = async (jobId) => {
+    try {
+      const allQuestions = await streamJob(jobId);
+
+      if (allQuestions.length > 0) {
+        setQuestions(allQuestions);
+        setAnswers(allQuestions.map(q => ({
+          questionId: q.id,
+          selectedOption: null,
+          isCorrect: false,
+          answered: false
+        })));
+        setCurrentQuestionIndex(0);
+        setGameState("playing");
+      } else {
+        setDebugInfo(prev => prev || "El servidor no devolvió preguntas. Revisa la API Key o intenta de nuevo.");
+        setGameState("start");
+      }
+    } catch (error) {
+      console.error("Failed to generate exam:", error);
+      addLog(`❌ Error fatal: ${error.message || "Error de conexión"}`);
+      setDebugInfo(prev => (prev || "") + "\n[ERROR] " + (error.message || "Error de conexión"));
+      setGameState("start");
+    } finally {
+      localStorage.removeItem("pendingJob");
+      setLoading(false);
+      setStreamProgress(0);
+    }
+  };
+
+  // Resume a generation that was running when the page was reloaded
+  useEffect(() => {
+    const pendingJob = localStorage.getItem("pendingJob");
+    if (pendingJob) {
+      setLoading(true);
+      setGameState("generating");
+      addLog("Reanudando generación en curso...");
+      runJob(pendingJob);
+    }
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, []);
+
+  // Generate Exam (background job + SSE Streaming)
   const handleStartExam = async (settings) => {
     setConfig(settings);
     setLoading(true);
@@ -62,111 +213,59 @@ function App() {
       formData.append("topic", settings.topic);
     }
 
+    // Optional fact-sheet condensation ("local" | "engine")
+    if (settings.condense) {
+      formData.append("condense", settings.condense);
+    }
+
+    // Ask the server to prepare the next exam while this one is taken
+    if (settings.prefetch) {
+      formData.append("prefetch", "true");
+    }
+
     // Directory handling (Random or Simulacro)
     if (settings.directory_path) {
       formData.append("directory_path", settings.directory_path);
       addLog(`[MODO ${settings.mode.toUpperCase()}] Carpeta: ${settings.directory_path}`);
     } else if (settings.file) {
       formData.append("file", settings.file);
-    } else if ((settings.context || lastContext) && !settings.topic) {
+    } else if (settings.context && !settings.topic) {
+      formData.append("context", settings.context);
+    } else if (lastContext && !settings.topic) {
       // Use existing context ONLY if no new topic/file/folder
-      formData.append("context", settings.context || lastContext);
+      if (lastContext.id) {
+        formData.append("context_id", lastContext.id);
+      } else {
+        formData.append("context", lastContext.text);
+      }
       addLog("Usando contexto previo de memoria...");
     }
 
     try {
-      const res = await fetch(`${API_URL}/generate-exam`, {
+      const res = await fetch(`${API_URL}/jobs`, {
         method: "POST",
         body: formData,
       });
 
       if (!res.ok) {
         const errData = await res.json().catch(() => ({}));
-        throw new Error(errData.detail || `Error del servidor (${res.status})`);
-      }
-
-      // === SSE STREAM READER ===
-      const reader = res.body.getReader();
-      const decoder = new TextDecoder();
-      let allQuestions = [];
-      let buffer = "";
-
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-
-        buffer += decoder.decode(value, { stream: true });
-
-        // Parse SSE lines (format: "data: <json>\n\n")
-        const parts = buffer.split("\n\n");
-        buffer = parts.pop(); // Keep incomplete part in buffer
-
-        for (const part of parts) {
-          const trimmed = part.trim();
-          if (trimmed.startsWith("data: ")) {
-            const payload = trimmed.slice(6);
-            if (payload === "[DONE]") {
-              addLog("Stream finalizado.");
-              continue;
-            }
-            try {
-              const parsed = JSON.parse(payload);
-
-              // Log event from backend
-              if (parsed && parsed.type === "log") {
-                addLog(parsed.msg);
-                continue;
-              }
-
-              // Context update event
-              if (parsed && parsed.type === "context") {
-                const newContext = parsed.content;
-                if (newContext) {
-                  setLastContext(newContext);
-                  localStorage.setItem("lastContext", newContext);
-                  addLog("Contexto actualizado y guardado.");
-                }
-                continue;
-              }
-
-              // Question batch
-              if (!Array.isArray(parsed)) {
-                addLog(`[WARN] Respuesta no es array: ${payload.slice(0, 200)}`);
-                setDebugInfo(prev => (prev || "") + "\n[NOT ARRAY] " + payload.slice(0, 500));
-                continue;
-              }
-              allQuestions = [...allQuestions, ...parsed];
-              setStreamProgress(allQuestions.length);
-            } catch (e) {
-              addLog(`[ERROR] Parse JSON falló: ${payload.slice(0, 100)}`);
-              setDebugInfo(prev => (prev || "") + "\n[PARSE ERROR] " + payload.slice(0, 500));
-            }
-          }
+        if (res.status === 404 && formData.has("context_id")) {
+          // The server no longer has that context: forget it
+          setLastContext(null);
+          localStorage.removeItem("lastContext");
         }
+        throw new Error(errData.detail || `Error del servidor (${res.status})`);
       }
 
-      if (allQuestions.length > 0) {
-        setQuestions(allQuestions);
-        setAnswers(allQuestions.map(q => ({
-          questionId: q.id,
-          selectedOption: null,
-          isCorrect: false,
-          answered: false
-        })));
-        setCurrentQuestionIndex(0);
-        setGameState("playing");
-      } else {
-        setDebugInfo(prev => prev || "El servidor no devolvió preguntas. Revisa la API Key o intenta de nuevo.");
-        setGameState("start");
-      }
+      const { job_id: jobId } = await res.json();
+      localStorage.setItem("pendingJob", jobId);
+      await runJob(jobId);
     } catch (error) {
       console.error("Failed to generate exam:", error);
       addLog(`❌ Error fatal: ${error.message || "Error de conexión"}`);
       setDebugInfo(prev => (prev || "") + "\n[ERROR] " + (error.message || "Error de conexión"));
       setGameState("start");
-    } finally {
       setLoading(false);
-      setStreamProgress(0);
     }
   };
 
@@ -1,6 +1,6 @@
 import { useState } from 'react';
 import { motion } from 'framer-motion';
-import { Play, Settings2, BookOpen, BarChart, FolderOpen, Dice5, Zap, Server, CloudLightning } from 'lucide-react';
+import { Play, Settings2, BookOpen, BarChart, FolderOpen, Dice5, Zap, Server, CloudLightning, Shuffle } from 'lucide-react';
 import UploadZone from './UploadZone';
 
 export default function StartScreen({ onStart }) {
@@ -11,7 +11,8 @@ export default function StartScreen({ onStart }) {
     const [difficulty, setDifficulty] = useState("Experto");
     const [examMode, setExamMode] = useState('manual'); // 'manual' | 'random_1' | 'simulacro_3'
     const [folderPath, setFolderPath] = useState("");
-    const [aiEngine, setAiEngine] = useState("gemini"); // "gemini" | "ollama" | "groq"
+    const [aiEngine, setAiEngine] = useState("gemini"); // "gemini" | "ollama" | "groq" | "auto"
+    const [prefetch, setPrefetch] = useState(false); // pregenerar el siguiente examen (ruleta/simulacro)
 
     const handleStart = () => {
         onStart({
@@ -22,7 +23,8 @@ export default function StartScreen({ onStart }) {
             difficulty,
             mode: examMode,
             directory_path: (examMode === 'random_1' || examMode === 'simulacro_3') ? folderPath : null,
-            aiEngine
+            aiEngine,
+            prefetch: (examMode === 'random_1' || examMode === 'simulacro_3') && prefetch
         });
     };
 
@@ -164,6 +166,19 @@ export default function StartScreen({ onStart }) {
                                     <FolderOpen className="w-4 h-4" />
                                     {folderPath ? 'Cambiar Carpeta' : 'Seleccionar Carpeta'}
                                 </button>
+
+                                <label
+                                    className="mt-4 flex items-center gap-2 text-xs text-slate-600 dark:text-slate-400 cursor-pointer select-none"
+                                    title="Mientras haces este examen, el servidor prepara el siguiente con los mismos ajustes"
+                                >
+                                    <input
+                                        type="checkbox"
+                                        checked={prefetch}
+                                        onChange={(e) => setPrefetch(e.target.checked)}
+                                        className={examMode === 'simulacro_3' ? 'accent-indigo-500' : 'accent-emerald-500'}
+                                    />
+                                    Pregenerar el siguiente examen
+                                </label>
                             </div>
                         )}
                     </div>
@@ -217,7 +232,7 @@ export default function StartScreen({ onStart }) {
                             <label className="block text-xs font-bold text-slate-400 uppercase tracking-widest mb-2">
                                 Motor AI
                             </label>
-                            <div className="grid grid-cols-3 gap-2 bg-slate-100 dark:bg-slate-800/50 p-1 rounded-xl">
+                            <div className="grid grid-cols-4 gap-2 bg-slate-100 dark:bg-slate-800/50 p-1 rounded-xl">
                                 <button
                                     onClick={() => setAiEngine('gemini')}
                                     className={`flex items-center justify-center py-2 px-1 rounded-lg text-xs font-bold transition-all gap-1.5 ${aiEngine === 'gemini'
@@ -250,6 +265,17 @@ export default function StartScreen({ onStart }) {
                                     <CloudLightning className="w-3.5 h-3.5" />
                                     <span>Groq Cloud</span>
                                 </button>
+                                <button
+                                    onClick={() => setAiEngine('auto')}
+                                    title="El servidor elige el motor más rápido disponible y cambia de motor si uno falla"
+                                    className={`flex items-center justify-center py-2 px-1 rounded-lg text-xs font-bold transition-all gap-1.5 ${aiEngine === 'auto'
+                                            ? 'bg-white dark:bg-slate-700 shadow text-emerald-600 dark:text-emerald-400 ring-1 ring-black/5 dark:ring-white/10'
+                                            : 'text-slate-500 hover:text-slate-700 dark:hover:text-slate-300 hover:bg-slate-200/50 dark:hover:bg-slate-700/50'
+                                        }`}
+                                >
+                                    <Shuffle className="w-3.5 h-3.5" />
+                                    <span>Auto</span>
+                                </button>
                             </div>
                         </div>
 